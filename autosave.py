@@ -0,0 +1,420 @@
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import chunking
+import database
+import llm_client
+import profiler
+
+# 一次保存请求。silent 为 False 表示用户主动点击了保存，出错时需要提示。
+PromptSnapshot = namedtuple('PromptSnapshot', 'prompt_id title content tags silent seq')
+
+_seq = itertools.count(1)
+
+# 恢复日志是追加写入的 JSON Lines；行数超过该值且超过存活条目数的两倍时整体重写
+JOURNAL_COMPACT_MIN_LINES = 64
+
+
+def make_snapshot(prompt_id, title, content, tags, silent=True):
+    return PromptSnapshot(prompt_id, title, content, tuple(tags), silent, next(_seq))
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def embedding_hash(text):
+    """只对影响语义的内容求哈希：忽略首尾和连续空白的差异，避免无意义的重新向量化。"""
+    return content_hash(' '.join(text.split()))
+
+
+def _user_data_dir():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.environ.get('APPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'PromptManager')
+
+
+def default_journal_path():
+    """恢复日志放在当前用户本机的数据目录中（可用 PROMPT_MANAGER_DATA_DIR 指定），
+    多人共用一个数据库时各自只恢复自己的更改；文件名包含数据库路径的哈希，打开不同的库互不干扰。"""
+    directory = os.environ.get('PROMPT_MANAGER_DATA_DIR') or _user_data_dir()
+    os.makedirs(directory, exist_ok=True)
+    key = content_hash(os.path.abspath(database.DATABASE_PATH))[:12]
+    return os.path.join(directory, f'autosave_journal_{key}.jsonl')
+
+
+class SaveResult:
+    __slots__ = ('prompt_id', 'silent', 'saved', 'embedded', 'error', 'conflict')
+
+    def __init__(self, prompt_id, silent, saved=False, embedded=False, error=None, conflict=False):
+        self.prompt_id = prompt_id
+        self.silent = silent
+        self.saved = saved
+        self.embedded = embedded
+        self.error = error
+        # 为 True 表示提示词已被其他进程修改，本次更改没有写入，仍保留在恢复日志中
+        self.conflict = conflict
+
+
+class AutoSaveEngine:
+    """后台自动保存引擎。
+
+    - 与上一次落盘的状态比较哈希，没有变化的保存直接跳过；
+    - 同一提示词排队中的多次保存只保留最新的一次；
+    - 写库和生成 embedding 都在后台写线程中完成，不阻塞界面；
+    - 只有内容在语义上发生变化时才重新生成 embedding；
+    - 以加载时的版本号写库，其他进程先改过时不覆盖，而是报告冲突；
+    - 提交的快照记入恢复日志，落盘后再移除，崩溃后可以恢复；日志由单独的线程追加写入磁盘，
+      界面线程只更新内存中的条目。
+    """
+
+    def __init__(self, journal_path=None, on_saved=None, embed_function=None):
+        self.journal_path = journal_path or default_journal_path()
+        self.on_saved = on_saved
+        # embed_function(content, model=模型名称) -> (文档向量, 分块向量列表)
+        self.embed_function = embed_function or chunking.embed_content
+        self._persisted = {}
+        self._pending = {}
+        # 恢复日志：内存中的存活条目、等待写入磁盘的提示词 ID，以及文件中已有的行数
+        self._journal = {}
+        # 日志条目所基于的版本号，恢复时据此检查冲突
+        self._journal_versions = {}
+        self._journal_dirty = {}
+        self._journal_reset = False
+        self._journal_lines = 0
+        self._journal_writing = False
+        self._journal_stopping = False
+        self._busy = False
+        # 写线程正在落盘的快照
+        self._in_flight = None
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._journal_cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='autosave-writer', daemon=True)
+        self._thread.start()
+        self._journal_thread = threading.Thread(target=self._run_journal, name='autosave-journal', daemon=True)
+        self._journal_thread.start()
+
+    # --- 状态跟踪 ---
+
+    def remember(self, prompt_id, title, content, tags, has_embedding=True, version=None):
+        """记录从数据库加载出来的（即已落盘的）状态。version 为 None 时保存不做冲突检查。
+
+        该提示词还有排队中或正在写入的保存时不记录并返回 False：此时读到的是旧版本，
+        保存完成后写线程会自行更新已落盘的状态。
+        """
+        with self._cond:
+            if self._outstanding_locked(prompt_id) is not None:
+                return False
+            self._persisted[prompt_id] = {
+                'title': title,
+                'content': content_hash(content),
+                'tags': tuple(tags),
+                'embedding': embedding_hash(content) if has_embedding else None,
+                'version': version,
+            }
+        return True
+
+    def pending_snapshot(self, prompt_id):
+        """返回该提示词尚未落盘的最新快照（排队中或正在写入），没有时返回 None。"""
+        with self._cond:
+            return self._outstanding_locked(prompt_id)
+
+    def _outstanding_locked(self, prompt_id):
+        queued = self._pending.get(prompt_id)
+        if queued is not None:
+            return queued
+        if self._in_flight is not None and self._in_flight.prompt_id == prompt_id:
+            return self._in_flight
+        return None
+
+    def restore(self, snapshot, version):
+        """提交从恢复日志中读出的快照，以日志记录的版本号为基准：其他人在此期间修改过时报告冲突，
+        而不是覆盖对方的修改。version 为 None（旧格式的日志）时不做冲突检查。"""
+        with self._cond:
+            if self._outstanding_locked(snapshot.prompt_id) is None:
+                self._persisted[snapshot.prompt_id] = {
+                    'title': None, 'content': None, 'tags': None, 'embedding': None, 'version': version,
+                }
+        return self.submit(snapshot, force=True)
+
+    def rebase(self, prompt_id, version):
+        """解决冲突时选择覆盖：把基准版本改为数据库中的当前版本，之后的保存会覆盖对方的修改。"""
+        with self._cond:
+            state = self._persisted.get(prompt_id)
+            if state is not None:
+                state['version'] = version
+
+    def forget(self, prompt_id):
+        """丢弃某个提示词的全部状态和排队中的保存（例如提示词被删除时）。"""
+        with self._cond:
+            self._persisted.pop(prompt_id, None)
+            self._pending.pop(prompt_id, None)
+        self._remove_from_journal(prompt_id)
+
+    def has_changes(self, snapshot):
+        with self._cond:
+            return self._has_changes_locked(snapshot)
+
+    def _has_changes_locked(self, snapshot):
+        queued = self._pending.get(snapshot.prompt_id)
+        if queued is not None:
+            return (queued.title, queued.content, queued.tags) != (snapshot.title, snapshot.content, snapshot.tags)
+        state = self._persisted.get(snapshot.prompt_id)
+        if state is None:
+            return True
+        return (state['title'] != snapshot.title
+                or state['tags'] != snapshot.tags
+                or state['content'] != content_hash(snapshot.content))
+
+    def resolve_conflict(self, prompt_id, overwrite):
+        """处理保存冲突：overwrite 为 True 时以数据库当前版本为基准重新提交恢复日志中的更改，
+        否则丢弃本地更改。"""
+        if not overwrite:
+            self.forget(prompt_id)
+            return
+        with self._journal_cond:
+            snapshot = self._journal.get(prompt_id)
+        self.rebase(prompt_id, database.get_prompt_version(prompt_id))
+        if snapshot is not None:
+            self.submit(snapshot, force=True)
+
+    # --- 提交与等待 ---
+
+    def submit(self, snapshot, force=False):
+        """提交一次保存。没有任何变化时返回 False；force 为 True 时总是提交（例如补生成 embedding）。"""
+        with self._cond:
+            if not force and not self._has_changes_locked(snapshot):
+                profiler.increment('autosave.skipped')
+                return False
+            if snapshot.prompt_id in self._pending:
+                profiler.increment('autosave.coalesced')
+            state = self._persisted.get(snapshot.prompt_id)
+            self._write_journal_entry(snapshot, state.get('version') if state else None)
+            self._pending[snapshot.prompt_id] = snapshot
+            self._cond.notify_all()
+        return True
+
+    def flush(self, timeout=None):
+        """等待所有排队中的保存落盘、恢复日志写入磁盘。超时返回 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: not self._pending and not self._busy, timeout):
+                return False
+        return self.flush_journal(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def flush_journal(self, timeout=None):
+        """只等待恢复日志写入磁盘。超时返回 False。"""
+        with self._journal_cond:
+            return self._journal_cond.wait_for(
+                lambda: not self._journal_dirty and not self._journal_reset and not self._journal_writing, timeout)
+
+    def stop(self, timeout=None):
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._journal_cond:
+            self._journal_stopping = True
+            self._journal_cond.notify_all()
+        self._journal_thread.join(timeout)
+
+    # --- 后台写线程 ---
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._busy = False
+                self._in_flight = None
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if not self._pending:
+                    return
+                prompt_id = next(iter(self._pending))
+                snapshot = self._pending.pop(prompt_id)
+                self._in_flight = snapshot
+                self._busy = True
+            result = self._persist(snapshot)
+            if self.on_saved:
+                self.on_saved(result)
+
+    @profiler.timed('autosave.persist')
+    def _persist(self, snapshot):
+        result = SaveResult(snapshot.prompt_id, snapshot.silent)
+        with self._cond:
+            state = dict(self._persisted.get(snapshot.prompt_id) or {})
+        new_content_hash = content_hash(snapshot.content)
+        new_embedding_hash = embedding_hash(snapshot.content)
+        content_changed = state.get('content') != new_content_hash
+        tags_changed = state.get('tags') != snapshot.tags
+        needs_embedding = state.get('embedding') != new_embedding_hash
+
+        embedding, chunks = None, None
+        model = llm_client.get_embedding_model()
+        if needs_embedding and snapshot.content.strip():
+            try:
+                embedding, chunks = self.embed_function(snapshot.content, model=model)
+                result.embedded = True
+            except Exception as e:
+                result.error = e
+        try:
+            version = database.save_prompt_snapshot(
+                snapshot.prompt_id, snapshot.title,
+                content=snapshot.content if content_changed else None,
+                tags=list(snapshot.tags) if tags_changed else None,
+                embedding=embedding, update_embedding=needs_embedding, chunks=chunks,
+                expected_version=state.get('version'), embedding_model=model)
+        except database.ConflictError as e:
+            profiler.increment('autosave.conflicts')
+            result.error = e
+            result.conflict = True
+            return result
+        except Exception as e:
+            # 写库失败时保留恢复日志，下次启动时还能恢复
+            result.error = e
+            return result
+        saved = version is not None
+        result.saved = saved
+        if not needs_embedding or result.embedded or not snapshot.content.strip():
+            stored_embedding_hash = new_embedding_hash
+        else:
+            # 生成失败，下次保存时重试
+            stored_embedding_hash = None
+        with self._cond:
+            if saved:
+                self._persisted[snapshot.prompt_id] = {
+                    'title': snapshot.title,
+                    'content': new_content_hash,
+                    'tags': snapshot.tags,
+                    'embedding': stored_embedding_hash,
+                    'version': version,
+                }
+            else:
+                self._persisted.pop(snapshot.prompt_id, None)
+        self._remove_from_journal(snapshot.prompt_id, snapshot.seq, version)
+        return result
+
+    # --- 恢复日志 ---
+
+    def _write_journal_entry(self, snapshot, version):
+        with self._journal_cond:
+            self._journal[snapshot.prompt_id] = snapshot
+            self._journal_versions[snapshot.prompt_id] = version
+            self._mark_journal_dirty(snapshot.prompt_id)
+
+    def _remove_from_journal(self, prompt_id, seq=None, version=None):
+        """移除已落盘的条目。日志中已是更新的快照时不移除；若 version 给出了刚写入的版本号，
+        更新的快照此后以它为基准。"""
+        with self._journal_cond:
+            entry = self._journal.get(prompt_id)
+            if entry is None:
+                return
+            if seq is not None and entry.seq != seq:
+                if version is not None:
+                    self._journal_versions[prompt_id] = version
+                    self._mark_journal_dirty(prompt_id)
+                return
+            del self._journal[prompt_id]
+            self._journal_versions.pop(prompt_id, None)
+            self._mark_journal_dirty(prompt_id)
+
+    def _mark_journal_dirty(self, prompt_id):
+        self._journal_dirty[prompt_id] = True
+        self._journal_cond.notify_all()
+
+    def _run_journal(self):
+        while True:
+            with self._journal_cond:
+                self._journal_writing = False
+                self._journal_cond.notify_all()
+                self._journal_cond.wait_for(
+                    lambda: self._journal_dirty or self._journal_reset or self._journal_stopping)
+                if not self._journal_dirty and not self._journal_reset:
+                    return
+                # 同一提示词的多次修改只写最后一次
+                changes = [(prompt_id, self._journal.get(prompt_id), self._journal_versions.get(prompt_id))
+                           for prompt_id in self._journal_dirty]
+                self._journal_dirty = {}
+                rewrite = (self._journal_reset
+                           or self._journal_lines + len(changes) > max(JOURNAL_COMPACT_MIN_LINES,
+                                                                        2 * len(self._journal)))
+                live = ([(prompt_id, snapshot, self._journal_versions.get(prompt_id))
+                         for prompt_id, snapshot in self._journal.items()] if rewrite else None)
+                self._journal_reset = False
+                self._journal_writing = True
+            try:
+                if rewrite:
+                    self._rewrite_journal(live)
+                else:
+                    self._append_journal(changes)
+            except OSError:
+                # 写不了恢复日志不影响保存本身
+                profiler.increment('autosave.journal_errors')
+
+    @staticmethod
+    def _journal_line(prompt_id, snapshot, version):
+        if snapshot is None:
+            item = {'prompt_id': prompt_id, 'removed': True}
+        else:
+            item = {'prompt_id': prompt_id, 'title': snapshot.title, 'content': snapshot.content,
+                    'tags': list(snapshot.tags), 'version': version}
+        return json.dumps(item, ensure_ascii=False) + '\n'
+
+    @profiler.timed('autosave.journal_append')
+    def _append_journal(self, changes):
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.writelines(self._journal_line(*change) for change in changes)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_lines += len(changes)
+
+    @profiler.timed('autosave.journal_rewrite')
+    def _rewrite_journal(self, entries):
+        if not entries:
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._journal_lines = 0
+            return
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(self._journal_line(*entry) for entry in entries)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self._journal_lines = len(entries)
+
+    def recover(self):
+        """读取上次异常退出时残留的恢复日志，返回 [(未落盘的快照, 它所基于的版本号), ...]，
+        应通过 restore() 重新提交。"""
+        if not os.path.exists(self.journal_path):
+            return []
+        entries = {}
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 崩溃时最后一行可能只写了一半
+                        continue
+                    entries[item['prompt_id']] = None if item.get('removed') else item
+        except IOError:
+            return []
+        return [(make_snapshot(item['prompt_id'], item['title'], item['content'], item['tags']), item.get('version'))
+                for item in entries.values() if item is not None]
+
+    def discard_journal(self):
+        with self._journal_cond:
+            self._journal.clear()
+            self._journal_versions.clear()
+            self._journal_dirty = {}
+            self._journal_reset = True
+            self._journal_cond.notify_all()
@@ -0,0 +1,178 @@
+"""批量 AI 优化 / 生成。
+
+任务和每个提示词的处理状态保存在 batch_jobs / batch_job_items 表中，结果作为新的历史版本写入
+prompt_versions，不修改提示词当前的内容，可以在“查看历史”中比较后恢复。请求通过有上限的线程池
+并发发出，并由令牌桶限制速率；任务可以随时取消，异常退出后从未完成的条目继续。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import llm_client
+import profiler
+
+MODES = ('optimize', 'generate')
+DEFAULT_INSTRUCTIONS = "你是一个提示词工程专家。请优化以下提示词，使其更清晰、更强大、更通用。请直接返回优化后的提示词内容，无需任何解释。"
+DEFAULT_WORKERS = 4
+# 每秒请求数；大多数 API 的默认限额都能承受
+DEFAULT_RATE = 2.0
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 2.0
+
+
+class TokenBucket:
+    """令牌桶限速器：平均每秒 rate 个请求，最多允许 capacity 个突发请求。线程安全。"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop_event=None):
+        """取得一个令牌；等待期间 stop_event 被设置时返回 False。"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+def create_job(mode='optimize', prompt_ids=None, tag=None, instructions=None):
+    """按提示词 ID 列表或标签创建任务，返回任务 ID。"""
+    if mode not in MODES:
+        raise ValueError(f"未知的模式: {mode}")
+    ids = list(prompt_ids or [])
+    if tag:
+        ids.extend(database.get_prompt_ids_by_tag(tag))
+    ids = sorted(set(ids))
+    if not ids:
+        raise ValueError("没有选中任何提示词。")
+    if mode == 'optimize':
+        instructions = instructions or DEFAULT_INSTRUCTIONS
+    return database.create_batch_job(mode, instructions, ids)
+
+
+def _generate_requirement(item):
+    if not (item['content'] or '').strip():
+        return item['title']
+    return f"{item['title']}\n\n{item['content']}"
+
+
+def _call(job, item):
+    if job['mode'] == 'optimize':
+        return llm_client.optimize_prompt(item['content'], job['instructions'])
+    return llm_client.generate_prompt(_generate_requirement(item))
+
+
+@profiler.timed('batch_optimize.run_job')
+def run_job(job_id=None, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, retry_failed=False, progress=None,
+            stop_event=None):
+    """执行（或继续）任务，返回 (状态, 成功数, 失败数)。
+
+    状态为 'completed'，或 stop_event 被设置时的 'paused'（已发出的请求完成后返回，未处理的条目保持待处理）。
+    progress(已完成, 总数, prompt_id, 错误) 在每个条目处理后调用（可能来自工作线程）。
+    配置错误 (ValueError) 会中止整个任务并抛出。
+    """
+    job = database.get_batch_job(job_id)
+    if job is None:
+        raise ValueError("没有未完成的批量任务。")
+    job_id = job['id']
+    statuses = ('pending', 'failed') if retry_failed else ('pending',)
+    items = list(database.get_batch_job_items(job_id, statuses))
+    if job['status'] != 'running':
+        database.set_batch_job_status(job_id, 'running')
+
+    stop_event = stop_event or threading.Event()
+    bucket = TokenBucket(rate, capacity=workers)
+    lock = threading.Lock()
+    finished = job['done'] + (0 if retry_failed else job['failed'])
+    succeeded, failed, fatal = 0, 0, []
+    pending = iter(items)
+
+    def next_item():
+        with lock:
+            return next(pending, None)
+
+    def report(prompt_id, error):
+        nonlocal finished, succeeded, failed
+        with lock:
+            finished += 1
+            if error is None:
+                succeeded += 1
+            else:
+                failed += 1
+            done = finished
+        if progress:
+            progress(done, job['total'], prompt_id, error)
+
+    def process():
+        while not stop_event.is_set():
+            item = next_item()
+            if item is None:
+                return
+            if item['title'] is None:
+                database.fail_batch_job_item(job_id, item['prompt_id'], "提示词已被删除")
+                report(item['prompt_id'], "提示词已被删除")
+                continue
+            error = None
+            for attempt in range(MAX_ATTEMPTS):
+                if not bucket.acquire(stop_event):
+                    return
+                try:
+                    result = _call(job, item)
+                    break
+                except ValueError as e:
+                    # 配置错误，继续请求没有意义
+                    fatal.append(e)
+                    stop_event.set()
+                    return
+                except RuntimeError as e:
+                    error = str(e)
+                    profiler.increment('batch_optimize.retries')
+                    if attempt + 1 < MAX_ATTEMPTS and stop_event.wait(RETRY_BACKOFF * 2 ** attempt):
+                        return
+            else:
+                database.fail_batch_job_item(job_id, item['prompt_id'], error)
+                report(item['prompt_id'], error)
+                continue
+            if database.complete_batch_job_item(job_id, item['prompt_id'], result) is None:
+                report(item['prompt_id'], "提示词已被删除")
+            else:
+                report(item['prompt_id'], None)
+
+    def worker():
+        try:
+            process()
+        except BaseException:
+            # 例如数据库错误：让其他工作线程尽快停下，异常在下面重新抛出
+            stop_event.set()
+            raise
+
+    worker_count = max(1, min(workers, len(items)))
+    with ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix='batch-optimize') as executor:
+        futures = [executor.submit(worker) for _ in range(worker_count)]
+    for future in futures:
+        future.result()
+    if fatal:
+        raise fatal[0]
+    if stop_event.is_set() and database.get_batch_job(job_id)['pending']:
+        return 'paused', succeeded, failed
+    database.set_batch_job_status(job_id, 'completed')
+    return 'completed', succeeded, failed
+
+
+def cancel_job(job_id):
+    """标记任务为已取消，之后不会被自动继续（仍可通过 ID 显式继续）。"""
+    database.set_batch_job_status(job_id, 'cancelled')
@@ -0,0 +1,515 @@
+"""提示词列表的内存目录：按标题或标签筛选时不再查询数据库。
+
+每个提示词占一个槽位，ID、updated_at、标签引用都存放在 array 中，标签名只保存一份并以整数 ID 引用。
+updated_at 编码为与其文本排序一致的整数，结果顺序与 search_prompts 的 ORDER BY updated_at DESC, id DESC 相同。
+标题按单个字符和三字符片段 (trigram) 建立倒排索引：加载时用 NumPy 一次性排序生成 CSR 形式的
+（片段编码、偏移、槽位）三个数组，筛选时对查询的各片段的倒排表求交集，再逐个核对候选项。
+
+数据库中的触发器把每次写入涉及的提示词 ID 记入 prompt_changes。sync() 只在 PRAGMA data_version
+变化时读取新增的日志并重新加载这些提示词，因此其他进程的写入同样会被发现。修改或删除的提示词只把
+旧槽位标记为失效，新内容追加到末尾并记入一个小的增量索引；增量索引或失效槽位过多时在内存中重建。
+
+    python catalogue.py bench --prompts 100000    # 与 search_prompts 比较内存占用和筛选耗时
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+
+import numpy as np
+
+import database
+import profiler
+
+# 增量索引中的槽位超过这个数量时重建倒排索引
+MAX_DELTA_SLOTS = 5000
+# 失效槽位超过这个数量且超过总数的 1/4 时重新编排槽位
+COMPACT_MIN_DEAD = 1000
+# 一次同步中变化的提示词超过这个数量且超过总数的 1/4 时整体重新加载，比逐个读取更快
+RELOAD_MIN_CHANGES = 1000
+
+# 片段编码为 32 位整数：单个字符为其码位（小于 2**21）；三字符片段为三个码位的乘法哈希，最高位置 1。
+# 哈希冲突只会多出候选项，候选项总会再核对一次。
+TRIGRAM = 0x80000000
+HASH_MULTIPLIERS = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D)
+
+_STAMP_SEPARATORS = str.maketrans('', '', '- :.')
+
+
+def stamp_key(updated_at):
+    """把 updated_at 的文本转换为整数，整数的大小顺序与 SQLite 比较文本的顺序一致。
+
+    本程序写入的格式只有 'YYYY-MM-DD HH:MM:SS'（CURRENT_TIMESTAMP）和带三位毫秒的 NOW：
+    前者编码为 日期时间 * 10000，后者为 日期时间 * 10000 + 毫秒 * 10 + 1，
+    因此与文本比较一样，不带毫秒的值排在同一秒带毫秒的值之前。NULL 与其他格式排在最后。
+    """
+    if updated_at is None:
+        return -1
+    digits = updated_at.translate(_STAMP_SEPARATORS)
+    if not digits.isdigit():
+        return 0
+    if len(updated_at) == 19 and len(digits) == 14:
+        return int(digits) * 10000
+    if len(updated_at) == 23 and len(digits) == 17:
+        return int(digits) * 10 + 1
+    return 0
+
+
+def _trigram_code(a, b, c):
+    x, y, z = HASH_MULTIPLIERS
+    return ((a * x ^ b * y ^ c * z) & 0xFFFFFFFF) | TRIGRAM
+
+
+def _gram_codes(text):
+    chars = [ord(c) for c in text]
+    codes = set(chars)
+    codes.update(_trigram_code(a, b, c) for a, b, c in zip(chars, chars[1:], chars[2:]))
+    return codes
+
+
+def _query_codes(query):
+    # 一两个字符的查询用单字符倒排表；更长的查询只用 trigram，候选项更少
+    chars = [ord(c) for c in query]
+    if len(chars) < 3:
+        return set(chars)
+    return {_trigram_code(a, b, c) for a, b, c in zip(chars, chars[1:], chars[2:])}
+
+
+def build_ngram_index(folded_titles):
+    """为折叠大小写后的标题建立倒排索引，返回 (片段编码, 偏移, 槽位)：编码 codes[i] 出现在
+    slots[offsets[i]:offsets[i + 1]] 这些槽位中（升序）。"""
+    if not folded_titles:
+        return np.zeros(0, np.uint32), np.zeros(1, np.int64), np.zeros(0, np.uint32)
+    lengths = np.fromiter((len(t) for t in folded_titles), np.int64, len(folded_titles))
+    # 以 NUL 分隔拼接后按 UTF-32 解码为码位数组；position_slots 为每个位置所属的槽位
+    chars = np.frombuffer('\0'.join(folded_titles).encode('utf-32-le'), np.uint32)
+    position_slots = np.repeat(np.arange(len(folded_titles), dtype=np.uint64), lengths + 1)[:len(chars)]
+    present = chars != 0
+    valid = present[:-2] & present[1:-1] & present[2:]
+    x, y, z = (np.uint32(m) for m in HASH_MULTIPLIERS)
+    trigrams = chars[:-2][valid] * x
+    trigrams ^= chars[1:-1][valid] * y
+    trigrams ^= chars[2:][valid] * z
+    trigrams |= np.uint32(TRIGRAM)
+    # (编码, 槽位) 拼成一个 64 位整数原地排序，同一片段内槽位升序，再去掉同一标题中重复的片段
+    keys = np.concatenate([chars[present], trigrams]).astype(np.uint64)
+    keys <<= np.uint64(32)
+    keys |= np.concatenate([position_slots[present], position_slots[:-2][valid]])
+    keys.sort()
+    keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+    codes = (keys >> np.uint64(32)).astype(np.uint32)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    return codes[starts], np.r_[starts, len(codes)].astype(np.int64), keys.astype(np.uint32)
+
+
+class Catalogue:
+    """(id, 标题, 标签, updated_at) 的紧凑内存副本。筛选结果与 database.search_prompts 相同
+    （按 updated_at 的文本从新到旧，相同时 ID 大的在前），只是非 ASCII 字母同样不区分大小写，且 % 和 _ 按普通字符匹配。"""
+
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._last_seq = 0
+        self._reset()
+
+    def _reset(self):
+        self.ids = array('q')
+        # stamp_key(updated_at)
+        self.stamps = array('q')
+        self.alive = bytearray()
+        self.titles = []
+        # 提示词 ID 到槽位：重建时按 ID 排序的 (ID, 槽位) 数组，之后的变化记在 moved 中（-1 表示已删除）
+        self.id_keys = np.zeros(0, np.int64)
+        self.id_slots = np.zeros(0, np.int64)
+        self.moved = {}
+        self.count = 0
+        self.dead = 0
+        # 槽位 s 的标签 ID 为 tag_refs[tag_starts[s]:tag_starts[s + 1]]
+        self.tag_starts = array('i', [0])
+        self.tag_refs = array('i')
+        self.tag_names = []
+        self.tag_folded = []
+        self.tag_ids = {}
+        self.tag_postings = []
+        # 倒排索引覆盖 [0, indexed_slots) 的槽位，之后追加的槽位在 delta 中
+        self.gram_codes, self.gram_offsets, self.gram_slots = build_ngram_index([])
+        self.indexed_slots = 0
+        self.delta = {}
+        self._order = None
+
+    def __len__(self):
+        return self.count
+
+    def _slot(self, prompt_id):
+        slot = self.moved.get(prompt_id)
+        if slot is not None:
+            return slot
+        i = int(np.searchsorted(self.id_keys, prompt_id))
+        if i < len(self.id_keys) and self.id_keys[i] == prompt_id:
+            return int(self.id_slots[i])
+        return -1
+
+    def _tag_id(self, name):
+        tag_id = self.tag_ids.get(name)
+        if tag_id is None:
+            tag_id = self.tag_ids[name] = len(self.tag_names)
+            self.tag_names.append(name)
+            self.tag_folded.append(name.casefold())
+            self.tag_postings.append(array('i'))
+        return tag_id
+
+    def _append(self, prompt_id, title, stamp, tags):
+        slot = len(self.ids)
+        old_slot = self._slot(prompt_id)
+        if old_slot >= 0:
+            self.alive[old_slot] = 0
+            self.dead += 1
+        else:
+            self.count += 1
+        self.moved[prompt_id] = slot
+        self.ids.append(prompt_id)
+        self.stamps.append(stamp)
+        self.alive.append(1)
+        self.titles.append(title)
+        for name in tags:
+            tag_id = self._tag_id(name)
+            self.tag_refs.append(tag_id)
+            self.tag_postings[tag_id].append(slot)
+        self.tag_starts.append(len(self.tag_refs))
+        return slot
+
+    def _add(self, prompt_id, title, stamp, tags):
+        slot = self._append(prompt_id, title, stamp, tags)
+        for code in _gram_codes(title.casefold()):
+            self.delta.setdefault(code, []).append(slot)
+
+    def _remove(self, prompt_id):
+        slot = self._slot(prompt_id)
+        if slot >= 0:
+            self.moved[prompt_id] = -1
+            self.alive[slot] = 0
+            self.dead += 1
+            self.count -= 1
+
+    def _build_index(self):
+        self.gram_codes, self.gram_offsets, self.gram_slots = build_ngram_index(
+            [title.casefold() for title in self.titles])
+        self.indexed_slots = len(self.titles)
+        self.delta = {}
+        alive = np.flatnonzero(np.frombuffer(self.alive, np.uint8))
+        ids = np.frombuffer(self.ids, np.int64)[alive]
+        order = np.argsort(ids, kind='stable')
+        self.id_keys, self.id_slots = ids[order], alive[order].astype(np.int64)
+        self.moved = {}
+
+    def _rebuild(self, records):
+        """用 [(id, 标题, 时间, 标签), ...] 重新编排所有槽位并重建索引。"""
+        self._reset()
+        records = list(records)
+        self.ids = array('q', [record[0] for record in records])
+        self.stamps = array('q', [record[2] for record in records])
+        self.titles = [record[1] for record in records]
+        self.alive = bytearray(b'\x01') * len(records)
+        self.count = len(records)
+        for slot, record in enumerate(records):
+            for name in record[3]:
+                tag_id = self._tag_id(name)
+                self.tag_refs.append(tag_id)
+                self.tag_postings[tag_id].append(slot)
+            self.tag_starts.append(len(self.tag_refs))
+        self._build_index()
+
+    def _records(self):
+        for slot in np.flatnonzero(np.frombuffer(self.alive, np.uint8)).tolist():
+            tags = self.tag_refs[self.tag_starts[slot]:self.tag_starts[slot + 1]]
+            yield self.ids[slot], self.titles[slot], self.stamps[slot], [self.tag_names[t] for t in tags]
+
+    def _maintain(self):
+        if self.dead > COMPACT_MIN_DEAD and self.dead * 4 > len(self.ids):
+            self._rebuild(list(self._records()))
+            profiler.increment('catalogue.compactions')
+        elif len(self.ids) - self.indexed_slots > MAX_DELTA_SLOTS or len(self.moved) > MAX_DELTA_SLOTS:
+            self._build_index()
+            profiler.increment('catalogue.index_rebuilds')
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = database.get_db_connection()
+        return self._conn
+
+    @profiler.timed('catalogue.load')
+    def _load(self):
+        conn = self._connect()
+        self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        # 在同一个读事务中取得日志位置和数据，两者对应同一个快照
+        conn.execute("BEGIN")
+        try:
+            self._last_seq = conn.execute("SELECT MAX(seq) FROM prompt_changes").fetchone()[0] or 0
+            rows, tags = database.get_catalogue_rows(conn)
+        finally:
+            conn.commit()
+        records = [(prompt_id, title, stamp_key(stamp), tags.get(prompt_id, ())) for prompt_id, title, stamp in rows]
+        records.sort(key=lambda record: (record[2], record[0]), reverse=True)
+        self._rebuild(records)
+
+    def load(self):
+        """从数据库完整加载。"""
+        with self._lock:
+            self._load()
+
+    @profiler.timed('catalogue.sync')
+    def sync(self):
+        """应用上次同步之后数据库中的变化，返回是否有变化。数据库没有新的写入时只执行一次 PRAGMA。"""
+        with self._lock:
+            if self._conn is None:
+                self._load()
+                return True
+            conn = self._conn
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return False
+            self._data_version = data_version
+            conn.execute("BEGIN")
+            try:
+                first, last, changed = database.get_prompt_changes(conn, self._last_seq)
+                last = last or 0
+                # 日志被清理到了上次同步的位置之后，或数据库被替换：无法增量更新
+                reload = last < self._last_seq or (first is not None and first > self._last_seq + 1) or \
+                    len(changed) > max(RELOAD_MIN_CHANGES, self.count // 4)
+                if not reload and changed:
+                    rows, tags = database.get_catalogue_rows(conn, changed)
+            finally:
+                conn.commit()
+            if reload:
+                self._load()
+                return True
+            self._last_seq = last
+            if not changed:
+                return False
+            for prompt_id in changed - {row[0] for row in rows}:
+                self._remove(prompt_id)
+            for prompt_id, title, stamp in rows:
+                self._add(prompt_id, title, stamp_key(stamp), tags.get(prompt_id, ()))
+            self._order = None
+            self._maintain()
+            profiler.increment('catalogue.synced_prompts', len(changed))
+            return True
+
+    def _posting(self, code):
+        i = np.searchsorted(self.gram_codes, np.uint32(code))
+        if i == len(self.gram_codes) or self.gram_codes[i] != code:
+            return self.gram_slots[:0]
+        return self.gram_slots[self.gram_offsets[i]:self.gram_offsets[i + 1]]
+
+    def _title_candidates(self, query):
+        codes = _query_codes(query)
+        indexed, delta = None, None
+        for code in codes:
+            posting = self._posting(code)
+            indexed = posting if indexed is None else np.intersect1d(indexed, posting, assume_unique=True)
+            delta_posting = self.delta.get(code, ())
+            delta = set(delta_posting) if delta is None else delta.intersection(delta_posting)
+        candidates = indexed.tolist() + sorted(delta)
+        if len(query) == 1:
+            # 片段就是整个查询，不需要核对
+            return candidates
+        titles = self.titles
+        return [slot for slot in candidates if query in titles[slot].casefold()]
+
+    def _matching_slots(self, query):
+        slots = set(self._title_candidates(query))
+        for tag_id, name in enumerate(self.tag_folded):
+            if query in name:
+                slots.update(self.tag_postings[tag_id])
+        alive = self.alive
+        return [slot for slot in slots if alive[slot]]
+
+    def _by_recency(self, slots):
+        # 与 search_prompts 相同：updated_at 从新到旧，相同时 ID 大的在前
+        slots = np.array(slots, np.int64)
+        keys = np.frombuffer(self.stamps, np.int64)[slots]
+        ids = np.frombuffer(self.ids, np.int64)[slots]
+        return slots[np.lexsort((ids, keys))[::-1]].tolist()
+
+    @profiler.timed('catalogue.search')
+    def search(self, query=""):
+        """按标题或标签筛选，返回 [(id, 标题), ...]，顺序与 search_prompts 相同。"""
+        self.sync()
+        with self._lock:
+            query = query.casefold()
+            if query:
+                slots = self._by_recency(self._matching_slots(query))
+            else:
+                if self._order is None:
+                    self._order = self._by_recency(np.flatnonzero(np.frombuffer(self.alive, np.uint8)).tolist())
+                slots = self._order
+            ids, titles = self.ids, self.titles
+            return [(ids[slot], titles[slot]) for slot in slots]
+
+    def memory_usage(self):
+        """估算各部分占用的字节数（包括容器和其中的对象）。"""
+        def container(items):
+            return sys.getsizeof(items) + sum(sys.getsizeof(item) for item in items)
+
+        usage = {
+            'arrays': sum(sys.getsizeof(a) for a in (self.ids, self.stamps, self.alive, self.tag_starts, self.tag_refs))
+                      + self.id_keys.nbytes + self.id_slots.nbytes + sys.getsizeof(self.moved),
+            'titles': container(self.titles),
+            'tags': container(self.tag_names) + container(self.tag_folded) + sys.getsizeof(self.tag_ids)
+                    + container(self.tag_postings),
+            'ngram_index': self.gram_codes.nbytes + self.gram_offsets.nbytes + self.gram_slots.nbytes
+                           + sys.getsizeof(self.delta) + sum(sys.getsizeof(p) for p in self.delta.values()),
+        }
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _traced(function):
+    """执行 function，返回 (结果, 结果在执行后仍占用的内存字节数)。"""
+    tracemalloc.start()
+    try:
+        result = function()
+        retained = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, retained
+
+
+def _timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def _timings_ms(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {'median': statistics.median(samples), 'max': max(samples)}
+
+
+def seed_database(prompts, tags, seed=0):
+    """写入 prompts 个合成的提示词，每个带一到三个标签（共 tags 种）。"""
+    rng = random.Random(seed)
+    words = ["翻译", "写作", "周报", "代码审查", "客服回复", "邮件", "总结", "营销文案", "SQL", "Python",
+             "Summarize", "Email", "Review", "学习计划", "面试", "简历", "产品需求", "数据分析", "故事", "诗歌"]
+    database.init_db()
+    titles = [f"{' '.join(rng.sample(words, rng.randint(2, 4)))} {i}" for i in range(prompts)]
+    ids = database.add_prompts((title, f"{title}：{{{{输入}}}}") for title in titles)
+    tag_names = [f"标签{i}" for i in range(tags)]
+
+    def write(conn):
+        conn.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(name,) for name in tag_names])
+        tag_ids = [conn.execute("SELECT id FROM tags WHERE name = ?", (name,)).fetchone()[0] for name in tag_names]
+        conn.executemany("INSERT OR IGNORE INTO prompt_tags (prompt_id, tag_id) VALUES (?, ?)",
+                         [(prompt_id, tag_id) for prompt_id in ids
+                          for tag_id in rng.sample(tag_ids, rng.randint(1, min(3, len(tag_ids))))])
+
+    if tag_names:
+        database.run_in_write_transaction(write)
+    return ids
+
+
+def run_benchmark(queries, repeat=20):
+    """比较 search_prompts（每次筛选都查询数据库）与内存目录的内存占用和筛选耗时。"""
+    # tracemalloc 会显著拖慢分配，耗时和内存分开测量
+    rows, rows_seconds = _timed(lambda: database.search_prompts(''))
+    del rows
+    rows, rows_bytes = _traced(lambda: database.search_prompts(''))
+    del rows
+    catalogue = Catalogue()
+    _, catalogue_bytes = _traced(catalogue.load)
+    catalogue.close()
+    catalogue = Catalogue()
+    _, load_seconds = _timed(catalogue.load)
+    report = {
+        'prompts': len(catalogue),
+        'search_prompts': {'list_bytes': rows_bytes, 'list_seconds': rows_seconds},
+        'catalogue': {'traced_bytes': catalogue_bytes, 'estimated_bytes': catalogue.memory_usage(),
+                      'load_seconds': load_seconds},
+        'queries': [],
+    }
+    for query in queries:
+        expected = [row['id'] for row in database.search_prompts(query)]
+        got = [prompt_id for prompt_id, _ in catalogue.search(query)]
+        report['queries'].append({
+            'query': query,
+            'results': len(got),
+            'matches_sql': expected == got,
+            'search_prompts_ms': _timings_ms(lambda: database.search_prompts(query), max(3, repeat // 4)),
+            'catalogue_ms': _timings_ms(lambda: catalogue.search(query), repeat),
+        })
+    report['sync_without_changes_ms'] = _timings_ms(catalogue.sync, repeat)
+
+    # 修改一个提示词后增量同步的耗时
+    prompt_id = catalogue.search()[-1][0]
+    database.save_prompt_snapshot(prompt_id, "刚刚修改的标题", tags=["刚刚添加的标签"])
+    start = time.perf_counter()
+    catalogue.sync()
+    report['sync_after_one_write_ms'] = (time.perf_counter() - start) * 1000
+    report['write_visible'] = catalogue.search("刚刚修改")[:1] == [(prompt_id, "刚刚修改的标题")]
+    catalogue.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="内存目录基准测试")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('bench', help="与 search_prompts 比较内存占用和筛选耗时")
+    p.add_argument('--db', help="使用已有的数据库（只会修改其中一个提示词的标题和标签）；默认在临时目录中生成")
+    p.add_argument('--prompts', type=int, default=100_000, help="生成的提示词数量")
+    p.add_argument('--tags', type=int, default=200, help="生成的标签种数")
+    p.add_argument('--query', action='append', help="要测试的筛选词，可重复；默认使用一组常见的查询")
+    p.add_argument('--repeat', type=int, default=20)
+    p.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    queries = args.query or ["翻", "代码", "review", "学习计划 面试", "标签17", "12345", "不存在的内容"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.db:
+            database.DATABASE_PATH = os.path.abspath(args.db)
+            database.init_db()
+        else:
+            database.DATABASE_PATH = os.path.join(tmp_dir, 'catalogue_bench.db')
+            seed_database(args.prompts, args.tags)
+        report = run_benchmark(queries, repeat=args.repeat)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+    mb = 1024 * 1024
+    print(f"{report['prompts']} 个提示词")
+    print(f"search_prompts 的结果列表: {report['search_prompts']['list_bytes'] / mb:.1f} MB "
+          f"（每次刷新都重新查询，耗时 {report['search_prompts']['list_seconds'] * 1000:.0f} ms）")
+    estimated = report['catalogue']['estimated_bytes']
+    print(f"内存目录: {report['catalogue']['traced_bytes'] / mb:.1f} MB（tracemalloc），加载 "
+          f"{report['catalogue']['load_seconds'] * 1000:.0f} ms；其中 "
+          + "，".join(f"{name} {value / mb:.1f} MB" for name, value in estimated.items() if name != 'total'))
+    print(f"{'查询':<16}{'结果数':>8}{'search_prompts':>18}{'内存目录':>14}")
+    for item in report['queries']:
+        check = "" if item['matches_sql'] else "  (结果与 SQL 不同)"
+        print(f"{item['query']:<16}{item['results']:>8}{item['search_prompts_ms']['median']:>15.2f} ms"
+              f"{item['catalogue_ms']['median']:>11.3f} ms{check}")
+    print(f"无变化时同步: {report['sync_without_changes_ms']['median']:.3f} ms；"
+          f"修改一个提示词后增量同步: {report['sync_after_one_write_ms']:.2f} ms"
+          + ("" if report['write_visible'] else "（修改未生效！）"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
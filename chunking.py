@@ -0,0 +1,61 @@
+import numpy as np
+
+import llm_client
+import profiler
+
+# 按字符切分。默认值保证大多数 Embedding 模型的输入上限（约 8k token）都不会被超出。
+DEFAULT_CHUNK_CHARS = 2000
+DEFAULT_OVERLAP_CHARS = 200
+DEFAULT_BATCH_SIZE = 32
+
+# 优先在这些位置断开，越靠前优先级越高
+_BREAKS = ('\n\n', '\n', '。', '！', '？', '. ', '! ', '? ', '；', '; ', '，', ', ', ' ')
+
+
+def split_into_chunks(text, max_chars=DEFAULT_CHUNK_CHARS, overlap=DEFAULT_OVERLAP_CHARS):
+    """把文本切分成互相重叠的窗口，返回 [(start, end), ...]。
+
+    每个窗口不超过 max_chars，尽量在段落、句子或空白处断开；相邻窗口重叠 overlap 个字符。
+    """
+    if len(text) <= max_chars:
+        return [(0, len(text))]
+    overlap = min(overlap, max_chars // 2)
+    spans = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            # 只在窗口后 30% 的范围内寻找断点，避免切出过短的块
+            floor = start + int(max_chars * 0.7)
+            for sep in _BREAKS:
+                pos = text.rfind(sep, floor, end)
+                if pos != -1:
+                    end = pos + len(sep)
+                    break
+        spans.append((start, end))
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return spans
+
+
+@profiler.timed('chunking.embed_content')
+def embed_content(content, max_chars=DEFAULT_CHUNK_CHARS, overlap=DEFAULT_OVERLAP_CHARS,
+                  batch_size=DEFAULT_BATCH_SIZE, embed_batch=None, model=None):
+    """为提示词内容生成分块向量，model 默认为配置中的 Embedding 模型。
+
+    返回 (文档向量, [(start, end, 向量), ...])。文档向量是各块归一化向量的平均值，
+    写入 prompts.embedding 供去重等只需要单个向量的功能使用。
+    """
+    embed_batch = embed_batch or (lambda texts: llm_client.get_embeddings(texts, model))
+    spans = split_into_chunks(content, max_chars, overlap)
+    vectors = []
+    for i in range(0, len(spans), batch_size):
+        texts = [content[start:end] for start, end in spans[i:i + batch_size]]
+        vectors.extend(embed_batch(texts))
+    matrix = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    normalized = matrix / np.where(norms == 0, 1, norms)
+    document = normalized.mean(axis=0).astype(np.float32)
+    chunks = [(start, end, matrix[i]) for i, (start, end) in enumerate(spans)]
+    return document, chunks
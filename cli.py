@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import sys
+import threading
+
+import batch_optimize
+import database
+import dedup
+import embedding_migration
+import llm_client
+import prompt_api
+
+
+def _print_rows(rows, as_json):
+    for row in rows:
+        if as_json:
+            print(json.dumps(row, ensure_ascii=False))
+        else:
+            print(f"{row['id']}\t{row['title']}")
+
+
+def cmd_import(args):
+    paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.txt'))
+        else:
+            paths.append(path)
+    prompt_ids = prompt_api.import_txt_files(paths, workers=args.workers)
+    print(f"已导入 {len(prompt_ids)} 个提示词。")
+    if args.embed and prompt_ids:
+        cmd_reembed(argparse.Namespace(ids=prompt_ids, missing=False, workers=args.workers, batch_size=100))
+
+
+def cmd_export(args):
+    count = prompt_api.export_txt_files(args.dir, ids=args.ids)
+    print(f"已导出 {count} 个提示词到 {args.dir}")
+
+
+def cmd_search(args):
+    if args.semantic:
+        rows = prompt_api.semantic_search(args.query, limit=args.limit)
+    else:
+        rows = prompt_api.keyword_search(args.query)[:args.limit]
+    _print_rows(rows, args.json)
+
+
+def cmd_render(args):
+    values = {}
+    for item in args.var or []:
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise SystemExit(f"变量格式错误: {item}，应为 名称=值")
+        values[name] = value
+    if args.vars_file:
+        with open(args.vars_file, 'r', encoding='utf-8') as f:
+            values.update(json.load(f))
+    results = prompt_api.render_prompts(values, ids=args.ids, workers=args.workers)
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+        for prompt_id, title, rendered in results:
+            with open(os.path.join(args.out_dir, f"{prompt_api.safe_filename(title)}.txt"), 'w', encoding='utf-8') as f:
+                f.write(rendered)
+        print(f"已渲染 {len(results)} 个提示词到 {args.out_dir}")
+    else:
+        for prompt_id, title, rendered in results:
+            print(json.dumps({'id': prompt_id, 'title': title, 'content': rendered}, ensure_ascii=False))
+
+
+def cmd_reembed(args):
+    def progress(done, total):
+        print(f"\r{done}/{total}", end='', file=sys.stderr, flush=True)
+
+    done, failures = prompt_api.reembed_prompts(ids=args.ids, missing_only=args.missing,
+                                                workers=args.workers, batch_size=args.batch_size,
+                                                progress=progress)
+    print(file=sys.stderr)
+    print(f"已生成 {done} 个向量，失败 {len(failures)} 个。")
+    for prompt_id, error in failures:
+        print(f"  提示词 {prompt_id}: {error}", file=sys.stderr)
+
+
+def cmd_dedup(args):
+    result = dedup.analyze(threshold=args.threshold, clusters=args.clusters,
+                           memory_limit_mb=args.memory_mb, refresh=args.refresh, mmap_path=args.mmap,
+                           embedding_model=llm_client.get_embedding_model())
+    grouped_ids = [prompt_id for group in result.groups for prompt_id in group]
+    titles = {p['id']: p['title'] for p in database.get_prompts_by_ids(grouped_ids)}
+    if args.json:
+        print(json.dumps({
+            'groups': [[{'id': i, 'title': titles.get(i)} for i in group] for group in result.groups],
+            'clusters': {str(i): result.labels[i] for i in result.labels},
+            'cluster_sizes': result.cluster_sizes,
+            'incremental': result.incremental,
+        }, ensure_ascii=False))
+        return
+    mode = "增量更新" if result.incremental else "完整计算"
+    print(f"共 {len(result.ids)} 个向量（{mode}），发现 {len(result.groups)} 组近似重复：")
+    for n, group in enumerate(result.groups, 1):
+        print(f"  组 {n}: " + ", ".join(f"{i} {titles.get(i)}" for i in group))
+    if result.cluster_sizes:
+        print("聚类大小: " + ", ".join(f"#{i}={size}" for i, size in enumerate(result.cluster_sizes)))
+
+
+def cmd_migrate_embeddings(args):
+    if args.status:
+        migration = database.get_embedding_migration()
+        print(f"当前模型: {llm_client.get_embedding_model()}")
+        for model, count in sorted(database.get_embedding_model_counts().items(), key=lambda item: str(item[0])):
+            print(f"  {model or '(未记录)'}: {count} 个提示词")
+        if migration:
+            print(f"进行中的迁移 #{migration['id']}: {migration['source_model']} -> {migration['target_model']}，"
+                  f"{migration['processed']}/{migration['total']}" + (f"，上次错误: {migration['error']}" if migration['error'] else ""))
+        return
+    if args.cancel:
+        embedding_migration.cancel()
+        print("迁移已取消。")
+        return
+    if args.model:
+        migration_id = embedding_migration.start(args.model)
+    else:
+        migration = database.get_embedding_migration()
+        if migration is None:
+            raise ValueError("没有进行中的迁移，请指定目标模型。")
+        migration_id = migration['id']
+
+    def progress(done, total):
+        print(f"\r{done}/{total}", end='', file=sys.stderr, flush=True)
+
+    try:
+        status = embedding_migration.run(migration_id, batch_size=args.batch_size, workers=args.workers,
+                                         progress=progress)
+    except KeyboardInterrupt:
+        status = 'paused'
+    print(file=sys.stderr)
+    if status == 'completed':
+        print(f"迁移完成，当前模型: {llm_client.get_embedding_model()}")
+        failures = database.get_embedding_migration_failures(migration_id)
+        if failures:
+            print(f"{len(failures)} 个提示词生成失败，目前没有向量，可运行 reembed --missing 补生成:")
+            for prompt_id, title, error in failures:
+                print(f"  {prompt_id} {title}: {error}")
+    elif status == 'paused':
+        print("迁移已暂停，再次运行 migrate-embeddings 可从断点继续。")
+    else:
+        print("迁移已被取消。")
+
+
+def cmd_batch_optimize(args):
+    if args.resume is not None:
+        job_id = args.resume or None
+        if job_id is None and database.get_batch_job() is None:
+            raise ValueError("没有未完成的批量任务。")
+    else:
+        instructions = args.instructions
+        if args.instructions_file:
+            with open(args.instructions_file, 'r', encoding='utf-8') as f:
+                instructions = f.read()
+        job_id = batch_optimize.create_job(args.mode, prompt_ids=args.ids, tag=args.tag, instructions=instructions)
+        print(f"已创建批量任务 #{job_id}", file=sys.stderr)
+
+    def progress(done, total, prompt_id, error):
+        if error:
+            print(f"\n  提示词 {prompt_id}: {error}", file=sys.stderr)
+        print(f"\r{done}/{total}", end='', file=sys.stderr, flush=True)
+
+    stop_event = threading.Event()
+    try:
+        status, succeeded, failed = batch_optimize.run_job(job_id, workers=args.workers, rate=args.rate,
+                                                           retry_failed=args.retry_failed, progress=progress,
+                                                           stop_event=stop_event)
+    except KeyboardInterrupt:
+        # 已发出的请求仍会在工作线程中完成并保存
+        stop_event.set()
+        status, succeeded, failed = 'paused', None, None
+    print(file=sys.stderr)
+    if status == 'completed':
+        print(f"批量任务完成：成功 {succeeded} 个，失败 {failed} 个。" + ("结果已保存为历史版本。" if succeeded else ""))
+        if failed:
+            print("使用 batch-optimize --resume --retry-failed 可重试失败的提示词。")
+    else:
+        print("批量任务已暂停，使用 batch-optimize --resume 可继续。")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="提示词库命令行工具（无需图形界面）")
+    parser.add_argument('--db', help="数据库文件路径，默认为程序目录下的 prompts.db")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('import', help="批量导入 .txt 文件或目录")
+    p.add_argument('paths', nargs='+')
+    p.add_argument('--embed', action='store_true', help="导入后生成向量")
+    p.add_argument('--workers', type=int, default=4)
+    p.set_defaults(func=cmd_import)
+
+    p = subparsers.add_parser('export', help="导出为 .txt 文件")
+    p.add_argument('dir')
+    p.add_argument('--ids', type=int, nargs='+')
+    p.set_defaults(func=cmd_export)
+
+    p = subparsers.add_parser('search', help="关键词或语义搜索")
+    p.add_argument('query', nargs='?', default='')
+    p.add_argument('--semantic', action='store_true')
+    p.add_argument('--limit', type=int, default=10)
+    p.add_argument('--json', action='store_true', help="每行输出一个 JSON 对象")
+    p.set_defaults(func=cmd_search)
+
+    p = subparsers.add_parser('render', help="批量渲染模板")
+    p.add_argument('--ids', type=int, nargs='+', help="默认渲染全部提示词")
+    p.add_argument('--var', action='append', metavar='NAME=VALUE')
+    p.add_argument('--vars-file', help="包含变量值的 JSON 文件")
+    p.add_argument('--out-dir', help="输出目录，默认以 JSON 行输出到标准输出")
+    p.add_argument('--workers', type=int, default=1, help="大于 1 时使用多进程渲染")
+    p.set_defaults(func=cmd_render)
+
+    p = subparsers.add_parser('reembed', help="重新生成向量")
+    p.add_argument('--ids', type=int, nargs='+')
+    p.add_argument('--missing', action='store_true', help="只处理尚无向量的提示词")
+    p.add_argument('--workers', type=int, default=4)
+    p.add_argument('--batch-size', type=int, default=100)
+    p.set_defaults(func=cmd_reembed)
+
+    p = subparsers.add_parser('dedup', help="查找近似重复的提示词并进行主题聚类")
+    p.add_argument('--threshold', type=float, default=dedup.DEFAULT_THRESHOLD, help="余弦相似度阈值")
+    p.add_argument('--clusters', type=int, default=0, help="k-means 聚类数，0 表示不聚类")
+    p.add_argument('--memory-mb', type=int, default=dedup.DEFAULT_MEMORY_LIMIT_MB, help="分块计算的工作集上限（不含内存映射的向量矩阵）")
+    p.add_argument('--mmap', help="把向量矩阵保存在该 .npy 文件中（默认使用用完即删的临时文件）")
+    p.add_argument('--refresh', action='store_true', help="忽略缓存，重新完整计算")
+    p.add_argument('--json', action='store_true')
+    p.set_defaults(func=cmd_dedup)
+
+    p = subparsers.add_parser('migrate-embeddings', help="在后台把整个库的向量迁移到新的 Embedding 模型")
+    p.add_argument('model', nargs='?', help="目标模型；省略时继续进行中的迁移")
+    p.add_argument('--batch-size', type=int, default=embedding_migration.DEFAULT_BATCH_SIZE)
+    p.add_argument('--workers', type=int, default=embedding_migration.DEFAULT_WORKERS)
+    p.add_argument('--status', action='store_true', help="查看各模型的向量数量和迁移进度")
+    p.add_argument('--cancel', action='store_true', help="取消进行中的迁移")
+    p.set_defaults(func=cmd_migrate_embeddings)
+
+    p = subparsers.add_parser('batch-optimize', help="批量 AI 优化或生成，结果保存为新的历史版本")
+    p.add_argument('--ids', type=int, nargs='+')
+    p.add_argument('--tag', help="处理带有该标签的全部提示词")
+    p.add_argument('--mode', choices=batch_optimize.MODES, default='optimize')
+    p.add_argument('--instructions', help="优化指令，默认与界面中的 AI 优化相同")
+    p.add_argument('--instructions-file')
+    p.add_argument('--workers', type=int, default=batch_optimize.DEFAULT_WORKERS, help="同时进行的请求数")
+    p.add_argument('--rate', type=float, default=batch_optimize.DEFAULT_RATE, help="每秒最多发出的请求数")
+    p.add_argument('--resume', type=int, nargs='?', const=0, metavar='JOB_ID',
+                   help="继续未完成的任务（默认为最近的一个）")
+    p.add_argument('--retry-failed', action='store_true', help="同时重试之前失败的条目")
+    p.set_defaults(func=cmd_batch_optimize)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.db:
+        database.DATABASE_PATH = os.path.abspath(args.db)
+    database.init_db()
+    try:
+        args.func(args)
+    except (ValueError, RuntimeError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
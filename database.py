@@ -2,6 +2,11 @@ import sqlite3
 import os
 import numpy as np
 import io
+import random
+import time
+from collections import Counter
+
+import profiler
 
 # --- 数据库设置 ---
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'prompts.db')
@@ -10,12 +15,74 @@ DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'prompts.db')
 sqlite3.register_adapter(np.ndarray, lambda arr: sqlite3.Binary(arr.tobytes()))
 sqlite3.register_converter("BLOB", lambda b: np.frombuffer(b, dtype=np.float32))
 
+# --- 并发设置 ---
+# 多人共用同一个数据库文件时使用 WAL：读不阻塞写、写不阻塞读。
+# WAL 依赖共享内存，不支持网络文件系统 (SMB/NFS)，这种情况下可设为 DELETE 使用传统回滚日志。
+JOURNAL_MODE = os.environ.get('PROMPT_MANAGER_JOURNAL_MODE', 'WAL').upper()
+# 遇到锁时 SQLite 自行等待的时间（毫秒）
+BUSY_TIMEOUT_MS = int(os.environ.get('PROMPT_MANAGER_BUSY_TIMEOUT_MS', '5000'))
+# busy_timeout 用尽后写事务整体重试的次数和初始退避时间（秒）
+WRITE_RETRIES = 5
+RETRY_BACKOFF = 0.05
+
+# updated_at 精确到毫秒
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# prompt_changes 变更日志保留的最近条目数；落后更多的内存目录会整体重新加载
+CHANGE_LOG_KEEP = 100_000
+
+
+class ConflictError(Exception):
+    """提示词在加载之后已被其他进程修改。current_version 为数据库中当前的版本号。"""
+
+    def __init__(self, prompt_id, current_version):
+        super().__init__(f"提示词 {prompt_id} 已被其他人修改（版本 {current_version}）")
+        self.prompt_id = prompt_id
+        self.current_version = current_version
+
+
 def get_db_connection():
     """创建数据库连接，并启用BLOB转换。"""
-    conn = sqlite3.connect(DATABASE_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn = sqlite3.connect(DATABASE_PATH, detect_types=sqlite3.PARSE_DECLTYPES,
+                           timeout=BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
-    return conn
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    return profiler.trace_connection(conn)
+
+def _is_locked_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
 
+def run_in_write_transaction(function):
+    """在 BEGIN IMMEDIATE 事务中执行 function(conn) 并提交，返回其结果。
+
+    BEGIN IMMEDIATE 在事务开始时就取得写锁，避免两个连接都先读后写时互相等待导致的死锁；
+    busy_timeout 用尽仍然报 "database is locked" 时回滚并按指数退避整体重试。
+    function 可能被执行多次，不能有数据库以外的副作用。
+    """
+    for attempt in range(WRITE_RETRIES + 1):
+        conn = get_db_connection()
+        conn.isolation_level = None  # 由这里显式管理事务
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = function(conn)
+            conn.execute('COMMIT')
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            if not _is_locked_error(e) or attempt == WRITE_RETRIES:
+                raise
+            profiler.increment('database.write_retries')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        time.sleep(RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+@profiler.timed('database.init_db')
 def init_db():
     """使用 schema.sql 文件初始化数据库。"""
     if os.path.exists(DATABASE_PATH):
@@ -28,36 +95,166 @@ def init_db():
             os.remove(DATABASE_PATH) # 删除旧数据库
         else:
             conn.close()
-            return
 
+    # schema.sql 只包含 IF NOT EXISTS 语句，对已有数据库执行可以补建新增的表
     conn = get_db_connection()
+    # journal_mode 会持久化到数据库文件中，之后所有进程的连接都会使用它
+    conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
     schema_path = os.path.join(os.path.dirname(__file__), 'schema.sql')
     with open(schema_path, 'r', encoding='utf-8') as f:
         conn.executescript(f.read())
+    _migrate_schema(conn)
+    conn.execute("DELETE FROM prompt_changes WHERE seq <= (SELECT MAX(seq) FROM prompt_changes) - ?",
+                 (CHANGE_LOG_KEEP,))
     conn.commit()
     conn.close()
 
+def _migrate_schema(conn):
+    """为旧数据库补齐后来新增的列（CREATE TABLE IF NOT EXISTS 不会修改已有的表）。"""
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(prompts)")}
+    if 'version' not in columns:
+        conn.execute("ALTER TABLE prompts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    for table in ('prompts', 'prompt_chunks'):
+        columns = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if 'embedding_model' not in columns:
+            # 旧向量没有记录生成它的模型，保持为 NULL，检索时只在维度一致时使用
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN embedding_model TEXT")
+        if 'embedding_dim' not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN embedding_dim INTEGER")
+            conn.execute(f"UPDATE {table} SET embedding_dim = length(embedding) / 4 WHERE embedding IS NOT NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_prompt_chunks_model ON prompt_chunks (embedding_model, embedding_dim)")
+
 # --- 提示词 (Prompt) 函数 ---
 
-def add_prompt(title, content, embedding=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO prompts (title, content, embedding) VALUES (?, ?, ?)', 
-                   (title, content, embedding))
-    prompt_id = cursor.lastrowid
-    cursor.execute('INSERT INTO prompt_versions (prompt_id, content) VALUES (?, ?)', (prompt_id, content))
-    conn.commit()
-    conn.close()
+def _embedding_dim(embedding):
+    return len(embedding) if embedding is not None else None
+
+def _insert_prompt(conn, title, content, embedding, embedding_model):
+    cursor = conn.execute(f'''
+        INSERT INTO prompts (title, content, embedding, embedding_model, embedding_dim, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, {NOW}, {NOW})
+    ''', (title, content, embedding, embedding_model if embedding is not None else None, _embedding_dim(embedding)))
+    conn.execute('INSERT INTO prompt_versions (prompt_id, content) VALUES (?, ?)', (cursor.lastrowid, content))
+    return cursor.lastrowid
+
+@profiler.timed('database.add_prompt')
+def add_prompt(title, content, embedding=None, embedding_model=None):
+    prompt_id = run_in_write_transaction(lambda conn: _insert_prompt(conn, title, content, embedding, embedding_model))
     return prompt_id
 
-def update_prompt(prompt_id, title, content, embedding=None):
-    conn = get_db_connection()
-    conn.execute('UPDATE prompts SET title = ?, content = ?, embedding = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', 
-                 (title, content, embedding, prompt_id))
-    conn.execute('INSERT INTO prompt_versions (prompt_id, content) VALUES (?, ?)', (prompt_id, content))
-    conn.commit()
-    conn.close()
+@profiler.timed('database.add_prompts')
+def add_prompts(items, embedding_model=None):
+    """在一个事务中批量新增提示词。items 为 (title, content) 或 (title, content, embedding) 序列。"""
+    items = list(items)
+
+    def insert_all(conn):
+        return [_insert_prompt(conn, item[0], item[1], item[2] if len(item) > 2 else None, embedding_model)
+                for item in items]
+
+    prompt_ids = run_in_write_transaction(insert_all)
+    return prompt_ids
+
+@profiler.timed('database.update_prompt')
+def update_prompt(prompt_id, title, content, embedding=None, embedding_model=None):
+    def write(conn):
+        conn.execute(f'''
+            UPDATE prompts SET title = ?, content = ?, embedding = ?, embedding_model = ?, embedding_dim = ?,
+                               updated_at = {NOW}, version = version + 1
+            WHERE id = ?
+        ''', (title, content, embedding, embedding_model if embedding is not None else None,
+              _embedding_dim(embedding), prompt_id))
+        conn.execute('INSERT INTO prompt_versions (prompt_id, content) VALUES (?, ?)', (prompt_id, content))
+        replace_prompt_chunks(conn, prompt_id, [], embedding_model, other_models_stale=True)
+
+    run_in_write_transaction(write)
+
+@profiler.timed('database.save_prompt_snapshot')
+def save_prompt_snapshot(prompt_id, title, content=None, tags=None, embedding=None, update_embedding=False,
+                         chunks=None, expected_version=None, embedding_model=None):
+    """在一个事务中只写入发生变化的部分。
+
+    content 为 None 时不修改内容、也不新增历史版本；tags 为 None 时不修改标签；
+    只有 update_embedding 为 True 时才覆盖 embedding 列并替换分块向量 chunks（由 embedding_model 生成）。
+    给出 expected_version 时，只有数据库中的版本号仍等于它才写入，否则抛出 ConflictError。
+    返回写入后新的版本号；提示词不存在时返回 None。
+    """
+    assignments = ['title = ?', f'updated_at = {NOW}', 'version = version + 1']
+    params = [title]
+    if content is not None:
+        assignments.append('content = ?')
+        params.append(content)
+    if update_embedding:
+        assignments += ['embedding = ?', 'embedding_model = ?', 'embedding_dim = ?']
+        params += [embedding, embedding_model if embedding is not None else None, _embedding_dim(embedding)]
+    query = f"UPDATE prompts SET {', '.join(assignments)} WHERE id = ?"
+    params.append(prompt_id)
+    if expected_version is not None:
+        query += " AND version = ?"
+        params.append(expected_version)
+
+    def write(conn):
+        if conn.execute(query, params).rowcount == 0:
+            current = get_prompt_version(prompt_id, conn)
+            if current is not None:
+                raise ConflictError(prompt_id, current)
+            return None
+        if content is not None:
+            conn.execute('INSERT INTO prompt_versions (prompt_id, content) VALUES (?, ?)', (prompt_id, content))
+        if update_embedding:
+            # 内容已经变化，其他模型（例如迁移中的目标模型）的向量也随之过期
+            replace_prompt_chunks(conn, prompt_id, chunks or [], embedding_model, other_models_stale=True)
+        if tags is not None:
+            _replace_prompt_tags(conn, prompt_id, tags)
+        return get_prompt_version(prompt_id, conn)
+
+    return run_in_write_transaction(write)
+
+def get_prompt_version(prompt_id, conn=None):
+    """返回乐观并发检查用的版本号（每次修改标题、内容或标签时加一）；提示词不存在时返回 None。
 
+    只修改向量的写入（补生成 embedding、模型迁移）不改变版本号，打开的编辑器不会因此冲突。
+    """
+    own_connection = conn is None
+    conn = conn or get_db_connection()
+    try:
+        row = conn.execute("SELECT version FROM prompts WHERE id = ?", (prompt_id,)).fetchone()
+    finally:
+        if own_connection:
+            conn.close()
+    return row['version'] if row else None
+
+@profiler.timed('database.update_embeddings')
+def update_embeddings(items, embedding_model=None):
+    """批量写入由 embedding_model 生成的 (prompt_id, embedding, chunks)，不修改内容、不新增历史版本。"""
+    items = list(items)
+
+    def write(conn):
+        for prompt_id, embedding, chunks in items:
+            conn.execute('UPDATE prompts SET embedding = ?, embedding_model = ?, embedding_dim = ? WHERE id = ?',
+                         (embedding, embedding_model, _embedding_dim(embedding), prompt_id))
+            replace_prompt_chunks(conn, prompt_id, chunks, embedding_model)
+
+    run_in_write_transaction(write)
+
+def replace_prompt_chunks(conn, prompt_id, chunks, embedding_model=None, other_models_stale=False):
+    """用 [(start, end, embedding), ...] 替换提示词由 embedding_model 生成的分块向量（在调用方的事务中执行）。
+
+    不同模型的分块可以并存，迁移期间新旧模型各有一份；未记录模型的旧分块视为当前模型的，一并替换。
+    内容发生变化时传入 other_models_stale=True，删除所有模型的分块。
+    """
+    if other_models_stale:
+        conn.execute("DELETE FROM prompt_chunks WHERE prompt_id = ?", (prompt_id,))
+    else:
+        conn.execute("DELETE FROM prompt_chunks WHERE prompt_id = ? AND (embedding_model IS ? OR embedding_model IS NULL)",
+                     (prompt_id, embedding_model))
+    conn.executemany(
+        f'''INSERT INTO prompt_chunks (prompt_id, chunk_index, start_offset, end_offset, embedding,
+                                       embedding_model, embedding_dim, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, {NOW})''',
+        [(prompt_id, i, start, end, embedding, embedding_model, len(embedding))
+         for i, (start, end, embedding) in enumerate(chunks)])
+
+@profiler.timed('database.get_all_prompts_with_embeddings')
 def get_all_prompts_with_embeddings():
     """获取所有包含ID和embedding的提示词。"""
     conn = get_db_connection()
@@ -65,27 +262,111 @@ def get_all_prompts_with_embeddings():
     conn.close()
     return prompts
 
-def semantic_search_prompts(query_embedding, limit=10):
-    """执行语义搜索并返回排序后的提示词ID列表。"""
-    all_prompts = get_all_prompts_with_embeddings()
-    if not all_prompts:
-        return []
+def _embedding_filter(alias, embedding_model, dimension):
+    """只使用 embedding_model 生成的向量；未记录模型的旧向量只要维度一致也可以使用。"""
+    conditions = []
+    if embedding_model is not None:
+        conditions.append(f"({alias}.embedding_model = :model OR {alias}.embedding_model IS NULL)")
+    if dimension is not None:
+        conditions.append(f"{alias}.embedding_dim = :dimension")
+    return ' AND '.join(conditions) or '1'
 
-    ids = [p['id'] for p in all_prompts]
-    embeddings = np.array([p['embedding'] for p in all_prompts])
-    
-    # 计算余弦相似度
-    query_embedding = query_embedding.reshape(1, -1) # Reshape for broadcasting
-    sim = np.dot(embeddings, query_embedding.T) / (np.linalg.norm(embeddings, axis=1, keepdims=True) * np.linalg.norm(query_embedding, keepdims=True))
-    sim = sim.flatten()
+def iter_embeddings(batch_size=1000, embedding_model=None):
+    """分批读取 (id, embedding)，避免一次把整个向量库载入为 Python 对象。"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(f"""
+            SELECT id, embedding FROM prompts p
+            WHERE embedding IS NOT NULL AND {_embedding_filter('p', embedding_model, None)}
+            ORDER BY id
+        """, {'model': embedding_model})
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
 
-    # 获取排序后的索引
-    sorted_indices = np.argsort(sim)[::-1] # 降序
+def _id_groups(ids, size=500):
+    """ids 为 None 时返回 [None]（不限制），否则按 size 分组，避免超出 SQL 参数个数的上限。"""
+    if ids is None:
+        return [None]
+    ids = list(ids)
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
 
-    # 返回排序后的ID
-    sorted_ids = [ids[i] for i in sorted_indices[:limit]]
-    return sorted_ids
+@profiler.timed('database.get_embedding_chunks')
+def get_embedding_chunks(dimension=None, embedding_model=None, ids=None):
+    """返回检索用的向量矩阵 (chunk_prompt_ids, matrix)，矩阵每行已归一化。
 
+    每个分块一行；尚未分块的旧提示词以 prompts.embedding 作为唯一的一块。
+    给出 embedding_model 时只使用该模型的向量。只保留 dimension 维的向量，
+    未指定时使用该模型向量的维度，没有时使用最常见的维度。ids 不为 None 时只返回这些提示词的分块。
+    """
+    chunk_filter = _embedding_filter('c', embedding_model, dimension)
+    conn = get_db_connection()
+    rows = []
+    for group in _id_groups(ids):
+        params = {'model': embedding_model, 'dimension': dimension}
+        if group is None:
+            chunk_ids = prompt_ids = '1'
+        else:
+            params.update((f'id{i}', prompt_id) for i, prompt_id in enumerate(group))
+            placeholders = ', '.join(f':id{i}' for i in range(len(group)))
+            chunk_ids, prompt_ids = f"c.prompt_id IN ({placeholders})", f"p.id IN ({placeholders})"
+        rows.extend(conn.execute(f'''
+            SELECT prompt_id, embedding, embedding_model, embedding_dim FROM prompt_chunks c
+            WHERE {chunk_filter} AND {chunk_ids}
+            UNION ALL
+            SELECT id, embedding, embedding_model, embedding_dim FROM prompts p
+            WHERE embedding IS NOT NULL AND {_embedding_filter('p', embedding_model, dimension)} AND {prompt_ids}
+              AND NOT EXISTS (SELECT 1 FROM prompt_chunks c WHERE c.prompt_id = p.id AND {chunk_filter})
+        ''', params).fetchall())
+    conn.close()
+    if dimension is None and rows:
+        tagged = [r for r in rows if embedding_model is not None and r['embedding_model'] == embedding_model]
+        dimension = Counter(len(r['embedding']) for r in (tagged or rows)).most_common(1)[0][0]
+    rows = [r for r in rows if len(r['embedding']) == dimension]
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, dimension or 0), dtype=np.float32)
+    prompt_ids = np.array([r['prompt_id'] for r in rows], dtype=np.int64)
+    matrix = np.vstack([r['embedding'] for r in rows]).astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1, norms)
+    return prompt_ids, matrix
+
+def rank_prompts_by_chunk_scores(chunk_prompt_ids, scores, limit):
+    """按 max-sim 聚合分块得分：每个提示词取其最相似分块的得分，返回 [(prompt_id, score), ...]。"""
+    if not len(scores):
+        return []
+    # 先取得分最高的一部分分块，通常已经覆盖 limit 个不同的提示词，不够时再对全部分块排序
+    candidates = min(len(scores), limit * 8)
+    while True:
+        top = np.argpartition(-scores, candidates - 1)[:candidates] if candidates < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        ordered_ids = chunk_prompt_ids[top]
+        _, first = np.unique(ordered_ids, return_index=True)
+        first.sort()
+        if len(first) >= limit or candidates >= len(scores):
+            break
+        candidates = min(len(scores), candidates * 4)
+    first = first[:limit]
+    return [(int(ordered_ids[i]), float(scores[top[i]])) for i in first]
+
+@profiler.timed('database.semantic_search_prompts')
+def semantic_search_prompts(query_embedding, limit=10, embedding_model=None):
+    """执行语义搜索并返回排序后的提示词ID列表。只与 embedding_model（查询向量所用的模型）生成的向量比较。"""
+    query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    chunk_prompt_ids, matrix = get_embedding_chunks(dimension=len(query_embedding), embedding_model=embedding_model)
+    if not len(chunk_prompt_ids):
+        return []
+
+    # 计算余弦相似度（矩阵已归一化），每个提示词取最相似的分块
+    norm = np.linalg.norm(query_embedding)
+    sim = matrix @ (query_embedding / (norm if norm else 1))
+    return [prompt_id for prompt_id, _ in rank_prompts_by_chunk_scores(chunk_prompt_ids, sim, limit)]
+
+@profiler.timed('database.get_prompts_by_ids')
 def get_prompts_by_ids(ids):
     """根据ID列表获取提示词。"""
     if not ids:
@@ -104,10 +385,11 @@ def get_prompts_by_ids(ids):
 
 # (Other functions like search_prompts, get_prompt_details, etc. remain)
 
+@profiler.timed('database.search_prompts')
 def search_prompts(query=""):
     conn = get_db_connection()
     if not query:
-        prompts = conn.execute('SELECT id, title FROM prompts ORDER BY updated_at DESC').fetchall()
+        prompts = conn.execute('SELECT id, title FROM prompts ORDER BY updated_at DESC, id DESC').fetchall()
     else:
         search_term = f'%{query}%'
         prompts = conn.execute('''
@@ -116,22 +398,348 @@ def search_prompts(query=""):
             LEFT JOIN prompt_tags pt ON p.id = pt.prompt_id
             LEFT JOIN tags t ON pt.tag_id = t.id
             WHERE p.title LIKE ? OR t.name LIKE ?
-            ORDER BY p.updated_at DESC
+            ORDER BY p.updated_at DESC, p.id DESC
         ''', (search_term, search_term)).fetchall()
     conn.close()
     return prompts
 
+def get_catalogue_rows(conn, ids=None):
+    """内存目录使用的数据（在调用方的连接和事务中执行）：返回 ([(id, 标题, updated_at 的文本), ...],
+    {id: [标签名, ...]})。ids 为 None 时返回全部提示词，已删除的 ID 不会出现在结果中。"""
+    rows, tags = [], {}
+    for group in _id_groups(ids):
+        where, params = ('', ()) if group is None else (f"WHERE p.id IN ({', '.join('?' * len(group))})", group)
+        rows.extend(conn.execute(f"SELECT p.id, p.title, CAST(p.updated_at AS TEXT) FROM prompts p {where}",
+                                 params).fetchall())
+        for prompt_id, name in conn.execute(f'''
+            SELECT pt.prompt_id, t.name FROM prompt_tags pt
+            JOIN prompts p ON p.id = pt.prompt_id JOIN tags t ON t.id = pt.tag_id {where}
+        ''', params):
+            tags.setdefault(prompt_id, []).append(name)
+    return [tuple(row) for row in rows], tags
+
+def get_prompt_changes(conn, after_seq):
+    """返回 prompt_changes 中的 (最小 seq, 最大 seq, after_seq 之后变化过的提示词 ID 集合)。日志为空时 seq 为 None。"""
+    # 分成两个子查询，SQLite 才会直接从主键两端取值而不是扫描整个表
+    first, last = conn.execute(
+        "SELECT (SELECT MIN(seq) FROM prompt_changes), (SELECT MAX(seq) FROM prompt_changes)").fetchone()
+    changed = {row[0] for row in conn.execute("SELECT prompt_id FROM prompt_changes WHERE seq > ? AND seq <= ?",
+                                              (after_seq, last or 0))}
+    return first, last, changed
+
+@profiler.timed('database.get_prompt_details')
 def get_prompt_details(prompt_id):
     conn = get_db_connection()
+    # version 列在保存时作为乐观并发检查的版本号
     prompt = conn.execute('SELECT * FROM prompts WHERE id = ?', (prompt_id,)).fetchone()
     conn.close()
     return prompt
 
-def delete_prompt(prompt_id):
+def count_prompts():
     conn = get_db_connection()
-    conn.execute('DELETE FROM prompts WHERE id = ?', (prompt_id,))
-    conn.commit()
+    count = conn.execute("SELECT COUNT(*) FROM prompts").fetchone()[0]
     conn.close()
+    return count
+
+@profiler.timed('database.get_prompts_with_content')
+def get_prompts_with_content(ids=None, missing_embedding_only=False, embedding_model=None):
+    """一次查询取出多个提示词的 id、标题和内容；ids 为 None 时返回全部。
+
+    missing_embedding_only 为 True 时只返回没有向量、或向量不是由 embedding_model 生成的提示词。
+    """
+    conn = get_db_connection()
+    query = "SELECT id, title, content FROM prompts"
+    conditions, params = [], []
+    if ids is not None:
+        if not ids:
+            conn.close()
+            return []
+        conditions.append(f"id IN ({', '.join('?' * len(ids))})")
+        params.extend(ids)
+    if missing_embedding_only and embedding_model is not None:
+        conditions.append("(embedding IS NULL OR embedding_model != ?)")
+        params.append(embedding_model)
+    elif missing_embedding_only:
+        conditions.append("embedding IS NULL")
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    prompts = conn.execute(query + " ORDER BY updated_at DESC", params).fetchall()
+    conn.close()
+    return prompts
+
+@profiler.timed('database.get_search_corpus')
+def get_search_corpus(ids=None):
+    """一次性取出构建内存索引所需的全部字段，标签以逗号拼接。ids 不为 None 时只取这些提示词（已删除的不返回）。"""
+    conn = get_db_connection()
+    prompts = []
+    for group in _id_groups(ids):
+        where, params = ('', ()) if group is None else (f"WHERE p.id IN ({', '.join('?' * len(group))})", group)
+        prompts.extend(conn.execute(f'''
+            SELECT p.id, p.title, p.content, p.embedding, group_concat(t.name, ',') AS tags
+            FROM prompts p
+            LEFT JOIN prompt_tags pt ON p.id = pt.prompt_id
+            LEFT JOIN tags t ON pt.tag_id = t.id
+            {where}
+            GROUP BY p.id
+            ORDER BY p.updated_at DESC
+        ''', params).fetchall())
+    conn.close()
+    return prompts
+
+# --- Embedding 模型迁移 ---
+
+@profiler.timed('database.get_embedding_model_counts')
+def get_embedding_model_counts():
+    """返回 {embedding_model: 有该模型向量的提示词数量}，未记录模型的旧向量计在 None 下。"""
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT embedding_model, COUNT(DISTINCT prompt_id) AS n FROM (
+            SELECT prompt_id, embedding_model FROM prompt_chunks
+            UNION ALL
+            SELECT id, embedding_model FROM prompts WHERE embedding IS NOT NULL
+        ) GROUP BY embedding_model
+    ''').fetchall()
+    conn.close()
+    return {row['embedding_model']: row['n'] for row in rows}
+
+@profiler.timed('database.create_embedding_migration')
+def create_embedding_migration(source_model, target_model, total):
+    """登记一次迁移并返回其 ID。已有相同目标的进行中迁移时直接返回它，其他进行中的迁移被取消。
+
+    未记录模型的旧向量在这里归为 source_model，之后写入目标模型的分块时不会误删它们。
+    """
+    def write(conn):
+        running = conn.execute("SELECT id, target_model FROM embedding_migrations WHERE status = 'running'").fetchall()
+        for row in running:
+            if row['target_model'] == target_model:
+                return row['id']
+            conn.execute(f"UPDATE embedding_migrations SET status = 'cancelled', updated_at = {NOW} WHERE id = ?",
+                         (row['id'],))
+        if source_model is not None:
+            conn.execute("UPDATE prompt_chunks SET embedding_model = ? WHERE embedding_model IS NULL", (source_model,))
+            conn.execute("UPDATE prompts SET embedding_model = ? WHERE embedding_model IS NULL AND embedding IS NOT NULL",
+                         (source_model,))
+        cursor = conn.execute(f'''
+            INSERT INTO embedding_migrations (source_model, target_model, total, started_at, updated_at)
+            VALUES (?, ?, ?, {NOW}, {NOW})
+        ''', (source_model, target_model, total))
+        return cursor.lastrowid
+
+    return run_in_write_transaction(write)
+
+@profiler.timed('database.get_embedding_migration')
+def get_embedding_migration(migration_id=None):
+    """按 ID 取出迁移记录；未给出 ID 时返回进行中的迁移（没有则返回 None）。"""
+    conn = get_db_connection()
+    if migration_id is None:
+        row = conn.execute("SELECT * FROM embedding_migrations WHERE status = 'running' ORDER BY id DESC LIMIT 1").fetchone()
+    else:
+        row = conn.execute("SELECT * FROM embedding_migrations WHERE id = ?", (migration_id,)).fetchone()
+    conn.close()
+    return row
+
+def set_embedding_migration_status(migration_id, status, error=None):
+    run_in_write_transaction(lambda conn: conn.execute(
+        f"UPDATE embedding_migrations SET status = ?, error = ?, updated_at = {NOW} WHERE id = ?",
+        (status, error, migration_id)))
+
+@profiler.timed('database.get_prompts_for_embedding')
+def get_prompts_for_embedding(after_id, limit, missing_model=None, migration_id=None):
+    """按 ID 顺序分页取出 id > after_id 的提示词内容及其版本号。
+
+    给出 missing_model 时只返回还没有该模型分块的提示词（迁移的补齐阶段）；
+    给出 migration_id 时跳过在该迁移中生成失败、之后也没有被修改过的提示词。
+    """
+    query = "SELECT id, content, version FROM prompts p WHERE id > ?"
+    params = [after_id]
+    if missing_model is not None:
+        query += " AND NOT EXISTS (SELECT 1 FROM prompt_chunks c WHERE c.prompt_id = p.id AND c.embedding_model = ?)"
+        params.append(missing_model)
+    if migration_id is not None:
+        query += (" AND NOT EXISTS (SELECT 1 FROM embedding_migration_failures f"
+                  " WHERE f.migration_id = ? AND f.prompt_id = p.id AND f.version = p.version)")
+        params.append(migration_id)
+    conn = get_db_connection()
+    prompts = conn.execute(query + " ORDER BY id LIMIT ?", params + [limit]).fetchall()
+    conn.close()
+    return prompts
+
+@profiler.timed('database.save_embedding_migration_batch')
+def save_embedding_migration_batch(migration_id, target_model, items, cursor=None, processed=0, failures=()):
+    """写入一批目标模型的分块 [(prompt_id, version, chunks), ...] 并推进游标，返回实际写入的数量。
+
+    只写入版本号与读取时一致的提示词；期间被修改过的提示词留给补齐阶段重新生成。
+    failures 为生成失败的 [(prompt_id, version, 错误), ...]，与游标在同一事务中记录。
+    不修改 prompts.embedding，切换之前检索仍然使用旧模型。
+    """
+    def write(conn):
+        written = 0
+        for prompt_id, version, chunks in items:
+            current = get_prompt_version(prompt_id, conn)
+            if current is None or current != version:
+                continue
+            replace_prompt_chunks(conn, prompt_id, chunks, target_model)
+            conn.execute("DELETE FROM embedding_migration_failures WHERE migration_id = ? AND prompt_id = ?",
+                         (migration_id, prompt_id))
+            written += 1
+        conn.executemany('''
+            INSERT OR REPLACE INTO embedding_migration_failures (migration_id, prompt_id, version, error)
+            VALUES (?, ?, ?, ?)
+        ''', [(migration_id, prompt_id, version, error) for prompt_id, version, error in failures])
+        if cursor is not None:
+            conn.execute(f'''
+                UPDATE embedding_migrations SET cursor = ?, processed = processed + ?, updated_at = {NOW}
+                WHERE id = ?
+            ''', (cursor, processed, migration_id))
+        return written
+
+    return run_in_write_transaction(write)
+
+def get_embedding_migration_failures(migration_id):
+    """返回迁移中生成失败、之后也没有补上的提示词 [(prompt_id, title, error), ...]。"""
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT f.prompt_id, p.title, f.error FROM embedding_migration_failures f
+        JOIN prompts p ON p.id = f.prompt_id
+        WHERE f.migration_id = ?
+        ORDER BY f.prompt_id
+    ''', (migration_id,)).fetchall()
+    conn.close()
+    return rows
+
+@profiler.timed('database.finish_embedding_migration')
+def finish_embedding_migration(migration_id, target_model):
+    """在一个事务中完成切换：用目标模型的分块重新计算文档向量，删除其他模型的向量，标记迁移完成。"""
+    def write(conn):
+        def flush(prompt_id, vectors):
+            matrix = np.vstack(vectors).astype(np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            document = (matrix / np.where(norms == 0, 1, norms)).mean(axis=0).astype(np.float32)
+            conn.execute("UPDATE prompts SET embedding = ?, embedding_model = ?, embedding_dim = ? WHERE id = ?",
+                         (document, target_model, len(document), prompt_id))
+
+        # 没有目标模型分块的提示词（内容为空）不再保留旧模型的文档向量
+        conn.execute('''
+            UPDATE prompts SET embedding = NULL, embedding_model = NULL, embedding_dim = NULL
+            WHERE NOT EXISTS (SELECT 1 FROM prompt_chunks c WHERE c.prompt_id = prompts.id AND c.embedding_model = ?)
+        ''', (target_model,))
+        rows = conn.execute("SELECT prompt_id, embedding FROM prompt_chunks WHERE embedding_model = ? ORDER BY prompt_id, chunk_index",
+                            (target_model,))
+        current_id, vectors = None, []
+        while True:
+            batch = rows.fetchmany(1000)
+            if not batch:
+                break
+            for row in batch:
+                if row['prompt_id'] != current_id:
+                    if vectors:
+                        flush(current_id, vectors)
+                    current_id, vectors = row['prompt_id'], []
+                vectors.append(row['embedding'])
+        if vectors:
+            flush(current_id, vectors)
+        conn.execute("DELETE FROM prompt_chunks WHERE embedding_model IS NOT ?", (target_model,))
+        conn.execute(f"UPDATE embedding_migrations SET status = 'completed', error = NULL, updated_at = {NOW} WHERE id = ?",
+                     (migration_id,))
+
+    run_in_write_transaction(write)
+
+# --- 批量 AI 任务 ---
+
+@profiler.timed('database.get_prompt_ids_by_tag')
+def get_prompt_ids_by_tag(tag_name):
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT pt.prompt_id FROM prompt_tags pt JOIN tags t ON pt.tag_id = t.id
+        WHERE t.name = ? ORDER BY pt.prompt_id
+    ''', (tag_name,)).fetchall()
+    conn.close()
+    return [row['prompt_id'] for row in rows]
+
+def add_prompt_version(conn, prompt_id, content):
+    """新增一条历史版本（在调用方的事务中执行），不修改提示词当前的内容，返回版本 ID。"""
+    cursor = conn.execute(f'INSERT INTO prompt_versions (prompt_id, content, saved_at) VALUES (?, ?, {NOW})',
+                          (prompt_id, content))
+    return cursor.lastrowid
+
+@profiler.timed('database.create_batch_job')
+def create_batch_job(mode, instructions, prompt_ids):
+    def write(conn):
+        cursor = conn.execute(f"INSERT INTO batch_jobs (mode, instructions, created_at, updated_at) VALUES (?, ?, {NOW}, {NOW})",
+                              (mode, instructions))
+        job_id = cursor.lastrowid
+        conn.executemany("INSERT OR IGNORE INTO batch_job_items (job_id, prompt_id) VALUES (?, ?)",
+                         [(job_id, prompt_id) for prompt_id in prompt_ids])
+        return job_id
+
+    return run_in_write_transaction(write)
+
+@profiler.timed('database.get_batch_job')
+def get_batch_job(job_id=None):
+    """按 ID 取出任务及各状态的条目数；未给出 ID 时返回最近一个未完成的任务（没有则返回 None）。"""
+    conn = get_db_connection()
+    if job_id is None:
+        job = conn.execute("SELECT * FROM batch_jobs WHERE status = 'running' ORDER BY id DESC LIMIT 1").fetchone()
+    else:
+        job = conn.execute("SELECT * FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+    if job is None:
+        conn.close()
+        return None
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM batch_job_items WHERE job_id = ? GROUP BY status",
+                               (job['id'],)).fetchall())
+    conn.close()
+    result = dict(job)
+    result.update({'pending': counts.get('pending', 0), 'done': counts.get('done', 0),
+                   'failed': counts.get('failed', 0)})
+    result['total'] = result['pending'] + result['done'] + result['failed']
+    return result
+
+@profiler.timed('database.get_batch_job_items')
+def get_batch_job_items(job_id, statuses=('pending',)):
+    """返回任务中处于 statuses 状态的条目及其提示词的标题和内容。"""
+    conn = get_db_connection()
+    items = conn.execute(f'''
+        SELECT i.prompt_id, i.status, i.error, p.title, p.content
+        FROM batch_job_items i LEFT JOIN prompts p ON p.id = i.prompt_id
+        WHERE i.job_id = ? AND i.status IN ({', '.join('?' * len(statuses))})
+        ORDER BY i.prompt_id
+    ''', (job_id, *statuses)).fetchall()
+    conn.close()
+    return items
+
+@profiler.timed('database.complete_batch_job_item')
+def complete_batch_job_item(job_id, prompt_id, content):
+    """在一个事务中把结果保存为新的历史版本并标记条目完成，返回版本 ID；提示词已被删除时返回 None。"""
+    def write(conn):
+        if conn.execute("SELECT 1 FROM prompts WHERE id = ?", (prompt_id,)).fetchone() is None:
+            conn.execute("UPDATE batch_job_items SET status = 'failed', error = ? WHERE job_id = ? AND prompt_id = ?",
+                         ("提示词已被删除", job_id, prompt_id))
+            return None
+        version_id = add_prompt_version(conn, prompt_id, content)
+        conn.execute('''
+            UPDATE batch_job_items SET status = 'done', version_id = ?, error = NULL
+            WHERE job_id = ? AND prompt_id = ?
+        ''', (version_id, job_id, prompt_id))
+        return version_id
+
+    return run_in_write_transaction(write)
+
+def fail_batch_job_item(job_id, prompt_id, error):
+    run_in_write_transaction(lambda conn: conn.execute(
+        "UPDATE batch_job_items SET status = 'failed', error = ? WHERE job_id = ? AND prompt_id = ?",
+        (error, job_id, prompt_id)))
+
+def set_batch_job_status(job_id, status):
+    run_in_write_transaction(lambda conn: conn.execute(
+        f"UPDATE batch_jobs SET status = ?, updated_at = {NOW} WHERE id = ?", (status, job_id)))
+
+@profiler.timed('database.delete_prompt')
+def delete_prompt(prompt_id):
+    def write(conn):
+        conn.execute('DELETE FROM prompts WHERE id = ?', (prompt_id,))
+        conn.execute('DELETE FROM prompt_chunks WHERE prompt_id = ?', (prompt_id,))
+
+    run_in_write_transaction(write)
 
 def get_or_create_tag_id(conn, name):
     cursor = conn.cursor()
@@ -143,21 +751,24 @@ def get_or_create_tag_id(conn, name):
         cursor.execute("INSERT INTO tags (name) VALUES (?)", (name,))
         return cursor.lastrowid
 
+def _replace_prompt_tags(conn, prompt_id, tags):
+    conn.execute("DELETE FROM prompt_tags WHERE prompt_id = ?", (prompt_id,))
+    for tag_name in tags:
+        tag_id = get_or_create_tag_id(conn, tag_name)
+        conn.execute("INSERT INTO prompt_tags (prompt_id, tag_id) VALUES (?, ?)", (prompt_id, tag_id))
+
+@profiler.timed('database.update_prompt_tags')
 def update_prompt_tags(prompt_id, tags):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM prompt_tags WHERE prompt_id = ?", (prompt_id,))
-        for tag_name in tags:
-            tag_id = get_or_create_tag_id(conn, tag_name)
-            cursor.execute("INSERT INTO prompt_tags (prompt_id, tag_id) VALUES (?, ?)", (prompt_id, tag_id))
-        conn.commit()
+        def write(conn):
+            _replace_prompt_tags(conn, prompt_id, tags)
+            conn.execute("UPDATE prompts SET version = version + 1 WHERE id = ?", (prompt_id,))
+
+        run_in_write_transaction(write)
     except Exception as e:
-        conn.rollback()
         print(f"更新标签时出错: {e}")
-    finally:
-        conn.close()
 
+@profiler.timed('database.get_prompt_tags')
 def get_prompt_tags(prompt_id):
     conn = get_db_connection()
     tags = conn.execute('''
@@ -168,12 +779,14 @@ def get_prompt_tags(prompt_id):
     conn.close()
     return [tag['name'] for tag in tags]
 
+@profiler.timed('database.get_prompt_versions')
 def get_prompt_versions(prompt_id):
     conn = get_db_connection()
     versions = conn.execute('SELECT id, content, saved_at FROM prompt_versions WHERE prompt_id = ? ORDER BY saved_at DESC', (prompt_id,)).fetchall()
     conn.close()
     return versions
 
+@profiler.timed('database.get_version_content')
 def get_version_content(version_id):
     conn = get_db_connection()
     version = conn.execute('SELECT content FROM prompt_versions WHERE id = ?', (version_id,)).fetchone()
@@ -0,0 +1,313 @@
+import os
+import tempfile
+import zlib
+from collections import Counter
+
+import numpy as np
+
+import database
+import profiler
+
+DEFAULT_THRESHOLD = 0.95
+# 分块计算时相似度矩阵等工作集的上限。向量矩阵本身放在磁盘上的内存映射中，由操作系统按需调入调出，
+# 不计入该上限；此外每个提示词还有数十字节的 ID、校验和与聚类标签数组常驻内存，
+# 返回结果中的 ID 列表和聚类标签字典也与提示词数量成正比。
+DEFAULT_MEMORY_LIMIT_MB = 256
+
+
+def default_cache_path():
+    return os.path.join(os.path.dirname(database.DATABASE_PATH), 'dedup_cache.npz')
+
+
+# --- 向量矩阵 ---
+
+def load_embedding_matrix(mmap_path=None, embedding_model=None):
+    """读取 embedding_model 生成的向量（未给出时读取全部）并按行归一化，返回 (ids, checksums, matrix)。
+
+    只保留最常见维度的向量。矩阵总是写入磁盘上的 np.memmap 并按批次流式填充，
+    这样即使向量库很大，常驻内存也只有分块计算时的工作集。提供 mmap_path 时写入该 .npy 文件并保留，
+    否则使用数据库旁的匿名临时文件，矩阵释放后自动删除。
+    """
+    dims = Counter()
+    count = 0
+    for rows in database.iter_embeddings(embedding_model=embedding_model):
+        for row in rows:
+            dims[len(row['embedding'])] += 1
+            count += 1
+    if not count:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint32), np.zeros((0, 0), dtype=np.float32)
+    dim, n = dims.most_common(1)[0]
+    if mmap_path:
+        matrix = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=np.float32, shape=(n, dim))
+    else:
+        # 不放在系统临时目录中：那里常常是内存文件系统 (tmpfs)
+        with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(database.DATABASE_PATH))) as f:
+            matrix = np.memmap(f, dtype=np.float32, mode='w+', shape=(n, dim))
+    ids = np.empty(n, dtype=np.int64)
+    checksums = np.empty(n, dtype=np.uint32)
+    i = 0
+    for rows in database.iter_embeddings(embedding_model=embedding_model):
+        rows = [r for r in rows if len(r['embedding']) == dim]
+        if not rows:
+            continue
+        block = np.vstack([r['embedding'] for r in rows])
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        matrix[i:i + len(rows)] = block / np.where(norms == 0, 1, norms)
+        ids[i:i + len(rows)] = [r['id'] for r in rows]
+        checksums[i:i + len(rows)] = [zlib.crc32(r['embedding'].tobytes()) for r in rows]
+        i += len(rows)
+    return ids, checksums, matrix
+
+
+def block_rows(n_columns, memory_limit_mb):
+    """在内存上限内，每块相似度矩阵可以包含的行数（float32 分数 + 比较结果掩码）。"""
+    bytes_per_row = max(1, n_columns) * 5
+    return max(1, int(memory_limit_mb * 1024 * 1024 // bytes_per_row))
+
+
+# --- 近似重复 ---
+
+def _hits(sims, threshold):
+    # 绝大多数行没有命中，先按行筛选再取坐标，避免在整块掩码上调用 nonzero
+    mask = sims >= threshold
+    hit_rows = np.flatnonzero(mask.any(axis=1))
+    r, c = np.nonzero(mask[hit_rows])
+    return hit_rows[r], c
+
+
+@profiler.timed('dedup.find_duplicate_pairs')
+def find_duplicate_pairs(matrix, threshold=DEFAULT_THRESHOLD, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB, rows=None):
+    """分块计算相似度，返回相似度不低于 threshold 的行号对 (i, j, sim)，其中 i < j。
+
+    rows 为 None 时计算全部两两组合（每块只计算上三角部分）；
+    否则只计算 rows 中各行与所有行的组合（用于增量更新）。
+    """
+    n = len(matrix)
+    pair_i, pair_j, pair_sim = [], [], []
+    if rows is None:
+        step = block_rows(n, memory_limit_mb)
+        for start in range(0, n, step):
+            stop = min(start + step, n)
+            sims = matrix[start:stop] @ matrix[start:].T
+            r, c = _hits(sims, threshold)
+            keep = c > r
+            r, c = r[keep], c[keep]
+            pair_i.append(r + start)
+            pair_j.append(c + start)
+            pair_sim.append(sims[r, c])
+    else:
+        rows = np.asarray(rows, dtype=np.int64)
+        is_target = np.zeros(n, dtype=bool)
+        is_target[rows] = True
+        step = block_rows(n, memory_limit_mb)
+        for start in range(0, len(rows), step):
+            block_rows_index = rows[start:start + step]
+            sims = matrix[block_rows_index] @ matrix.T
+            r, c = _hits(sims, threshold)
+            g = block_rows_index[r]
+            # 两端都是目标行时只保留一次，且排除自身
+            keep = (c != g) & (~is_target[c] | (c > g))
+            r, c, g = r[keep], c[keep], g[keep]
+            pair_i.append(np.minimum(g, c))
+            pair_j.append(np.maximum(g, c))
+            pair_sim.append(sims[r, c])
+    if not pair_i:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    return np.concatenate(pair_i), np.concatenate(pair_j), np.concatenate(pair_sim).astype(np.float32)
+
+
+def group_pairs(pair_a, pair_b):
+    """用并查集把成对的重复关系合并成重复组，返回按组大小降序排列的列表。"""
+    parent = {}
+
+    def find(x):
+        root = x
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while parent.get(x, x) != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for a, b in zip(pair_a.tolist(), pair_b.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    groups = {}
+    for x in set(pair_a.tolist()) | set(pair_b.tolist()):
+        groups.setdefault(find(x), []).append(x)
+    result = [sorted(members) for members in groups.values()]
+    result.sort(key=lambda g: (-len(g), g[0]))
+    return result
+
+
+# --- 聚类 ---
+
+def _assign(matrix, centroids, memory_limit_mb):
+    labels = np.empty(len(matrix), dtype=np.int32)
+    step = block_rows(len(centroids), memory_limit_mb)
+    for start in range(0, len(matrix), step):
+        labels[start:start + step] = np.argmax(matrix[start:start + step] @ centroids.T, axis=1)
+    return labels
+
+
+def _centroid_sums(matrix, labels, k, memory_limit_mb):
+    # 用 one-hot 矩阵乘法按块累加，比 np.add.at 快得多
+    sums = np.zeros((k, matrix.shape[1]), dtype=np.float64)
+    step = block_rows(k, memory_limit_mb)
+    for start in range(0, len(matrix), step):
+        block_labels = labels[start:start + step]
+        one_hot = np.zeros((len(block_labels), k), dtype=np.float32)
+        one_hot[np.arange(len(block_labels)), block_labels] = 1
+        sums += one_hot.T @ matrix[start:start + step]
+    counts = np.bincount(labels, minlength=k)
+    return sums, counts
+
+
+def _normalize(centroids):
+    norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+    return (centroids / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+@profiler.timed('dedup.kmeans')
+def kmeans(matrix, k, iterations=20, seed=0, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB, sample_size=10000):
+    """球面 k-means（基于余弦相似度），返回 (labels, centroid_sums, counts)。
+
+    初始中心用 k-means++ 在随机样本上选取；分配步骤按块计算，内存受 memory_limit_mb 限制。
+    """
+    n = len(matrix)
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    sample = matrix[np.sort(rng.choice(n, size=min(n, sample_size), replace=False))]
+    centers = [sample[rng.integers(len(sample))]]
+    closest = 1 - sample @ centers[0]
+    for _ in range(1, k):
+        weights = np.clip(closest, 0, None)
+        total = weights.sum()
+        index = rng.choice(len(sample), p=weights / total) if total > 0 else rng.integers(len(sample))
+        centers.append(sample[index])
+        closest = np.minimum(closest, 1 - sample @ sample[index])
+    centroids = np.array(centers, dtype=np.float32)
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = _assign(matrix, centroids, memory_limit_mb)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sums, counts = _centroid_sums(matrix, labels, k, memory_limit_mb)
+        empty = counts == 0
+        sums[empty] = centroids[empty]
+        centroids = _normalize(sums)
+    sums, counts = _centroid_sums(matrix, labels, k, memory_limit_mb)
+    return labels, sums, counts
+
+
+# --- 缓存与增量更新 ---
+
+class DedupResult:
+    __slots__ = ('ids', 'groups', 'pairs', 'labels', 'cluster_sizes', 'incremental')
+
+    def __init__(self, ids, groups, pairs, labels, cluster_sizes, incremental):
+        self.ids = ids
+        self.groups = groups
+        self.pairs = pairs
+        self.labels = labels
+        self.cluster_sizes = cluster_sizes
+        self.incremental = incremental
+
+
+def _lookup_rows(keys, values):
+    """返回 values 中每个 ID 在 keys 中的行号，不存在时为 -1。"""
+    if not len(keys):
+        return np.full(len(values), -1, dtype=np.int64)
+    order = np.argsort(keys, kind='stable')
+    positions = np.minimum(np.searchsorted(keys, values, sorter=order), len(keys) - 1)
+    rows = order[positions]
+    return np.where(keys[rows] == values, rows, -1)
+
+
+def _load_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as data:
+            return {key: data[key] for key in data.files}
+    except (IOError, ValueError):
+        return None
+
+
+def _save_cache(cache_path, **arrays):
+    tmp_path = cache_path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+@profiler.timed('dedup.analyze')
+def analyze(threshold=DEFAULT_THRESHOLD, clusters=0, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB,
+            cache_path=None, refresh=False, mmap_path=None, max_incremental_ratio=0.2, embedding_model=None):
+    """查找近似重复的提示词组，并可选地进行 k-means 主题聚类。
+
+    结果缓存在 cache_path（默认在数据库旁边）。再次运行时只对新增或向量发生变化的
+    提示词计算相似度并分配到已有的聚类中心；变化比例超过 max_incremental_ratio、
+    阈值或聚类数改变、或 refresh 为 True 时重新完整计算。
+    """
+    cache_path = cache_path or default_cache_path()
+    ids, checksums, matrix = load_embedding_matrix(mmap_path, embedding_model)
+    n = len(ids)
+    cache = None if refresh else _load_cache(cache_path)
+    if cache is not None and (float(cache['threshold']) != threshold or int(cache['clusters']) != clusters):
+        cache = None
+    if cache is not None and clusters and cache['centroid_sums'].shape[1:] != matrix.shape[1:]:
+        cache = None
+
+    unchanged = np.zeros(n, dtype=bool)
+    if cache is not None:
+        # 用排序后的数组按 ID 查找缓存中的行，而不是建立每个提示词一个 Python 对象的字典
+        cached_rows = _lookup_rows(cache['ids'], ids)
+        found = cached_rows >= 0
+        unchanged[found] = cache['checksums'][cached_rows[found]] == checksums[found]
+        if n and (n - unchanged.sum()) / n > max_incremental_ratio:
+            cache = None
+    incremental = cache is not None
+
+    if incremental:
+        # 保留两端都未变化的旧结果，只为变化的行重新计算
+        stable_ids = ids[unchanged]
+        keep = np.isin(cache['pair_a'], stable_ids) & np.isin(cache['pair_b'], stable_ids)
+        old_a, old_b, old_sim = cache['pair_a'][keep], cache['pair_b'][keep], cache['pair_sim'][keep]
+        changed_rows = np.nonzero(~unchanged)[0]
+        if len(changed_rows):
+            i, j, sim = find_duplicate_pairs(matrix, threshold, memory_limit_mb, rows=changed_rows)
+            pair_a = np.concatenate([old_a, ids[i]])
+            pair_b = np.concatenate([old_b, ids[j]])
+            pair_sim = np.concatenate([old_sim, sim])
+        else:
+            pair_a, pair_b, pair_sim = old_a, old_b, old_sim
+    else:
+        i, j, sim = find_duplicate_pairs(matrix, threshold, memory_limit_mb)
+        pair_a, pair_b, pair_sim = ids[i], ids[j], sim
+
+    labels = np.zeros(0, dtype=np.int32)
+    centroid_sums = np.zeros((0, 0), dtype=np.float64)
+    counts = np.zeros(0, dtype=np.int64)
+    if clusters and n:
+        if incremental and len(cache['labels']):
+            # 未变化的行沿用原来的聚类，变化的行分配到最近的已有中心，然后一次遍历重新累计中心
+            labels = np.full(n, -1, dtype=np.int32)
+            labels[unchanged] = cache['labels'][cached_rows[unchanged]]
+            changed_rows = np.nonzero(labels < 0)[0]
+            if len(changed_rows):
+                labels[changed_rows] = _assign(matrix[changed_rows], _normalize(cache['centroid_sums']),
+                                               memory_limit_mb)
+            centroid_sums, counts = _centroid_sums(matrix, labels, len(cache['counts']), memory_limit_mb)
+        else:
+            labels, centroid_sums, counts = kmeans(matrix, clusters, memory_limit_mb=memory_limit_mb)
+
+    _save_cache(cache_path, ids=ids, checksums=checksums, threshold=np.float64(threshold),
+                clusters=np.int64(clusters), pair_a=pair_a, pair_b=pair_b, pair_sim=pair_sim,
+                labels=labels, centroid_sums=centroid_sums, counts=counts)
+
+    pairs = sorted(zip(pair_a.tolist(), pair_b.tolist(), pair_sim.tolist()), key=lambda p: -p[2])
+    label_map = dict(zip(ids.tolist(), labels.tolist())) if len(labels) else {}
+    return DedupResult(ids.tolist(), group_pairs(pair_a, pair_b), pairs, label_map,
+                       counts.tolist(), incremental)
@@ -0,0 +1,143 @@
+"""在线切换 Embedding 模型。
+
+迁移在后台分批为整个提示词库生成新模型的分块向量，新旧模型的向量并存，期间检索仍然使用
+旧模型。进度（按提示词 ID 的游标）记录在 embedding_migrations 表中，中断后可以从断点继续。
+全部生成后先原子地改写配置文件切换到新模型，再在一个事务中删除旧模型的向量。
+个别提示词生成失败时记录在 embedding_migration_failures 中并跳过，迁移照常完成，
+这些提示词在切换后没有向量，可以用 `cli.py reembed --missing` 补生成。
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import chunking
+import database
+import llm_client
+import profiler
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_WORKERS = 4
+# 补齐阶段最多扫描的轮数；每轮只处理扫描期间没有被再次修改的提示词
+MAX_CATCH_UP_ROUNDS = 5
+
+
+def start(target_model, source_model=None):
+    """登记一次迁移并返回其 ID；已有相同目标的进行中迁移时继续使用它。"""
+    source_model = source_model or llm_client.get_embedding_model()
+    if not target_model:
+        raise ValueError("请指定目标 Embedding 模型。")
+    if target_model == source_model:
+        raise ValueError(f"当前已经在使用 {target_model}。")
+    total = database.count_prompts()
+    return database.create_embedding_migration(source_model, target_model, total)
+
+
+def cancel(migration_id=None):
+    """取消迁移。已生成的目标模型向量保留在库中，但不参与检索，下一次完成的迁移会清理它们。"""
+    migration = database.get_embedding_migration(migration_id)
+    if migration is None:
+        raise ValueError("没有进行中的迁移。")
+    database.set_embedding_migration_status(migration['id'], 'cancelled')
+
+
+def _interrupted(migration_id, stop_event):
+    """本进程要求暂停，或迁移已被（其他进程）取消时返回对应的状态。"""
+    if stop_event is not None and stop_event.is_set():
+        return 'paused'
+    migration = database.get_embedding_migration(migration_id)
+    if migration is None or migration['status'] != 'running':
+        return 'cancelled'
+    return None
+
+
+def _embed_batch(prompts, model, workers):
+    """返回 (成功的 [(prompt_id, version, chunks), ...], 失败的 [(prompt_id, version, 错误), ...])。
+
+    单个提示词的 API 错误不影响同一批的其他提示词；配置错误 (ValueError) 对所有提示词都一样，直接抛出。
+    """
+    def embed(prompt):
+        try:
+            document, chunks = chunking.embed_content(prompt['content'], model=model)
+        except ValueError:
+            raise
+        except Exception as e:
+            return prompt['id'], prompt['version'], None, str(e)
+        return prompt['id'], prompt['version'], chunks, None
+
+    prompts = [p for p in prompts if p['content'].strip()]
+    if workers <= 1 or len(prompts) <= 1:
+        results = [embed(p) for p in prompts]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(embed, prompts))
+    items = [(prompt_id, version, chunks) for prompt_id, version, chunks, error in results if error is None]
+    failures = [(prompt_id, version, error) for prompt_id, version, _, error in results if error is not None]
+    if failures:
+        profiler.increment('embedding_migration.failures', len(failures))
+    return items, failures
+
+
+def _catch_up(migration_id, model, batch_size, workers, stop_event):
+    """为第一遍之后新增或被修改（旧分块随之删除）的提示词补生成目标模型的向量。
+    已经失败过且之后没有被修改的提示词不再重试。
+
+    被中断时返回 'paused' 或 'cancelled'，否则返回 None。
+    """
+    for _ in range(MAX_CATCH_UP_ROUNDS):
+        after_id, written = 0, 0
+        while True:
+            interrupted = _interrupted(migration_id, stop_event)
+            if interrupted:
+                return interrupted
+            prompts = database.get_prompts_for_embedding(after_id, batch_size, missing_model=model,
+                                                         migration_id=migration_id)
+            if not prompts:
+                break
+            items, failures = _embed_batch(prompts, model, workers)
+            written += database.save_embedding_migration_batch(migration_id, model, items, failures=failures)
+            after_id = prompts[-1]['id']
+        if not written:
+            break
+    return None
+
+
+@profiler.timed('embedding_migration.run')
+def run(migration_id=None, batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS, progress=None, stop_event=None):
+    """执行（或继续）迁移，返回 'completed'；stop_event 被设置时在当前批次结束后返回 'paused'，
+    迁移被取消时返回 'cancelled'。
+
+    progress(已处理, 总数) 在每批之后调用。单个提示词生成失败时记录下来并继续，完成后可用
+    database.get_embedding_migration_failures 查看；其他错误记录在迁移中并重新抛出，之后可以继续。
+    """
+    migration = database.get_embedding_migration(migration_id)
+    if migration is None or migration['status'] != 'running':
+        raise ValueError("没有进行中的迁移。")
+    migration_id, model = migration['id'], migration['target_model']
+    after_id, processed, total = migration['cursor'], migration['processed'], migration['total']
+    try:
+        # 第一遍：按 ID 顺序处理全部提示词，游标随每批一起提交
+        while True:
+            interrupted = _interrupted(migration_id, stop_event)
+            if interrupted:
+                return interrupted
+            prompts = database.get_prompts_for_embedding(after_id, batch_size)
+            if not prompts:
+                break
+            items, failures = _embed_batch(prompts, model, workers)
+            after_id, processed = prompts[-1]['id'], processed + len(prompts)
+            database.save_embedding_migration_batch(migration_id, model, items, cursor=after_id,
+                                                    processed=len(prompts), failures=failures)
+            if progress:
+                progress(min(processed, total), max(total, processed))
+        interrupted = _catch_up(migration_id, model, batch_size, workers, stop_event)
+        if interrupted:
+            return interrupted
+
+        # 切换：之后所有进程都用新模型检索和保存；仍在用旧模型保存的少量提示词由再一次补齐覆盖
+        llm_client.save_llm_config({'embedding_model': model})
+        interrupted = _catch_up(migration_id, model, batch_size, workers, stop_event)
+        if interrupted:
+            return interrupted
+        database.finish_embedding_migration(migration_id, model)
+    except Exception as e:
+        database.set_embedding_migration_status(migration_id, 'running', error=str(e))
+        raise
+    return 'completed'
@@ -2,6 +2,8 @@ import requests
 import json
 import os
 
+import profiler
+
 CONFIG_FILE = 'config.json'
 
 def get_llm_config():
@@ -22,9 +24,37 @@ def get_llm_config():
     except (IOError, json.JSONDecodeError):
         return None, None, None, None, None, None
 
-def get_embedding(text):
+def get_embedding_model():
+    """当前配置的 Embedding 模型名称，未配置时返回 None。"""
+    return get_llm_config()[5] or None
+
+def save_llm_config(updates):
+    """把 updates 合并写入配置文件。先写临时文件再替换，其他进程不会读到写了一半的配置。"""
+    config = {}
+    if os.path.exists(CONFIG_FILE):
+        try:
+            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (IOError, json.JSONDecodeError):
+            config = {}
+    config.update(updates)
+    tmp_path = CONFIG_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, CONFIG_FILE)
+
+@profiler.timed('llm_client.get_embedding')
+def get_embedding(text, model=None):
     """获取给定文本的embedding向量。"""
+    return get_embeddings([text], model)[0]
+
+@profiler.timed('llm_client.get_embeddings')
+def get_embeddings(texts, model=None):
+    """在一次请求中获取多段文本的embedding向量，按输入顺序返回。model 默认为配置中的模型。"""
     _, _, _, embedding_base_url, embedding_api_key, embedding_model = get_llm_config()
+    embedding_model = model or embedding_model
     if not all([embedding_base_url, embedding_api_key, embedding_model]):
         raise ValueError("错误：请先在‘设置’中配置Embedding模型的URL、API Key和名称。")
 
@@ -32,7 +62,7 @@ def get_embedding(text):
         "Content-Type": "application/json",
         "Authorization": f"Bearer {embedding_api_key}"
     }
-    data = {"input": text, "model": embedding_model}
+    data = {"input": texts[0] if len(texts) == 1 else list(texts), "model": embedding_model}
 
     try:
         if not embedding_base_url.endswith('/'):
@@ -41,13 +71,16 @@ def get_embedding(text):
         response = requests.post(api_endpoint, headers=headers, json=data, timeout=20)
         response.raise_for_status()
         result = response.json()
-        embedding = result['data'][0]['embedding']
-        return embedding
+        items = sorted(result['data'], key=lambda item: item.get('index', 0))
+        if len(items) != len(texts):
+            raise RuntimeError(f"Embedding API 返回了 {len(items)} 个向量，期望 {len(texts)} 个")
+        return [item['embedding'] for item in items]
     except requests.exceptions.RequestException as e:
         raise RuntimeError(f"Embedding API 请求失败: {e}")
     except (KeyError, IndexError) as e:
         raise RuntimeError(f"解析Embedding API响应失败: {e}\n响应内容: {response.text}")
 
+@profiler.timed('llm_client.call_llm')
 def call_llm(system_prompt, user_prompt):
     """调用LLM API并返回结果。"""
     base_url, api_key, model, _, _, _ = get_llm_config()
@@ -70,10 +103,12 @@ def call_llm(system_prompt, user_prompt):
     except (KeyError, IndexError) as e:
         raise RuntimeError(f"解析API响应失败: {e}\n响应内容: {response.text}")
 
+@profiler.timed('llm_client.generate_prompt')
 def generate_prompt(requirement):
     system_prompt = "你是一个提示词工程专家。请根据用户的需求，创建一个高质量、清晰、可复用的提示词模板。模板中应使用双花括号 `{{变量名}}` 来标识变量。"
     return call_llm(system_prompt, requirement)
 
+@profiler.timed('llm_client.optimize_prompt')
 def optimize_prompt(prompt_content, custom_system_prompt):
     """使用用户自定义的指令优化一个已有的提示词。"""
     return call_llm(custom_system_prompt, prompt_content)
@@ -1,21 +1,31 @@
 import sys
-import re
 import json
 import os
-import numpy as np
+import threading
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
     QListWidget, QTextEdit, QLineEdit, QPushButton, QLabel, QSplitter,
     QMessageBox, QInputDialog, QDialog, QFormLayout, QDialogButtonBox,
-    QListWidgetItem, QFrame, QFileDialog, QStatusBar, QGridLayout
+    QListWidgetItem, QFrame, QFileDialog, QStatusBar, QGridLayout, QCheckBox, QPlainTextEdit,
+    QComboBox, QSpinBox, QDoubleSpinBox, QProgressDialog
 )
 from PySide6.QtCore import Qt, Signal, QTimer
 from PySide6.QtGui import QClipboard, QAction, QTextCursor, QMouseEvent
 
+import autosave
+import batch_optimize
+import catalogue
 import database
+import embedding_migration
 import llm_client
+import profiler
+import prompt_api
+import query_cache
+import template_editor
 
 CONFIG_FILE = 'config.json'
+# 启动时恢复的更改最多等待这么久（秒）再显示，未写完的由后台继续保存
+RECOVER_FLUSH_TIMEOUT = 2.0
 
 class TagLabel(QLabel):
     doubleClicked = Signal(str)
@@ -33,7 +43,7 @@ class OptimizeDialog(QDialog):
         self.setWindowTitle("自定义 AI 优化指令")
         self.layout = QVBoxLayout(self)
         self.instructions_edit = QTextEdit(self)
-        self.instructions_edit.setText("你是一个提示词工程专家。请优化以下提示词，使其更清晰、更强大、更通用。请直接返回优化后的提示词内容，无需任何解释。")
+        self.instructions_edit.setText(batch_optimize.DEFAULT_INSTRUCTIONS)
         self.layout.addWidget(QLabel("编辑用于本次优化的指令:"))
         self.layout.addWidget(self.instructions_edit)
         self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
@@ -44,6 +54,54 @@ class OptimizeDialog(QDialog):
     def get_instructions(self):
         return self.instructions_edit.toPlainText()
 
+class BatchOptimizeDialog(QDialog):
+    def __init__(self, list_count, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("批量 AI 处理")
+        self.layout = QFormLayout(self)
+        self.scope_combo = QComboBox(self)
+        self.scope_combo.addItem(f"当前列表中的 {list_count} 个提示词", 'list')
+        self.scope_combo.addItem("带有指定标签的提示词", 'tag')
+        self.tag_input = QLineEdit(self)
+        self.tag_input.setPlaceholderText("标签名")
+        self.tag_input.setEnabled(False)
+        self.scope_combo.currentIndexChanged.connect(
+            lambda: self.tag_input.setEnabled(self.scope_combo.currentData() == 'tag'))
+        self.mode_combo = QComboBox(self)
+        self.mode_combo.addItem("AI 优化现有内容", 'optimize')
+        self.mode_combo.addItem("AI 根据标题和内容重新生成", 'generate')
+        self.instructions_edit = QTextEdit(self)
+        self.instructions_edit.setText(batch_optimize.DEFAULT_INSTRUCTIONS)
+        self.mode_combo.currentIndexChanged.connect(
+            lambda: self.instructions_edit.setEnabled(self.mode_combo.currentData() == 'optimize'))
+        self.workers_input = QSpinBox(self)
+        self.workers_input.setRange(1, 32)
+        self.workers_input.setValue(batch_optimize.DEFAULT_WORKERS)
+        self.rate_input = QDoubleSpinBox(self)
+        self.rate_input.setRange(0.1, 100)
+        self.rate_input.setValue(batch_optimize.DEFAULT_RATE)
+        self.layout.addRow("范围:", self.scope_combo)
+        self.layout.addRow("标签:", self.tag_input)
+        self.layout.addRow("模式:", self.mode_combo)
+        self.layout.addRow("优化指令:", self.instructions_edit)
+        self.layout.addRow("并发请求数:", self.workers_input)
+        self.layout.addRow("每秒最多请求数:", self.rate_input)
+        self.layout.addRow(QLabel("结果将保存为各提示词的新历史版本，可在“查看历史”中比较和恢复。"))
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        self.layout.addRow(self.buttons)
+
+    def get_options(self):
+        return {
+            'scope': self.scope_combo.currentData(),
+            'tag': self.tag_input.text().strip(),
+            'mode': self.mode_combo.currentData(),
+            'instructions': self.instructions_edit.toPlainText(),
+            'workers': self.workers_input.value(),
+            'rate': self.rate_input.value(),
+        }
+
 class SettingsDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -172,7 +230,78 @@ class HistoryDialog(QDialog):
         self.version_restored.emit(content)
         self.accept()
 
+class DiagnosticsDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("性能诊断")
+        self.setGeometry(200, 200, 800, 500)
+        layout = QVBoxLayout(self)
+        options_layout = QHBoxLayout()
+        self.enable_checkbox = QCheckBox("启用性能采集")
+        self.enable_checkbox.setChecked(profiler.is_enabled())
+        self.enable_checkbox.toggled.connect(self.toggle_profiling)
+        self.sql_trace_checkbox = QCheckBox("记录慢 SQL")
+        self.sql_trace_checkbox.setChecked(profiler.is_sql_trace_enabled())
+        self.sql_trace_checkbox.toggled.connect(self.toggle_profiling)
+        options_layout.addWidget(self.enable_checkbox)
+        options_layout.addWidget(self.sql_trace_checkbox)
+        options_layout.addStretch()
+        layout.addLayout(options_layout)
+        self.report_view = QTextEdit()
+        self.report_view.setReadOnly(True)
+        self.report_view.setLineWrapMode(QTextEdit.NoWrap)
+        layout.addWidget(self.report_view)
+        button_layout = QHBoxLayout()
+        refresh_button = QPushButton("刷新")
+        refresh_button.clicked.connect(self.refresh)
+        reset_button = QPushButton("清空")
+        reset_button.clicked.connect(self.reset)
+        export_json_button = QPushButton("导出 JSON")
+        export_json_button.clicked.connect(lambda: self.export(profiler.to_json, "JSON Files (*.json)"))
+        export_prom_button = QPushButton("导出 Prometheus")
+        export_prom_button.clicked.connect(lambda: self.export(profiler.to_prometheus, "Text Files (*.prom *.txt)"))
+        close_button = QPushButton("关闭")
+        close_button.clicked.connect(self.close)
+        for button in (refresh_button, reset_button, export_json_button, export_prom_button):
+            button_layout.addWidget(button)
+        button_layout.addStretch()
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+        self.refresh()
+
+    def toggle_profiling(self):
+        if self.enable_checkbox.isChecked():
+            profiler.enable(sql_trace=self.sql_trace_checkbox.isChecked())
+        else:
+            profiler.disable()
+
+    def refresh(self):
+        if not profiler.is_enabled():
+            self.report_view.setPlainText("性能采集未启用。勾选“启用性能采集”后操作应用，再点击“刷新”查看结果。")
+            return
+        self.report_view.setPlainText(profiler.to_text())
+
+    def reset(self):
+        profiler.reset()
+        self.refresh()
+
+    def export(self, dump_function, file_filter):
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出性能数据", "", file_filter)
+        if not file_path:
+            return
+        try:
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(dump_function())
+        except IOError as e:
+            QMessageBox.warning(self, "导出错误", f"无法写入文件:\n{e}")
+
 class MainWindow(QMainWindow):
+    autosave_finished = Signal(object)
+    migration_progress = Signal(int, int)
+    migration_finished = Signal(object)
+    batch_progress = Signal(int, int)
+    batch_finished = Signal(object)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("提示词管理工具")
@@ -180,6 +309,17 @@ class MainWindow(QMainWindow):
         self.current_tags = []
         self.variable_inputs = {}
         self.is_dirty = False
+        self.loaded_prompt_id = None
+        # 保存时发现已被其他人修改、等待用户决定覆盖还是重新加载的提示词
+        self.conflicted_prompt_ids = set()
+        self.migration_thread = None
+        self.migration_stop = threading.Event()
+        self.batch_thread = None
+        self.batch_stop = threading.Event()
+        self.batch_job_id = None
+        self.batch_progress_dialog = None
+        # 列表筛选使用的内存目录，首次筛选时加载，之后只读取数据库中变化的提示词
+        self.catalogue = catalogue.Catalogue()
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -190,7 +330,7 @@ class MainWindow(QMainWindow):
         self.semantic_search_input = QLineEdit()
         self.semantic_search_input.setPlaceholderText("输入您的问题或需求进行语义搜索...")
         semantic_search_button = QPushButton("语义搜索")
-        semantic_search_button.clicked.connect(self.perform_semantic_search)
+        semantic_search_button.clicked.connect(lambda: self.perform_semantic_search())
         top_bar_layout.addWidget(QLabel("<b>智能检索:</b>"))
         top_bar_layout.addWidget(self.semantic_search_input)
         top_bar_layout.addWidget(semantic_search_button)
@@ -199,7 +339,10 @@ class MainWindow(QMainWindow):
         self.history_button.clicked.connect(self.show_history)
         self.settings_button = QPushButton("设置")
         self.settings_button.clicked.connect(self.open_settings)
+        self.diagnostics_button = QPushButton("诊断")
+        self.diagnostics_button.clicked.connect(self.show_diagnostics)
         top_bar_layout.addWidget(self.history_button)
+        top_bar_layout.addWidget(self.diagnostics_button)
         top_bar_layout.addWidget(self.settings_button)
         main_layout.addLayout(top_bar_layout)
 
@@ -232,6 +375,9 @@ class MainWindow(QMainWindow):
         list_mgmt_layout.addWidget(delete_prompt_button, 0, 1)
         list_mgmt_layout.addWidget(import_button, 1, 0)
         list_mgmt_layout.addWidget(export_button, 1, 1)
+        batch_button = QPushButton("批量 AI 处理")
+        batch_button.clicked.connect(self.batch_process_with_ai)
+        list_mgmt_layout.addWidget(batch_button, 2, 0, 1, 2)
         left_layout.addLayout(list_mgmt_layout)
         main_splitter.addWidget(left_widget)
 
@@ -251,16 +397,17 @@ class MainWindow(QMainWindow):
         template_layout = QVBoxLayout(template_widget)
         template_layout.setContentsMargins(0,0,0,0)
         template_layout.addWidget(QLabel("<b>模板编辑区</b>"))
-        self.prompt_content_edit = QTextEdit()
+        self.prompt_content_edit = template_editor.TemplateEditor()
         self.prompt_content_edit.setPlaceholderText("在此输入提示词模板... 输入 / 可快速插入变量")
         self.prompt_content_edit.textChanged.connect(self.on_template_change)
+        self.prompt_content_edit.variablesChanged.connect(self.update_variable_panel)
         template_layout.addWidget(self.prompt_content_edit)
         
         template_actions_layout = QHBoxLayout()
         insert_var_button = QPushButton("插入变量")
         insert_var_button.clicked.connect(self.insert_variable)
         save_button = QPushButton("立即保存")
-        save_button.clicked.connect(self.save_prompt)
+        save_button.clicked.connect(lambda: self.save_prompt())
         ai_generate_button = QPushButton("AI 生成")
         ai_generate_button.clicked.connect(self.generate_prompt_with_ai)
         ai_optimize_button = QPushButton("AI 优化")
@@ -276,7 +423,7 @@ class MainWindow(QMainWindow):
         preview_layout = QVBoxLayout(preview_widget)
         preview_layout.setContentsMargins(0,0,0,0)
         preview_layout.addWidget(QLabel("<b>实时预览区</b>"))
-        self.preview_edit = QTextEdit()
+        self.preview_edit = QPlainTextEdit()
         self.preview_edit.setPlaceholderText("最终提示词预览")
         self.preview_edit.setReadOnly(True)
         preview_layout.addWidget(self.preview_edit)
@@ -325,77 +472,173 @@ class MainWindow(QMainWindow):
 
         self.setStatusBar(QStatusBar(self))
 
+        # 连续编辑时只在停顿后保存一次；定时器保证持续编辑时每分钟至少保存一次
         self.auto_save_timer = QTimer(self)
         self.auto_save_timer.setInterval(60000)
         self.auto_save_timer.timeout.connect(self.auto_save)
         self.auto_save_timer.start()
+        self.auto_save_debounce_timer = QTimer(self)
+        self.auto_save_debounce_timer.setSingleShot(True)
+        self.auto_save_debounce_timer.setInterval(3000)
+        self.auto_save_debounce_timer.timeout.connect(self.auto_save)
+        # 预览需要渲染整个文档，大文档在停止输入后才刷新
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.timeout.connect(self.update_preview)
 
         database.init_db()
+        self.autosave_finished.connect(self.on_autosave_finished)
+        self.autosave = autosave.AutoSaveEngine(on_saved=self.autosave_finished.emit)
+        self.migration_progress.connect(self.on_migration_progress)
+        self.migration_finished.connect(self.on_migration_finished)
+        self.batch_progress.connect(self.on_batch_progress)
+        self.batch_finished.connect(self.on_batch_finished)
         self.refresh_prompt_list()
+        QTimer.singleShot(0, self.recover_unsaved_changes)
+        # 上次退出时未完成的模型迁移在后台继续
+        if database.get_embedding_migration() is not None:
+            QTimer.singleShot(0, self.start_embedding_migration)
+        if database.get_batch_job() is not None:
+            QTimer.singleShot(0, self.offer_resume_batch_job)
 
     def mark_dirty(self):
         self.is_dirty = True
+        self.auto_save_debounce_timer.start()
         self.statusBar().showMessage("有未保存的更改...", 3000)
 
+    @profiler.timed('ui.on_template_change')
     def on_template_change(self):
         self.mark_dirty()
-        cursor = self.prompt_content_edit.textCursor()
-        if cursor.position() > 0:
-            try:
-                char_before = self.prompt_content_edit.toPlainText()[cursor.position()-1]
-                if char_before == '/':
-                    cursor.deletePreviousChar()
-                    self.prompt_content_edit.setTextCursor(cursor)
-                    QTimer.singleShot(0, self.insert_variable)
-            except IndexError:
-                pass
-        self.detect_variables()
-        self.update_preview()
+        # 只读取光标前的一个字符，不复制整个文档；变量由编辑器根据增量自行跟踪
+        if self.prompt_content_edit.character_before_cursor() == '/':
+            cursor = self.prompt_content_edit.textCursor()
+            cursor.deletePreviousChar()
+            self.prompt_content_edit.setTextCursor(cursor)
+            QTimer.singleShot(0, self.insert_variable)
+        self.schedule_preview()
+
+    def schedule_preview(self):
+        large = self.prompt_content_edit.is_large_document()
+        self.preview_timer.start(template_editor.LARGE_DOCUMENT_PREVIEW_DELAY_MS if large else 0)
 
     def auto_save(self):
         if self.is_dirty:
             self.save_prompt(silent=True)
 
+    def current_snapshot(self, silent=True):
+        return autosave.make_snapshot(self.loaded_prompt_id, self.prompt_title_input.text(),
+                                      self.prompt_content_edit.toPlainText(), self.current_tags, silent)
+
+    @profiler.timed('ui.save_prompt')
     def save_prompt(self, silent=False):
         prompt_id = self.get_current_prompt_id()
-        if not prompt_id:
+        if not prompt_id or prompt_id != self.loaded_prompt_id:
             if not silent:
                 QMessageBox.warning(self, "警告", "没有选中要保存的提示词。")
             return
-        title = self.prompt_title_input.text()
-        content = self.prompt_content_edit.toPlainText()
-        embedding = None
-        try:
-            if content.strip():
-                embedding = llm_client.get_embedding(content)
-                embedding = np.array(embedding, dtype=np.float32)
-        except Exception as e:
-            if not silent:
-                QMessageBox.warning(self, "Embedding 错误", f"无法生成向量: {e}")
-        database.update_prompt(prompt_id, title, content, embedding)
-        database.update_prompt_tags(prompt_id, self.current_tags)
+        if silent and prompt_id in self.conflicted_prompt_ids:
+            # 冲突解决之前不再自动保存，更改仍保留在编辑器中
+            return
+        self.auto_save_debounce_timer.stop()
+        snapshot = self.current_snapshot(silent)
+        # 手动保存时总是提交，以便补生成之前失败的 embedding
+        submitted = self.autosave.submit(snapshot, force=not silent)
+        self.is_dirty = False
+        if not submitted:
+            return
         current_item = self.prompt_list.currentItem()
         if current_item:
-            current_item.setText(title)
-        self.is_dirty = False
-        msg = "已自动保存。" if silent else "提示词及标签已保存！"
-        if embedding is not None:
+            current_item.setText(snapshot.title)
+        self.statusBar().showMessage("正在后台保存...", 3000)
+
+    def on_autosave_finished(self, result):
+        if result.conflict:
+            self.resolve_save_conflict(result.prompt_id)
+            return
+        if result.error is not None and not result.saved:
+            self.statusBar().showMessage(f"保存失败，更改已记录在恢复日志中: {result.error}", 10000)
+            if not result.silent:
+                QMessageBox.warning(self, "保存错误", f"无法保存提示词: {result.error}")
+            return
+        if not result.saved:
+            return
+        if result.error is not None and not result.silent:
+            QMessageBox.warning(self, "Embedding 错误", f"无法生成向量: {result.error}")
+        msg = "已自动保存。" if result.silent else "提示词及标签已保存！"
+        if result.embedded:
             msg += " (向量已生成)"
         self.statusBar().showMessage(msg, 5000)
 
+    def resolve_save_conflict(self, prompt_id):
+        if prompt_id in self.conflicted_prompt_ids:
+            return
+        self.conflicted_prompt_ids.add(prompt_id)
+        try:
+            reply = QMessageBox.question(
+                self, '保存冲突',
+                "该提示词在您编辑期间已被其他人修改。\n"
+                "选择“是”用您的版本覆盖对方的修改；选择“否”放弃您的更改并重新加载。",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            overwrite = reply == QMessageBox.Yes
+            self.autosave.resolve_conflict(prompt_id, overwrite)
+            if overwrite and prompt_id == self.loaded_prompt_id and self.is_dirty:
+                # 对话框打开期间的编辑也一并提交
+                self.autosave.submit(self.current_snapshot(silent=False), force=True)
+                self.is_dirty = False
+        finally:
+            self.conflicted_prompt_ids.discard(prompt_id)
+        if not overwrite and prompt_id == self.loaded_prompt_id:
+            self.is_dirty = False
+            self.loaded_prompt_id = None
+            self.refresh_prompt_list(self.search_input.text())
+            self.display_prompt_content(self.prompt_list.currentItem(), None)
+            self.statusBar().showMessage("已重新加载其他人修改后的版本。", 5000)
+
+    def recover_unsaved_changes(self):
+        recovered = self.autosave.recover()
+        if not recovered:
+            return
+        reply = QMessageBox.question(self, '恢复未保存的更改',
+                                     f"检测到上次退出时有 {len(recovered)} 个提示词的更改尚未保存，是否恢复？",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if reply != QMessageBox.Yes:
+            self.autosave.discard_journal()
+            return
+        # 其他人在此期间修改过的提示词会报告冲突，由 resolve_save_conflict 询问是否覆盖
+        for snapshot, version in recovered:
+            self.autosave.restore(snapshot, version)
+        # 不在界面线程上无限等待；尚未落盘的提示词在显示时直接使用排队中的快照
+        self.autosave.flush(RECOVER_FLUSH_TIMEOUT)
+        self.loaded_prompt_id = None
+        self.refresh_prompt_list()
+        self.display_prompt_content(self.prompt_list.currentItem(), None)
+
+    def closeEvent(self, event):
+        if self.is_dirty and self.loaded_prompt_id:
+            self.autosave.submit(self.current_snapshot())
+        self.autosave.stop()
+        if self.migration_thread is not None:
+            # 迁移在当前批次结束后暂停，下次启动时继续
+            self.migration_stop.set()
+            self.migration_thread.join(30)
+        if self.batch_thread is not None:
+            # 已发出的请求完成并保存后停止，其余条目下次启动时可以继续
+            self.batch_stop.set()
+            self.batch_thread.join(30)
+        self.catalogue.close()
+        super().closeEvent(event)
+
+    @profiler.timed('ui.perform_semantic_search')
     def perform_semantic_search(self):
         query = self.semantic_search_input.text()
         if not query.strip():
             self.refresh_prompt_list()
             return
         try:
-            self.statusBar().showMessage("正在生成查询向量...")
-            QApplication.processEvents()
-            query_embedding = llm_client.get_embedding(query)
-            query_embedding = np.array(query_embedding, dtype=np.float32)
             self.statusBar().showMessage("正在进行语义搜索...")
             QApplication.processEvents()
-            sorted_ids = database.semantic_search_prompts(query_embedding)
+            # 相同的查询会直接命中缓存，无需再次请求 Embedding API
+            sorted_ids = query_cache.semantic_search(query)
             if not sorted_ids:
                 QMessageBox.information(self, "未找到", "未找到语义相关的提示词。 সন")
                 self.statusBar().clearMessage()
@@ -409,17 +652,19 @@ class MainWindow(QMainWindow):
     def refresh_prompt_list(self, query="", ids_ordered=None):
         current_id = self.get_current_prompt_id()
         self.prompt_list.blockSignals(True)
+        self.prompt_list.setUpdatesEnabled(False)
         self.prompt_list.clear()
         if ids_ordered is not None:
-            prompts = database.get_prompts_by_ids(ids_ordered)
+            prompts = [(prompt['id'], prompt['title']) for prompt in database.get_prompts_by_ids(ids_ordered)]
         else:
-            prompts = database.search_prompts(query)
-        for i, prompt in enumerate(prompts):
-            item = QListWidgetItem(prompt['title'])
-            item.setData(Qt.UserRole, prompt['id'])
+            prompts = self.catalogue.search(query)
+        for i, (prompt_id, title) in enumerate(prompts):
+            item = QListWidgetItem(title)
+            item.setData(Qt.UserRole, prompt_id)
             self.prompt_list.addItem(item)
-            if prompt['id'] == current_id:
+            if prompt_id == current_id:
                 self.prompt_list.setCurrentRow(i)
+        self.prompt_list.setUpdatesEnabled(True)
         self.prompt_list.blockSignals(False)
         if self.prompt_list.count() > 0 and self.prompt_list.currentRow() == -1:
              self.prompt_list.setCurrentRow(0)
@@ -429,26 +674,46 @@ class MainWindow(QMainWindow):
         self.refresh_prompt_list(query)
 
     def display_prompt_content(self, current, previous):
+        new_prompt_id = current.data(Qt.UserRole) if current else None
+        if self.is_dirty and self.loaded_prompt_id and self.loaded_prompt_id != new_prompt_id:
+            # 切换提示词前把未保存的更改交给后台保存
+            self.autosave.submit(self.current_snapshot())
+        self.auto_save_debounce_timer.stop()
+        self.loaded_prompt_id = None
         if not current:
             self.prompt_title_input.clear()
             self.prompt_content_edit.clear()
             self.update_tags_display([], mark_dirty=False)
-            self.detect_variables()
             self.update_preview()
             self.is_dirty = False
             return
         prompt_id = current.data(Qt.UserRole)
+        # 后台还有该提示词未写完的保存时，数据库中是旧版本，以排队中的快照为准
+        pending = self.autosave.pending_snapshot(prompt_id)
         prompt = database.get_prompt_details(prompt_id)
         if prompt:
+            if pending is not None:
+                title, content, tags = pending.title, pending.content, list(pending.tags)
+            else:
+                title, content, tags = prompt['title'], prompt['content'], database.get_prompt_tags(prompt_id)
             self.prompt_content_edit.blockSignals(True)
             self.prompt_title_input.blockSignals(True)
-            self.prompt_title_input.setText(prompt['title'])
-            self.prompt_content_edit.setText(prompt['content'])
+            self.prompt_title_input.setText(title)
+            self.prompt_content_edit.setPlainText(content)
             self.prompt_content_edit.blockSignals(False)
             self.prompt_title_input.blockSignals(False)
-            self.current_tags = database.get_prompt_tags(prompt_id)
+            self.current_tags = tags
             self.update_tags_display(self.current_tags, mark_dirty=False)
             self.on_template_change()
+            if pending is None:
+                has_embedding = (prompt['embedding'] is not None
+                                 and prompt['embedding_model'] in (None, llm_client.get_embedding_model()))
+                # 读取之后才提交的保存由引擎拒绝记录，不会用旧版本覆盖已落盘的状态
+                self.autosave.remember(prompt_id, prompt['title'], prompt['content'], self.current_tags,
+                                       has_embedding=has_embedding,
+                                       version=prompt['version'])
+            self.loaded_prompt_id = prompt_id
+            self.auto_save_debounce_timer.stop()
             self.is_dirty = False
 
     def update_tags_display(self, tags, mark_dirty=True):
@@ -519,6 +784,8 @@ class MainWindow(QMainWindow):
         reply = QMessageBox.question(self, '确认删除', f"您确定要永久删除提示词 '{current_item.text()}' 吗？\n此操作不可撤销。", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
             prompt_id = current_item.data(Qt.UserRole)
+            self.autosave.forget(prompt_id)
+            self.is_dirty = False
             database.delete_prompt(prompt_id)
             self.refresh_prompt_list()
             self.statusBar().showMessage(f"提示词 '{current_item.text()}' 已删除。", 5000)
@@ -528,34 +795,26 @@ class MainWindow(QMainWindow):
         clipboard.setText(self.preview_edit.toPlainText())
         self.statusBar().showMessage("预览结果已复制到剪贴板！", 3000)
 
-    def detect_variables(self):
-        # Clear existing variable widgets and the tracking dictionary
-        while self.variable_layout.count():
-            child = self.variable_layout.takeAt(0)
-            if child.widget():
-                child.widget().deleteLater()
-        self.variable_inputs.clear()
-
-        content = self.prompt_content_edit.toPlainText()
-        variables = sorted(list(set(re.findall(r'{{(.+?)}}', content))))
-
-        if not variables:
-            self.right_panel_widget.setVisible(False)
-            return
-
-        self.right_panel_widget.setVisible(True)
-        for var_name in variables:
-            line_edit = QLineEdit()
-            line_edit.textChanged.connect(self.update_preview)
-            line_edit.textChanged.connect(self.mark_dirty)
-            self.variable_layout.addRow(f"{{{{{var_name}}}}}", line_edit)
-            self.variable_inputs[var_name] = line_edit
+    def update_variable_panel(self, variables):
+        """变量集合变化时只增删对应的输入框，已输入的值保持不变。"""
+        for var_name in [name for name in self.variable_inputs if name not in variables]:
+            self.variable_layout.removeRow(self.variable_inputs.pop(var_name))
+        # variables 已排序，按顺序插入可以保持输入框的排列顺序
+        for row, var_name in enumerate(variables):
+            if var_name not in self.variable_inputs:
+                line_edit = QLineEdit()
+                line_edit.textChanged.connect(self.schedule_preview)
+                self.variable_layout.insertRow(row, f"{{{{{var_name}}}}}", line_edit)
+                self.variable_inputs[var_name] = line_edit
+        self.right_panel_widget.setVisible(bool(variables))
+        self.schedule_preview()
 
+    @profiler.timed('ui.update_preview')
     def update_preview(self):
+        self.preview_timer.stop()
         template = self.prompt_content_edit.toPlainText()
-        for var_name, input_widget in self.variable_inputs.items():
-            template = template.replace(f'{{{{{var_name}}}}}', input_widget.text())
-        self.preview_edit.setText(template)
+        values = {var_name: input_widget.text() for var_name, input_widget in self.variable_inputs.items()}
+        self.preview_edit.setPlainText(prompt_api.render_template(template, values))
 
     def insert_variable(self):
         var_name, ok = QInputDialog.getText(self, "插入变量", "输入变量名 (无需输入花括号): ")
@@ -572,17 +831,79 @@ class MainWindow(QMainWindow):
         dialog.exec()
 
     def restore_from_history(self, content):
-        self.prompt_content_edit.setText(content)
+        self.prompt_content_edit.setPlainText(content)
         self.mark_dirty()
         QMessageBox.information(self, "成功", "已从历史版本恢复内容。")
 
+    def show_diagnostics(self):
+        dialog = DiagnosticsDialog(self)
+        dialog.exec()
+
     def open_settings(self):
         dialog = SettingsDialog(self)
         if dialog.exec():
             settings = dialog.get_settings()
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, indent=4, ensure_ascii=False)
+            old_model = llm_client.get_embedding_model()
+            new_model = settings['embedding_model'] or None
+            migrate = False
+            if old_model and new_model and new_model != old_model and database.get_embedding_model_counts():
+                reply = QMessageBox.question(
+                    self, '切换 Embedding 模型',
+                    f"提示词库中的向量是由 {old_model} 生成的，与 {new_model} 不兼容。\n"
+                    f"是否在后台用 {new_model} 重新生成全部向量？迁移期间语义搜索继续使用旧模型，完成后自动切换。\n"
+                    "选择“否”将立即切换，旧向量不再参与检索，直到重新生成。",
+                    QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel, QMessageBox.Yes)
+                if reply == QMessageBox.Cancel:
+                    return
+                if reply == QMessageBox.Yes:
+                    # 迁移完成时才会切换配置中的模型
+                    settings['embedding_model'] = old_model
+                    migrate = True
+            llm_client.save_llm_config(settings)
             self.statusBar().showMessage("API 设置已成功保存。", 3000)
+            if migrate:
+                try:
+                    embedding_migration.start(new_model, old_model)
+                except ValueError as e:
+                    QMessageBox.warning(self, "迁移错误", str(e))
+                    return
+                self.start_embedding_migration()
+
+    def start_embedding_migration(self):
+        if self.migration_thread is not None and self.migration_thread.is_alive():
+            return
+        self.migration_stop.clear()
+
+        def run():
+            migration = database.get_embedding_migration()
+            try:
+                status = embedding_migration.run(migration['id'] if migration else None,
+                                                 progress=self.migration_progress.emit,
+                                                 stop_event=self.migration_stop)
+                failures = database.get_embedding_migration_failures(migration['id']) if status == 'completed' else []
+            except Exception as e:
+                status, failures = e, []
+            self.migration_finished.emit((status, failures))
+
+        self.migration_thread = threading.Thread(target=run, name='embedding-migration', daemon=True)
+        self.migration_thread.start()
+        self.statusBar().showMessage("正在后台迁移 Embedding 向量...", 5000)
+
+    def on_migration_progress(self, done, total):
+        self.statusBar().showMessage(f"正在后台迁移 Embedding 向量: {done}/{total}", 5000)
+
+    def on_migration_finished(self, result):
+        self.migration_thread = None
+        status, failures = result
+        if isinstance(status, Exception):
+            self.statusBar().showMessage(f"Embedding 迁移中断，下次启动时继续: {status}", 10000)
+        elif status == 'completed' and failures:
+            details = "\n".join(f"{title}: {error}" for _, title, error in failures[:20])
+            QMessageBox.warning(self, "Embedding 迁移",
+                                f"迁移完成，当前模型: {llm_client.get_embedding_model()}\n"
+                                f"{len(failures)} 个提示词生成失败，暂时无法被语义检索，保存时会重新生成：\n{details}")
+        elif status == 'completed':
+            self.statusBar().showMessage(f"Embedding 迁移完成，当前模型: {llm_client.get_embedding_model()}", 10000)
 
     def _handle_llm_call(self, llm_function, *args):
         try:
@@ -602,7 +923,7 @@ class MainWindow(QMainWindow):
             QApplication.processEvents()
             new_content = self._handle_llm_call(llm_client.generate_prompt, requirement)
             if new_content:
-                self.prompt_content_edit.setText(new_content)
+                self.prompt_content_edit.setPlainText(new_content)
                 self.statusBar().showMessage("AI 生成完成！", 5000)
             else:
                 self.statusBar().clearMessage()
@@ -619,45 +940,127 @@ class MainWindow(QMainWindow):
             QApplication.processEvents()
             optimized_content = self._handle_llm_call(llm_client.optimize_prompt, current_content, instructions)
             if optimized_content:
-                self.prompt_content_edit.setText(optimized_content)
+                self.prompt_content_edit.setPlainText(optimized_content)
                 self.statusBar().showMessage("AI 优化完成！", 5000)
             else:
                 self.statusBar().clearMessage()
 
+    def batch_process_with_ai(self):
+        if self.batch_thread is not None and self.batch_thread.is_alive():
+            QMessageBox.information(self, "批量 AI 处理", "已有批量任务正在进行。")
+            return
+        list_ids = [self.prompt_list.item(i).data(Qt.UserRole) for i in range(self.prompt_list.count())]
+        dialog = BatchOptimizeDialog(len(list_ids), self)
+        if not dialog.exec():
+            return
+        options = dialog.get_options()
+        try:
+            if options['scope'] == 'tag':
+                if not options['tag']:
+                    raise ValueError("请输入标签名。")
+                job_id = batch_optimize.create_job(options['mode'], tag=options['tag'],
+                                                   instructions=options['instructions'])
+            else:
+                job_id = batch_optimize.create_job(options['mode'], prompt_ids=list_ids,
+                                                   instructions=options['instructions'])
+        except ValueError as e:
+            QMessageBox.warning(self, "批量 AI 处理", str(e))
+            return
+        self.start_batch_job(job_id, workers=options['workers'], rate=options['rate'])
+
+    def offer_resume_batch_job(self):
+        job = database.get_batch_job()
+        if job is None:
+            return
+        reply = QMessageBox.question(self, "继续批量任务",
+                                     f"上次的批量 AI 任务尚未完成（{job['done'] + job['failed']}/{job['total']}），是否继续？\n"
+                                     "选择“否”将取消该任务，已生成的结果仍保留在历史版本中。")
+        if reply == QMessageBox.Yes:
+            self.start_batch_job(job['id'])
+        else:
+            batch_optimize.cancel_job(job['id'])
+
+    def start_batch_job(self, job_id, workers=batch_optimize.DEFAULT_WORKERS, rate=batch_optimize.DEFAULT_RATE):
+        job = database.get_batch_job(job_id)
+        self.batch_job_id = job_id
+        self.batch_stop.clear()
+        self.batch_progress_dialog = QProgressDialog("正在批量请求 AI...", "取消", 0, job['total'], self)
+        self.batch_progress_dialog.setWindowTitle("批量 AI 处理")
+        self.batch_progress_dialog.setMinimumDuration(0)
+        self.batch_progress_dialog.setValue(job['done'] + job['failed'])
+        self.batch_progress_dialog.canceled.connect(self.cancel_batch_job)
+
+        def run():
+            try:
+                result = batch_optimize.run_job(job_id, workers=workers, rate=rate,
+                                                progress=lambda done, total, prompt_id, error: self.batch_progress.emit(done, total),
+                                                stop_event=self.batch_stop)
+            except Exception as e:
+                result = e
+            self.batch_finished.emit(result)
+
+        self.batch_thread = threading.Thread(target=run, name='batch-optimize', daemon=True)
+        self.batch_thread.start()
+
+    def cancel_batch_job(self):
+        if self.batch_thread is None:
+            return
+        self.batch_stop.set()
+        batch_optimize.cancel_job(self.batch_job_id)
+        self.statusBar().showMessage("正在取消批量任务，等待进行中的请求完成...")
+
+    def on_batch_progress(self, done, total):
+        if self.batch_progress_dialog is not None:
+            self.batch_progress_dialog.setLabelText(f"正在批量请求 AI... {done}/{total}")
+            self.batch_progress_dialog.setValue(done)
+
+    def on_batch_finished(self, result):
+        self.batch_thread = None
+        if self.batch_progress_dialog is not None:
+            self.batch_progress_dialog.canceled.disconnect(self.cancel_batch_job)
+            self.batch_progress_dialog.close()
+            self.batch_progress_dialog = None
+        if isinstance(result, ValueError):
+            QMessageBox.warning(self, "配置错误", f"{result}\n修改设置后可在下次启动时继续该任务。")
+            return
+        if isinstance(result, Exception):
+            QMessageBox.critical(self, "批量 AI 处理", f"批量任务中断，下次启动时可以继续: {result}")
+            return
+        status, succeeded, failed = result
+        if status == 'completed':
+            QMessageBox.information(self, "批量 AI 处理",
+                                    f"完成：成功 {succeeded} 个，失败 {failed} 个。\n结果已保存为新的历史版本，可在“查看历史”中比较和恢复。")
+        else:
+            self.statusBar().showMessage(f"批量任务已停止：本次成功 {succeeded} 个，失败 {failed} 个。", 10000)
+
     def import_from_txt(self):
         file_paths, _ = QFileDialog.getOpenFileNames(self, "选择要导入的TXT文件", "", "Text Files (*.txt)")
         if not file_paths:
             return
-        imported_count = 0
-        for path in file_paths:
-            try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                title = os.path.splitext(os.path.basename(path))[0]
-                database.add_prompt(title, content)
-                imported_count += 1
-            except Exception as e:
-                QMessageBox.warning(self, "导入错误", f"无法导入文件 {path}:\n{e}")
-        if imported_count > 0:
-            QMessageBox.information(self, "成功", f"{imported_count} 个提示词已成功导入。 সন")
+        # 所有文件在一个事务中导入，任何一个文件读取失败都不会导入一半
+        try:
+            prompt_ids = prompt_api.import_txt_files(file_paths, workers=4)
+        except (OSError, UnicodeDecodeError) as e:
+            QMessageBox.warning(self, "导入错误", f"导入失败，没有导入任何文件:\n{e}")
+            return
+        if prompt_ids:
+            QMessageBox.information(self, "成功", f"{len(prompt_ids)} 个提示词已成功导入。 সন")
             self.refresh_prompt_list()
 
     def export_to_txt(self):
         dir_path = QFileDialog.getExistingDirectory(self, "选择要导出到的文件夹")
         if not dir_path:
             return
-        prompts = database.search_prompts()
+        prompts = database.get_prompts_with_content()
         if not prompts:
             QMessageBox.information(self, "信息", "数据库中没有可导出的提示词。")
             return
         exported_count = 0
         for prompt_data in prompts:
             try:
-                prompt_details = database.get_prompt_details(prompt_data['id'])
-                safe_title = re.sub(r'[\\/*?"<>|]', "_", prompt_details['title'])
-                file_path = os.path.join(dir_path, f"{safe_title}.txt")
+                file_path = os.path.join(dir_path, f"{prompt_api.safe_filename(prompt_data['title'])}.txt")
                 with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(prompt_details['content'])
+                    f.write(prompt_data['content'])
                 exported_count += 1
             except Exception as e:
                 QMessageBox.warning(self, "导出错误", f"无法导出提示词 '{prompt_data['title']}':\n{e}")
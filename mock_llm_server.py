@@ -0,0 +1,148 @@
+"""本地模拟的 OpenAI 兼容接口 (/v1/chat/completions 与 /v1/embeddings)，用于在不消耗额度的情况下
+测试批量优化、向量生成和模型迁移。
+
+    python mock_llm_server.py --port 8799 --latency 0.3 --error-rate 0.05
+    # 在“设置”中把 API Base URL 填为 http://127.0.0.1:8799/，Key 任意
+
+向量由文本的哈希确定，同一模型下相同的文本总是得到相同的向量；不同的模型名称对应不同的向量。
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class MockState:
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit=0.0, dimension=64, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.dimension = dimension
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'chat': 0, 'embeddings': 0, 'errors': 0, 'rate_limited': 0}
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def admit(self):
+        """返回 None 表示正常处理，否则返回要模拟的 HTTP 错误码。"""
+        with self.lock:
+            if self.rate_limit:
+                now = time.monotonic()
+                if now - self._window_start >= 1.0:
+                    self._window_start, self._window_count = now, 0
+                self._window_count += 1
+                if self._window_count > self.rate_limit:
+                    self.counts['rate_limited'] += 1
+                    return 429
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.counts['errors'] += 1
+                return 500
+        return None
+
+
+def mock_embedding(text, model, dimension):
+    seed = int.from_bytes(hashlib.sha1(f"{model}\0{text}".encode('utf-8')).digest()[:8], 'little')
+    return np.random.default_rng(seed).standard_normal(dimension).astype(np.float32).round(6).tolist()
+
+
+def mock_completion(messages):
+    system = next((m['content'] for m in messages if m.get('role') == 'system'), '')
+    user = next((m['content'] for m in reversed(messages) if m.get('role') == 'user'), '')
+    if '优化' in system:
+        return f"{user}\n\n（已优化）"
+    return f"# 提示词模板\n\n需求: {user}\n\n请根据 {{{{输入}}}} 完成任务。"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send(400, {'error': {'message': 'invalid JSON'}})
+            return
+        state = self.state
+        if state.latency:
+            time.sleep(state.latency * state.random.uniform(0.5, 1.5))
+        status = state.admit()
+        if status is not None:
+            self._send(status, {'error': {'message': 'rate limited' if status == 429 else 'mock failure'}})
+            return
+        path = self.path.rstrip('/')
+        if path.endswith('/v1/chat/completions'):
+            state.count('chat')
+            content = mock_completion(request.get('messages', []))
+            self._send(200, {'object': 'chat.completion', 'model': request.get('model'),
+                             'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                                          'finish_reason': 'stop'}]})
+        elif path.endswith('/v1/embeddings'):
+            state.count('embeddings')
+            texts = request.get('input', [])
+            texts = [texts] if isinstance(texts, str) else texts
+            model = request.get('model', '')
+            self._send(200, {'object': 'list', 'model': model,
+                             'data': [{'object': 'embedding', 'index': i,
+                                       'embedding': mock_embedding(text, model, state.dimension)}
+                                      for i, text in enumerate(texts)]})
+        else:
+            self._send(404, {'error': {'message': f'unknown path {self.path}'}})
+
+
+def start(host='127.0.0.1', port=0, **options):
+    """在后台线程中启动模拟服务，返回 server（server.server_address 为实际地址，server.shutdown() 停止）。"""
+    handler = type('Handler', (MockHandler,), {'state': MockState(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = handler.state
+    threading.Thread(target=server.serve_forever, name='mock-llm-server', daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模拟的 chat completions / embeddings 接口")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--latency', type=float, default=0.0, help="平均响应延迟（秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="每秒超过该请求数时返回 429，0 表示不限")
+    parser.add_argument('--dimension', type=int, default=64, help="向量维度")
+    args = parser.parse_args(argv)
+    server = start(args.host, args.port, latency=args.latency, error_rate=args.error_rate,
+                   rate_limit=args.rate_limit, dimension=args.dimension)
+    print(f"模拟服务已启动: http://{args.host}:{server.server_address[1]}/")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(server.state.counts, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- 采集开关 ---
+# 关闭时 timed 装饰器只多一次全局变量判断，几乎没有额外开销。
+_enabled = os.environ.get('PROMPT_MANAGER_PROFILE', '') not in ('', '0')
+_sql_trace = os.environ.get('PROMPT_MANAGER_SQL_TRACE', '') not in ('', '0')
+SLOW_THRESHOLD = float(os.environ.get('PROMPT_MANAGER_SLOW_MS', '200')) / 1000.0
+
+# 直方图的桶上界（秒），与 Prometheus 默认桶接近
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_local = threading.local()
+
+
+class _Histogram:
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable(sql_trace=None):
+    """开启性能采集；sql_trace 为 True 时同时记录慢 SQL。"""
+    global _enabled, _sql_trace
+    _enabled = True
+    if sql_trace is not None:
+        _sql_trace = sql_trace
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_sql_trace_enabled():
+    return _sql_trace
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def observe(name, seconds):
+    """向名为 name 的直方图记录一次耗时（秒）。"""
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = _Histogram()
+        hist.observe(seconds)
+
+
+def increment(name, amount=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def timed(name):
+    """计时装饰器：记录调用耗时、调用次数和异常次数。"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            statements = _sql_statements()
+            mark = len(statements)
+            _local.depth = getattr(_local, 'depth', 0) + 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                increment(f"{name}.errors")
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                observe(name, elapsed)
+                if elapsed >= SLOW_THRESHOLD and len(statements) > mark:
+                    logger.warning("慢调用 %s 耗时 %.1f ms，执行的 SQL:\n%s",
+                                   name, elapsed * 1000, "\n".join(statements[mark:]))
+                _local.depth -= 1
+                if _local.depth == 0:
+                    statements.clear()
+        return wrapper
+    return decorator
+
+
+# --- SQL 追踪 ---
+
+def _sql_statements():
+    statements = getattr(_local, 'statements', None)
+    if statements is None:
+        statements = _local.statements = []
+    return statements
+
+
+def _on_sql(statement):
+    increment('sql.statements')
+    # 只有 timed 调用内的 SQL 需要在慢调用日志中列出；调用之外（后台线程等）记录下来也不会被清空
+    if getattr(_local, 'depth', 0) > 0:
+        _sql_statements().append(statement)
+
+
+def trace_connection(conn):
+    """在开启 SQL 追踪时为连接注册 set_trace_callback。"""
+    if _enabled and _sql_trace:
+        conn.set_trace_callback(_on_sql)
+    return conn
+
+
+# --- 导出 ---
+
+def snapshot():
+    """返回当前所有指标的字典副本。"""
+    with _lock:
+        histograms = {
+            name: {
+                'count': h.count,
+                'sum': h.total,
+                'avg': h.total / h.count if h.count else 0.0,
+                'max': h.max,
+                'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], h.buckets)),
+            }
+            for name, h in sorted(_histograms.items())
+        }
+        counters = dict(sorted(_counters.items()))
+    return {'enabled': _enabled, 'histograms': histograms, 'counters': counters}
+
+
+def to_json(indent=2):
+    return json.dumps(snapshot(), indent=indent, ensure_ascii=False)
+
+
+def _metric_name(name):
+    return ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def to_prometheus():
+    """以 Prometheus 文本格式导出指标。"""
+    data = snapshot()
+    lines = []
+    for name, h in data['histograms'].items():
+        metric = f"prompt_manager_{_metric_name(name)}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in h['buckets'].items():
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{metric}_sum {h['sum']:.6f}")
+        lines.append(f"{metric}_count {h['count']}")
+    for name, value in data['counters'].items():
+        metric = f"prompt_manager_{_metric_name(name)}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def to_text():
+    """生成便于人工阅读的汇总表。"""
+    data = snapshot()
+    lines = [f"{'名称':<40}{'次数':>8}{'平均(ms)':>12}{'最大(ms)':>12}{'总计(ms)':>12}"]
+    for name, h in data['histograms'].items():
+        lines.append(f"{name:<40}{h['count']:>8}{h['avg'] * 1000:>12.2f}"
+                     f"{h['max'] * 1000:>12.2f}{h['sum'] * 1000:>12.2f}")
+    if data['counters']:
+        lines.append("")
+        for name, value in data['counters'].items():
+            lines.append(f"{name:<40}{value:>8}")
+    return "\n".join(lines)
@@ -0,0 +1,131 @@
+"""不依赖 Qt 的提示词库批量操作接口，供命令行 (cli.py) 和其他脚本调用。"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import chunking
+import database
+import llm_client
+import profiler
+import query_cache
+
+VARIABLE_PATTERN = re.compile(r'{{(.+?)}}')
+
+
+# --- 模板 ---
+
+def extract_variables(content):
+    """返回模板中出现的变量名（去重并排序）。"""
+    return sorted(set(VARIABLE_PATTERN.findall(content)))
+
+
+def render_template(template, values):
+    """用 values 中的值替换 {{变量}}，未提供的变量保持原样。"""
+    for var_name, value in values.items():
+        template = template.replace(f'{{{{{var_name}}}}}', value)
+    return template
+
+
+def _render_job(job):
+    prompt_id, title, content, values = job
+    return prompt_id, title, render_template(content, values)
+
+
+def _map(function, items, workers, use_processes):
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        chunksize = max(1, len(items) // (workers * 4)) if use_processes else 1
+        return list(executor.map(function, items, chunksize=chunksize))
+
+
+@profiler.timed('prompt_api.render_prompts')
+def render_prompts(values, ids=None, workers=1):
+    """批量渲染模板，返回 (id, title, rendered) 列表。workers > 1 时使用多进程。"""
+    prompts = database.get_prompts_with_content(ids)
+    jobs = [(p['id'], p['title'], p['content'], values) for p in prompts]
+    return _map(_render_job, jobs, workers, use_processes=True)
+
+
+# --- 导入 / 导出 ---
+
+def safe_filename(title):
+    return re.sub(r'[\\/*?"<>|]', "_", title)
+
+
+def _read_txt(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return os.path.splitext(os.path.basename(path))[0], content
+
+
+@profiler.timed('prompt_api.import_txt_files')
+def import_txt_files(paths, workers=1):
+    """将多个 .txt 文件批量导入为提示词（一个事务），返回新提示词的 ID 列表。"""
+    items = _map(_read_txt, list(paths), workers, use_processes=False)
+    return database.add_prompts(items)
+
+
+@profiler.timed('prompt_api.export_txt_files')
+def export_txt_files(dir_path, ids=None):
+    """把提示词导出为 .txt 文件，返回导出的数量。"""
+    os.makedirs(dir_path, exist_ok=True)
+    prompts = database.get_prompts_with_content(ids)
+    for prompt in prompts:
+        file_path = os.path.join(dir_path, f"{safe_filename(prompt['title'])}.txt")
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(prompt['content'])
+    return len(prompts)
+
+
+# --- 搜索 ---
+
+def keyword_search(query=""):
+    """按标题或标签筛选，返回 (id, title) 字典列表。"""
+    return [{'id': p['id'], 'title': p['title']} for p in database.search_prompts(query)]
+
+
+def embed_text(text, model=None):
+    return np.array(llm_client.get_embedding(text, model), dtype=np.float32)
+
+
+def semantic_search(query, limit=10):
+    """语义检索，返回按相关度排序的 (id, title) 字典列表。"""
+    sorted_ids = query_cache.semantic_search(query, limit)
+    return [{'id': p['id'], 'title': p['title']} for p in database.get_prompts_by_ids(sorted_ids)]
+
+
+# --- 向量 ---
+
+def _embed_job(job):
+    prompt, model = job
+    try:
+        return prompt['id'], chunking.embed_content(prompt['content'], model=model), None
+    except Exception as e:
+        return prompt['id'], None, e
+
+
+@profiler.timed('prompt_api.reembed_prompts')
+def reembed_prompts(ids=None, missing_only=False, workers=4, batch_size=100, progress=None):
+    """重新生成 embedding。网络请求并发执行，结果按批写入数据库。
+
+    missing_only 为 True 时只处理没有当前模型向量的提示词。返回 (成功数量, [(prompt_id, 错误), ...])。
+    """
+    model = llm_client.get_embedding_model()
+    prompts = [p for p in database.get_prompts_with_content(ids, missing_embedding_only=missing_only,
+                                                            embedding_model=model)
+               if p['content'].strip()]
+    done, failures = 0, []
+    for start in range(0, len(prompts), batch_size):
+        batch = prompts[start:start + batch_size]
+        results = _map(_embed_job, [(p, model) for p in batch], workers, use_processes=False)
+        succeeded = [(pid, emb) for pid, emb, err in results if err is None]
+        database.update_embeddings([(pid, document, chunks) for pid, (document, chunks) in succeeded], model)
+        failures.extend((pid, err) for pid, emb, err in results if err is not None)
+        done += sum(1 for _, _, err in results if err is None)
+        if progress:
+            progress(start + len(batch), len(prompts))
+    return done, failures
@@ -0,0 +1,128 @@
+import itertools
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import database
+import llm_client
+import profiler
+
+EMBEDDING_CACHE_SIZE = 512
+EMBEDDING_CACHE_TTL = 24 * 3600
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL = 600
+
+
+class LRUCache:
+    """带过期时间的定长 LRU 缓存，线程安全。"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# 查询向量只取决于查询文本和模型；检索结果还取决于提示词库，因此键中包含库的版本
+_embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL)
+_result_cache = LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+_version_lock = threading.Lock()
+_version_conn = None
+_version_path = None
+_version_epoch = itertools.count()
+_version_connection_epoch = None
+
+
+def library_version():
+    """返回数据库当前内容的版本标记，任何写入（包括其他进程的写入）之后都会变化。
+
+    PRAGMA data_version 在其他连接提交写入后改变。这里的连接一直保持打开且从不写入，
+    因此所有写入对它来说都来自“其他连接”。切换数据库文件时重新打开连接，
+    连接序号保证新连接的计数不会与旧连接的相同值混淆。
+    """
+    global _version_conn, _version_path, _version_connection_epoch
+    with _version_lock:
+        if _version_conn is None or _version_path != database.DATABASE_PATH:
+            if _version_conn is not None:
+                _version_conn.close()
+            _version_conn = sqlite3.connect(database.DATABASE_PATH, check_same_thread=False)
+            _version_path = database.DATABASE_PATH
+            _version_connection_epoch = next(_version_epoch)
+        return _version_connection_epoch, _version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+def normalize_query(query):
+    return ' '.join(query.split()).casefold()
+
+
+def active_embedding_model():
+    return llm_client.get_embedding_model()
+
+
+def get_query_embedding(query, model=None):
+    """返回查询文本的向量，同一模型下相同的（规范化后）查询只请求一次 API。"""
+    model = model if model is not None else active_embedding_model()
+    key = (model, normalize_query(query))
+    embedding = _embedding_cache.get(key)
+    if embedding is not None:
+        profiler.increment('query_cache.embedding_hits')
+        return embedding
+    profiler.increment('query_cache.embedding_misses')
+    embedding = np.array(llm_client.get_embedding(query, model), dtype=np.float32)
+    embedding.setflags(write=False)
+    _embedding_cache.put(key, embedding)
+    return embedding
+
+
+@profiler.timed('query_cache.semantic_search')
+def semantic_search(query, limit=10):
+    """带缓存的语义检索，返回排序后的提示词 ID 列表。
+
+    结果以 (embedding_model, 规范化查询, limit, 库版本) 为键；任何进程对数据库的写入
+    都会改变库版本，旧结果自然失效。
+    """
+    model = active_embedding_model()
+    key = (model, normalize_query(query), limit, library_version())
+    ids = _result_cache.get(key)
+    if ids is not None:
+        profiler.increment('query_cache.result_hits')
+        return list(ids)
+    profiler.increment('query_cache.result_misses')
+    ids = database.semantic_search_prompts(get_query_embedding(query, model), limit, embedding_model=model)
+    _result_cache.put(key, tuple(ids))
+    return ids
+
+
+def clear():
+    _embedding_cache.clear()
+    _result_cache.clear()
@@ -4,8 +4,11 @@ CREATE TABLE IF NOT EXISTS prompts (
     title TEXT NOT NULL,
     content TEXT NOT NULL,
     embedding BLOB, -- Store embeddings as a binary blob
+    embedding_model TEXT, -- Model that produced the embedding (NULL for legacy rows)
+    embedding_dim INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    version INTEGER NOT NULL DEFAULT 0 -- Incremented on every edit; used for optimistic concurrency
 );
 
 -- Tags table
@@ -31,3 +34,106 @@ CREATE TABLE IF NOT EXISTS prompt_versions (
     saved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (prompt_id) REFERENCES prompts (id) ON DELETE CASCADE
 );
+
+-- Chunk embeddings for long prompts (one row per overlapping window)
+CREATE TABLE IF NOT EXISTS prompt_chunks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    prompt_id INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    start_offset INTEGER NOT NULL,
+    end_offset INTEGER NOT NULL,
+    embedding BLOB NOT NULL,
+    embedding_model TEXT,
+    embedding_dim INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (prompt_id) REFERENCES prompts (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_prompt_chunks_prompt_id ON prompt_chunks (prompt_id);
+
+-- Background re-embedding of the library when the embedding model changes (resumable via cursor)
+CREATE TABLE IF NOT EXISTS embedding_migrations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source_model TEXT,
+    target_model TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running', -- running / completed / cancelled
+    cursor INTEGER NOT NULL DEFAULT 0, -- Last prompt id processed in the first pass
+    processed INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP
+);
+
+-- Prompts whose target-model embedding failed during a migration; skipped until edited
+CREATE TABLE IF NOT EXISTS embedding_migration_failures (
+    migration_id INTEGER NOT NULL,
+    prompt_id INTEGER NOT NULL,
+    version INTEGER NOT NULL, -- prompts.version that failed
+    error TEXT,
+    PRIMARY KEY (migration_id, prompt_id),
+    FOREIGN KEY (migration_id) REFERENCES embedding_migrations (id) ON DELETE CASCADE
+);
+
+-- Batch AI optimize / generate jobs; items are resumable after a crash
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mode TEXT NOT NULL, -- optimize / generate
+    instructions TEXT,
+    status TEXT NOT NULL DEFAULT 'running', -- running / completed / cancelled
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS batch_job_items (
+    job_id INTEGER NOT NULL,
+    prompt_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- pending / done / failed
+    version_id INTEGER, -- prompt_versions row holding the result
+    error TEXT,
+    PRIMARY KEY (job_id, prompt_id),
+    FOREIGN KEY (job_id) REFERENCES batch_jobs (id) ON DELETE CASCADE
+);
+
+-- Change log for in-memory catalogues and the search server: every write that affects a prompt's title,
+-- updated_at, tags or embedding appends its id here (from any process), so readers can apply just the changed rows
+CREATE TABLE IF NOT EXISTS prompt_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    prompt_id INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_prompts_insert_change AFTER INSERT ON prompts
+BEGIN
+    INSERT INTO prompt_changes (prompt_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_prompts_update_change AFTER UPDATE OF title, updated_at ON prompts
+BEGIN
+    INSERT INTO prompt_changes (prompt_id) VALUES (NEW.id);
+END;
+
+-- Embedding-only writes (re-embedding, finishing a model migration) keep updated_at unchanged
+CREATE TRIGGER IF NOT EXISTS trg_prompts_embedding_change AFTER UPDATE OF embedding ON prompts
+BEGIN
+    INSERT INTO prompt_changes (prompt_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_prompts_delete_change AFTER DELETE ON prompts
+BEGIN
+    INSERT INTO prompt_changes (prompt_id) VALUES (OLD.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_prompt_tags_insert_change AFTER INSERT ON prompt_tags
+BEGIN
+    INSERT INTO prompt_changes (prompt_id) VALUES (NEW.prompt_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_prompt_tags_delete_change AFTER DELETE ON prompt_tags
+BEGIN
+    INSERT INTO prompt_changes (prompt_id) VALUES (OLD.prompt_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tags_rename_change AFTER UPDATE OF name ON tags
+BEGIN
+    INSERT INTO prompt_changes (prompt_id) SELECT prompt_id FROM prompt_tags WHERE tag_id = NEW.id;
+END;
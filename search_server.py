@@ -0,0 +1,566 @@
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import database
+import llm_client
+import profiler
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# --- 常驻内存的索引 ---
+
+# 一次加载的结果。加载完成后整体替换，读者取一次引用即可得到互相一致的 ids、矩阵和全文索引。
+IndexSnapshot = namedtuple('IndexSnapshot', 'ids matrix fts fts_trigram embedding_model')
+
+
+# 一次同步中变化的提示词超过这个数量且超过总数的 1/4 时整体重建，比逐个更新更快
+RELOAD_MIN_CHANGES = 1000
+
+# prepare_update 的结果：在事件循环线程中由 apply_update 写入全文索引并替换快照
+IndexUpdate = namedtuple('IndexUpdate', 'base data_version last_seq changed rows ids matrix')
+
+
+class SearchIndex:
+    """保存在内存中的向量矩阵和全文索引。
+
+    数据库有写入时根据 prompt_changes 变更日志只更新变化的提示词；日志已被截断、变化过多或
+    切换了 Embedding 模型时整体重建。全文索引只在事件循环线程中读写，增量更新也在那里原地应用。
+    """
+
+    def __init__(self, refresh_interval=1.0):
+        self.refresh_interval = refresh_interval
+        self.snapshot = IndexSnapshot(np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32),
+                                      None, False, None)
+        self._version_conn = None
+        self._data_version = None
+        self._last_seq = 0
+        self._last_check = 0.0
+
+    @property
+    def ids(self):
+        return self.snapshot.ids
+
+    @property
+    def matrix(self):
+        return self.snapshot.matrix
+
+    @property
+    def embedding_model(self):
+        return self.snapshot.embedding_model
+
+    @property
+    def dimension(self):
+        matrix = self.snapshot.matrix
+        return matrix.shape[1] if matrix.size else 0
+
+    @property
+    def loaded(self):
+        return self._data_version is not None
+
+    def _current_data_version(self):
+        # data_version 在其他连接（包括其他进程）提交写入后会变化，查询它几乎没有开销
+        if self._version_conn is None:
+            self._version_conn = sqlite3.connect(database.DATABASE_PATH, check_same_thread=False)
+        return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def needs_reload(self):
+        return self._current_data_version() != self._data_version
+
+    def is_stale(self):
+        """与 needs_reload 相同，但最多每 refresh_interval 秒检查一次。"""
+        now = time.monotonic()
+        if self._data_version is not None and now - self._last_check < self.refresh_interval:
+            return False
+        self._last_check = now
+        return self.needs_reload()
+
+    def _last_change_seq(self):
+        conn = database.get_db_connection()
+        try:
+            return conn.execute("SELECT MAX(seq) FROM prompt_changes").fetchone()[0] or 0
+        finally:
+            conn.close()
+
+    @profiler.timed('search_server.load_index')
+    def load(self):
+        """整体重建索引。可以在任意线程中执行，完成后一次替换快照。"""
+        data_version = self._current_data_version()
+        # 先记下日志位置再读取数据：读取期间提交的修改会在下一次同步时再应用一遍
+        last_seq = self._last_change_seq()
+        rows = database.get_search_corpus()
+
+        fts = sqlite3.connect(':memory:', check_same_thread=False)
+        try:
+            fts.execute("CREATE VIRTUAL TABLE docs USING fts5(title, content, tags, tokenize='trigram')")
+            trigram = True
+        except sqlite3.OperationalError:
+            fts.execute("CREATE VIRTUAL TABLE docs USING fts5(title, content, tags)")
+            trigram = False
+        fts.executemany("INSERT INTO docs (rowid, title, content, tags) VALUES (?, ?, ?, ?)",
+                        [(r['id'], r['title'], r['content'], r['tags'] or '') for r in rows])
+        fts.commit()
+
+        # 每个分块一行，ids 为分块所属的提示词 ID；只加载当前配置的模型生成的向量。
+        # 切换模型的迁移完成时配置随之改变，下一次同步会整体重建。
+        embedding_model = llm_client.get_embedding_model()
+        chunk_prompt_ids, matrix = database.get_embedding_chunks(embedding_model=embedding_model)
+
+        # 旧的全文索引可能仍被进行中的请求引用，不主动关闭，最后一个引用释放时自动关闭
+        self.snapshot = IndexSnapshot(chunk_prompt_ids, matrix, fts, trigram, embedding_model)
+        self._last_seq = last_seq
+        self._data_version = data_version
+
+    @profiler.timed('search_server.prepare_update')
+    def prepare_update(self):
+        """读取上次同步之后变化的提示词，计算新的向量矩阵（不修改当前快照和全文索引），返回 IndexUpdate。
+
+        无法增量更新时直接在当前线程整体重建并返回 None；没有变化时也返回 None。
+        """
+        base = self.snapshot
+        data_version = self._current_data_version()
+        conn = database.get_db_connection()
+        try:
+            first, last, changed = database.get_prompt_changes(conn, self._last_seq)
+        finally:
+            conn.close()
+        last = last or 0
+        # 日志被清理到了上次同步的位置之后、数据库被替换、变化过多或切换了模型：无法增量更新
+        if (base.fts is None or last < self._last_seq or (first is not None and first > self._last_seq + 1)
+                or len(changed) > max(RELOAD_MIN_CHANGES, self.prompt_count // 4)
+                or llm_client.get_embedding_model() != base.embedding_model):
+            self.load()
+            profiler.increment('search_server.full_reloads')
+            return None
+        if not changed:
+            self._last_seq = last
+            self._data_version = data_version
+            return None
+        changed = sorted(changed)
+        rows = [(r['id'], r['title'], r['content'], r['tags'] or '') for r in database.get_search_corpus(changed)]
+        dimension = base.matrix.shape[1] if base.matrix.size else None
+        chunk_ids, chunk_matrix = database.get_embedding_chunks(dimension, base.embedding_model, ids=changed)
+        keep = ~np.isin(base.ids, changed)
+        if base.matrix.size:
+            ids = np.concatenate([base.ids[keep], chunk_ids])
+            matrix = np.vstack([base.matrix[keep], chunk_matrix])
+        else:
+            ids, matrix = chunk_ids, chunk_matrix
+        return IndexUpdate(base, data_version, last, changed, rows, ids, matrix)
+
+    @profiler.timed('search_server.apply_update')
+    def apply_update(self, update):
+        """在读取全文索引的线程中应用 prepare_update 的结果。快照在此期间被整体重建过时丢弃。"""
+        if self.snapshot is not update.base:
+            return False
+        fts = update.base.fts
+        with fts:
+            fts.executemany("DELETE FROM docs WHERE rowid = ?", [(prompt_id,) for prompt_id in update.changed])
+            fts.executemany("INSERT INTO docs (rowid, title, content, tags) VALUES (?, ?, ?, ?)", update.rows)
+        self.snapshot = update.base._replace(ids=update.ids, matrix=update.matrix)
+        self._last_seq = update.last_seq
+        self._data_version = update.data_version
+        profiler.increment('search_server.synced_prompts', len(update.changed))
+        return True
+
+    def refresh(self):
+        """在当前线程中同步数据库的变化（增量或整体重建）。"""
+        if not self.loaded:
+            self.load()
+            return
+        update = self.prepare_update()
+        if update is not None:
+            self.apply_update(update)
+
+    @property
+    def prompt_count(self):
+        return len(np.unique(self.snapshot.ids))
+
+    def keyword_search(self, query, limit):
+        snapshot = self.snapshot
+        fts = snapshot.fts
+        if not query.strip():
+            rows = fts.execute("SELECT rowid, title FROM docs LIMIT ?", (limit,)).fetchall()
+        elif snapshot.fts_trigram and len(query) < 3:
+            # trigram 分词无法匹配少于 3 个字符的查询，退回到 LIKE
+            term = f'%{query}%'
+            rows = fts.execute("SELECT rowid, title FROM docs WHERE title LIKE ? OR tags LIKE ? LIMIT ?",
+                               (term, term, limit)).fetchall()
+        else:
+            phrase = '"' + query.replace('"', '""') + '"'
+            rows = fts.execute("SELECT rowid, title FROM docs WHERE docs MATCH ? ORDER BY rank LIMIT ?",
+                               (phrase, limit)).fetchall()
+        return [{'id': rowid, 'title': title} for rowid, title in rows]
+
+    def get(self, prompt_id):
+        row = self.snapshot.fts.execute("SELECT rowid, title, content, tags FROM docs WHERE rowid = ?",
+                                        (prompt_id,)).fetchone()
+        if row is None:
+            return None
+        return {'id': row[0], 'title': row[1], 'content': row[2], 'tags': row[3].split(',') if row[3] else []}
+
+    def titles(self, ids):
+        if not ids:
+            return {}
+        placeholders = ', '.join('?' * len(ids))
+        rows = self.snapshot.fts.execute(f"SELECT rowid, title FROM docs WHERE rowid IN ({placeholders})",
+                                         ids).fetchall()
+        return dict(rows)
+
+
+def top_k_batch(ids, matrix, queries, ks):
+    """一次矩阵乘法计算一批查询与所有分块的相似度，按 max-sim 聚合后返回每个查询的 [(id, score), ...]。"""
+    if not len(ids):
+        return [[] for _ in ks]
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    queries = queries / np.where(norms == 0, 1, norms)
+    scores = matrix @ queries.T
+    return [database.rank_prompts_by_chunk_scores(ids, np.ascontiguousarray(scores[:, j]), k)
+            for j, k in enumerate(ks)]
+
+
+class MicroBatcher:
+    """把短时间窗口内到达的语义查询合并成一次矩阵乘法。"""
+
+    def __init__(self, index, window=0.002, max_batch=64):
+        self.index = index
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = []
+        self._flush_handle = None
+
+    async def search(self, vector, k):
+        if self.index.dimension and len(vector) != self.index.dimension:
+            raise HTTPError(400, f"向量维度 {len(vector)} 与索引维度 {self.index.dimension} 不一致")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((vector, k, future))
+        if len(self._queue) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._queue = self._queue, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        # 整个批次使用同一份快照，期间重新加载索引也不会混用新旧的 ids 和矩阵
+        snapshot = self.index.snapshot
+        ks = [k for _, k, _ in batch]
+        profiler.increment('search_server.batches')
+        profiler.increment('search_server.batched_queries', len(batch))
+        try:
+            queries = np.vstack([vector for vector, _, _ in batch]).astype(np.float32)
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, top_k_batch, snapshot.ids, snapshot.matrix, queries, ks)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+# --- HTTP 服务 ---
+
+class SearchServer:
+    def __init__(self, index=None, batch_window=0.002, max_batch=64):
+        self.index = index or SearchIndex()
+        self.batcher = MicroBatcher(self.index, batch_window, max_batch)
+        self.started_at = time.time()
+        self.request_count = 0
+        self._refresh_task = None
+
+    async def ensure_fresh(self):
+        """数据库有变化时在后台同步索引，当前请求继续使用现有的快照，不等待同步完成。"""
+        loop = asyncio.get_running_loop()
+        if not self.index.loaded:
+            await loop.run_in_executor(None, self.index.load)
+            return
+        if self._refresh_task is None and self.index.is_stale():
+            self._refresh_task = loop.create_task(self._refresh())
+
+    async def _refresh(self):
+        try:
+            update = await asyncio.get_running_loop().run_in_executor(None, self.index.prepare_update)
+            if update is not None:
+                self.index.apply_update(update)
+        except Exception as e:
+            # 同步失败时继续使用旧快照，下一次检查时重试
+            profiler.increment('search_server.refresh_errors')
+            print(f"同步索引失败: {e}", file=sys.stderr)
+        finally:
+            self._refresh_task = None
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('utf-8', errors='replace').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0) or 0)
+                body = await reader.readexactly(length) if length else b''
+
+                start = time.perf_counter()
+                route, status, payload = await self.dispatch(method, target, body)
+                profiler.observe(f'search_server.{route}', time.perf_counter() - start)
+                self.request_count += 1
+
+                if isinstance(payload, str):
+                    data, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+                else:
+                    data, content_type = json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json'
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write((f"{version} {status} {'OK' if status == 200 else 'Error'}\r\n"
+                              f"Content-Type: {content_type}; charset=utf-8\r\n"
+                              f"Content-Length: {len(data)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        route = 'unknown'
+        try:
+            if body:
+                try:
+                    payload = json.loads(body)
+                except json.JSONDecodeError:
+                    raise HTTPError(400, "请求体不是合法的 JSON")
+                if not isinstance(payload, dict):
+                    raise HTTPError(400, "请求体必须是 JSON 对象")
+                params.update(payload)
+            await self.ensure_fresh()
+            if url.path == '/search' and method in ('GET', 'POST'):
+                route = 'search'
+                return route, 200, await self.search(params)
+            if url.path.startswith('/prompts/') and method == 'GET':
+                route = 'get_prompt'
+                try:
+                    prompt_id = int(url.path[len('/prompts/'):])
+                except ValueError:
+                    raise HTTPError(400, "无效的提示词 ID")
+                prompt = self.index.get(prompt_id)
+                if prompt is None:
+                    raise HTTPError(404, "提示词不存在")
+                return route, 200, prompt
+            if url.path == '/stats':
+                route = 'stats'
+                return route, 200, self.stats()
+            if url.path == '/metrics':
+                route = 'metrics'
+                return route, 200, profiler.to_prometheus()
+            if url.path == '/health':
+                route = 'health'
+                return route, 200, {'status': 'ok'}
+            raise HTTPError(404, "未知的路径")
+        except HTTPError as e:
+            return route, e.status, {'error': str(e)}
+        except (ValueError, RuntimeError) as e:
+            return route, 502, {'error': str(e)}
+
+    async def search(self, params):
+        try:
+            k = int(params.get('k', 10))
+        except (TypeError, ValueError):
+            raise HTTPError(400, "k 必须是整数")
+        if k < 1:
+            raise HTTPError(400, "k 必须大于 0")
+        query = params.get('q') or params.get('query') or ''
+        if not isinstance(query, str):
+            raise HTTPError(400, "q 必须是字符串")
+        vector = params.get('vector')
+        mode = params.get('mode') or ('semantic' if vector is not None else 'keyword')
+        if mode == 'keyword':
+            return {'mode': mode, 'results': self.index.keyword_search(query, k)}
+        if mode != 'semantic':
+            raise HTTPError(400, f"未知的检索模式: {mode}")
+        if vector is None:
+            if not query.strip():
+                raise HTTPError(400, "语义检索需要提供 q 或 vector")
+            vector = await asyncio.get_running_loop().run_in_executor(None, llm_client.get_embedding, query,
+                                                                       self.index.embedding_model)
+        try:
+            vector = np.asarray(vector, dtype=np.float32)
+        except (TypeError, ValueError):
+            raise HTTPError(400, "vector 必须是数字数组")
+        if vector.ndim != 1 or not len(vector):
+            raise HTTPError(400, "vector 必须是非空的一维数字数组")
+        hits = await self.batcher.search(vector, k)
+        titles = self.index.titles([prompt_id for prompt_id, _ in hits])
+        return {'mode': mode, 'results': [{'id': prompt_id, 'title': titles.get(prompt_id), 'score': score}
+                                          for prompt_id, score in hits]}
+
+    def stats(self):
+        uptime = time.time() - self.started_at
+        return {
+            'prompts_indexed': self.index.prompt_count,
+            'chunks_indexed': int(len(self.index.ids)),
+            'dimension': self.index.dimension,
+            'embedding_model': self.index.embedding_model,
+            'requests': self.request_count,
+            'uptime_seconds': uptime,
+            'requests_per_second': self.request_count / uptime if uptime else 0.0,
+            'latency': profiler.snapshot()['histograms'],
+        }
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, batch_window=0.002, max_batch=64):
+    profiler.enable()
+    server = SearchServer(batch_window=batch_window, max_batch=max_batch)
+    await asyncio.get_running_loop().run_in_executor(None, server.index.load)
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+    print(f"检索服务已启动: http://{host}:{port} (已索引 {server.index.prompt_count} 个提示词)")
+    async with listener:
+        await listener.serve_forever()
+
+
+# --- 压测工具 ---
+
+async def _request(reader, writer, host, method, path, payload=None):
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+                  f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    data = await reader.readexactly(length)
+    return status, data
+
+
+async def run_load_test(host=DEFAULT_HOST, port=DEFAULT_PORT, mode='semantic', concurrency=32,
+                        total_requests=2000, k=10, query='test'):
+    """并发发送请求，返回吞吐量和延迟分位数。语义模式下使用随机向量，不会调用 Embedding API。"""
+    reader, writer = await asyncio.open_connection(host, port)
+    _, data = await _request(reader, writer, host, 'GET', '/stats')
+    writer.close()
+    stats = json.loads(data)
+    dim = stats['dimension']
+    if mode == 'semantic' and not dim:
+        raise RuntimeError("索引中没有向量，无法进行语义检索压测。")
+    if mode == 'fetch':
+        _, data = await _request(*(await asyncio.open_connection(host, port)), host, 'GET', '/search?k=1000')
+        fetch_ids = [r['id'] for r in json.loads(data)['results']] or [1]
+    rng = np.random.default_rng(0)
+    latencies, errors = [], 0
+    remaining = iter(range(total_requests))
+
+    async def worker():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for i in remaining:
+                if mode == 'semantic':
+                    args = ('POST', '/search', {'vector': rng.standard_normal(dim).tolist(), 'k': k})
+                elif mode == 'keyword':
+                    args = ('POST', '/search', {'q': query, 'mode': 'keyword', 'k': k})
+                else:
+                    args = ('GET', f'/prompts/{fetch_ids[i % len(fetch_ids)]}')
+                start = time.perf_counter()
+                status, _ = await _request(reader, writer, host, *args)
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    errors += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p95': float(np.percentile(latencies_ms, 95)),
+            'p99': float(np.percentile(latencies_ms, 99)),
+            'max': float(latencies_ms.max()),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="提示词库本地检索服务")
+    parser.add_argument('--db', help="数据库文件路径")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('serve', help="启动检索服务")
+    p.add_argument('--host', default=DEFAULT_HOST)
+    p.add_argument('--port', type=int, default=DEFAULT_PORT)
+    p.add_argument('--batch-window-ms', type=float, default=2.0, help="语义查询合并批处理的等待时间")
+    p.add_argument('--max-batch', type=int, default=64)
+    p = subparsers.add_parser('bench', help="对运行中的服务进行压测")
+    p.add_argument('--host', default=DEFAULT_HOST)
+    p.add_argument('--port', type=int, default=DEFAULT_PORT)
+    p.add_argument('--mode', choices=['semantic', 'keyword', 'fetch'], default='semantic')
+    p.add_argument('--concurrency', type=int, default=32)
+    p.add_argument('--requests', type=int, default=2000)
+    p.add_argument('--k', type=int, default=10)
+    p.add_argument('--query', default='test', help="关键词模式下使用的查询")
+    args = parser.parse_args(argv)
+    if args.db:
+        database.DATABASE_PATH = os.path.abspath(args.db)
+
+    if args.command == 'serve':
+        database.init_db()
+        try:
+            asyncio.run(serve(args.host, args.port, args.batch_window_ms / 1000.0, args.max_batch))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    report = asyncio.run(run_load_test(args.host, args.port, args.mode, args.concurrency,
+                                       args.requests, args.k, args.query))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
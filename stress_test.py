@@ -0,0 +1,183 @@
+"""多进程并发读写压测：模拟多人共用同一个 prompts.db。
+
+读进程循环执行列表查询、详情读取和语义检索；写进程以“读取 → 编辑 → 带版本号保存”的方式
+修改一小部分热点提示词，因此会产生真实的写冲突。结束后报告吞吐量、延迟和冲突率。
+
+    python stress_test.py --readers 8 --writers 8 --duration 20
+    python stress_test.py --db //server/share/prompts_copy.db --journal-mode DELETE
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def _configure(db_path, journal_mode):
+    # 子进程在导入 database 之前设置日志模式，保证与主进程一致
+    os.environ['PROMPT_MANAGER_JOURNAL_MODE'] = journal_mode
+    import database
+    import profiler
+    database.DATABASE_PATH = db_path
+    profiler.enable()
+    return database, profiler
+
+
+def seed_database(db_path, journal_mode, prompts, dimension):
+    database, _ = _configure(db_path, journal_mode)
+    database.init_db()
+    rng = np.random.default_rng(0)
+    items = [(f"提示词 {i}", f"内容 {i} " * 20, rng.standard_normal(dimension).astype(np.float32))
+             for i in range(prompts)]
+    return database.add_prompts(items)
+
+
+def _latency_summary(latencies):
+    if not latencies:
+        return {'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'p50': float(np.percentile(latencies_ms, 50)),
+        'p95': float(np.percentile(latencies_ms, 95)),
+        'max': float(latencies_ms.max()),
+    }
+
+
+def reader_process(db_path, journal_mode, prompt_ids, dimension, duration, seed, results):
+    database, _ = _configure(db_path, journal_mode)
+    rng = random.Random(seed)
+    vectors = np.random.default_rng(seed).standard_normal((16, dimension)).astype(np.float32)
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            operation = rng.random()
+            if operation < 0.4:
+                database.get_prompt_details(rng.choice(prompt_ids))
+            elif operation < 0.8:
+                database.search_prompts(rng.choice(["", "提示词 1", "提示词 2"]))
+            else:
+                database.semantic_search_prompts(vectors[rng.randrange(len(vectors))])
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    results.put({'role': 'reader', 'ops': len(latencies), 'errors': errors, 'latencies': latencies})
+
+
+def writer_process(db_path, journal_mode, hot_ids, duration, think_time, seed, results):
+    database, profiler = _configure(db_path, journal_mode)
+    rng = random.Random(seed)
+    latencies, conflicts, errors = [], 0, 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        prompt_id = rng.choice(hot_ids)
+        prompt = database.get_prompt_details(prompt_id)
+        # 模拟用户在加载和保存之间的编辑时间
+        time.sleep(rng.uniform(0, think_time))
+        start = time.perf_counter()
+        try:
+            database.save_prompt_snapshot(prompt_id, prompt['title'],
+                                          content=prompt['content'] + f"\n编辑 {seed}",
+                                          expected_version=prompt['version'])
+        except database.ConflictError:
+            conflicts += 1
+            continue
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    retries = profiler.snapshot()['counters'].get('database.write_retries', 0)
+    results.put({'role': 'writer', 'ops': len(latencies), 'conflicts': conflicts, 'errors': errors,
+                 'retries': retries, 'latencies': latencies})
+
+
+def run_stress_test(db_path, readers=4, writers=4, duration=10.0, prompts=500, hot=20, dimension=64,
+                    think_time=0.005, journal_mode='WAL'):
+    """启动 readers 个读进程和 writers 个写进程，运行 duration 秒，返回汇总结果。"""
+    prompt_ids = seed_database(db_path, journal_mode, prompts, dimension)
+    hot_ids = prompt_ids[:max(1, hot)]
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=reader_process,
+                                 args=(db_path, journal_mode, prompt_ids, dimension, duration, i, results))
+                 for i in range(readers)]
+    processes += [context.Process(target=writer_process,
+                                  args=(db_path, journal_mode, hot_ids, duration, think_time, 1000 + i, results))
+                  for i in range(writers)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    reader_reports = [r for r in reports if r['role'] == 'reader']
+    writer_reports = [r for r in reports if r['role'] == 'writer']
+    reads = sum(r['ops'] for r in reader_reports)
+    writes = sum(r['ops'] for r in writer_reports)
+    conflicts = sum(r['conflicts'] for r in writer_reports)
+    attempts = writes + conflicts + sum(r['errors'] for r in writer_reports)
+    return {
+        'journal_mode': journal_mode,
+        'readers': readers,
+        'writers': writers,
+        'seconds': elapsed,
+        'reads': reads,
+        'reads_per_second': reads / duration,
+        'read_errors': sum(r['errors'] for r in reader_reports),
+        'read_latency_ms': _latency_summary([x for r in reader_reports for x in r['latencies']]),
+        'writes': writes,
+        'writes_per_second': writes / duration,
+        'write_conflicts': conflicts,
+        'conflict_rate': conflicts / attempts if attempts else 0.0,
+        'write_errors': sum(r['errors'] for r in writer_reports),
+        'write_retries': sum(r['retries'] for r in writer_reports),
+        'write_latency_ms': _latency_summary([x for r in writer_reports for x in r['latencies']]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多进程并发读写压测")
+    parser.add_argument('--db', help="数据库文件路径，默认在临时目录中新建；不要指向正在使用的库")
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help="运行秒数")
+    parser.add_argument('--prompts', type=int, default=500, help="预先写入的提示词数量")
+    parser.add_argument('--hot', type=int, default=20, help="写进程竞争修改的提示词数量，越小冲突越多")
+    parser.add_argument('--dimension', type=int, default=64)
+    parser.add_argument('--think-time', type=float, default=0.005, help="读取与保存之间的最长间隔（秒）")
+    parser.add_argument('--journal-mode', default=os.environ.get('PROMPT_MANAGER_JOURNAL_MODE', 'WAL'))
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.abspath(args.db) if args.db else os.path.join(tmp_dir, 'stress.db')
+        report = run_stress_test(db_path, readers=args.readers, writers=args.writers, duration=args.duration,
+                                 prompts=args.prompts, hot=args.hot, dimension=args.dimension,
+                                 think_time=args.think_time, journal_mode=args.journal_mode.upper())
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+    print(f"日志模式 {report['journal_mode']}，{report['readers']} 个读进程，{report['writers']} 个写进程，"
+          f"运行 {report['seconds']:.1f} 秒")
+    latency = report['read_latency_ms']
+    print(f"读: {report['reads']} 次 ({report['reads_per_second']:.0f}/s)，错误 {report['read_errors']}，"
+          f"延迟 p50 {latency['p50']:.2f} ms / p95 {latency['p95']:.2f} ms / max {latency['max']:.2f} ms")
+    latency = report['write_latency_ms']
+    print(f"写: {report['writes']} 次 ({report['writes_per_second']:.0f}/s)，冲突 {report['write_conflicts']} "
+          f"({report['conflict_rate']:.1%})，锁错误 {report['write_errors']}，重试 {report['write_retries']}，"
+          f"延迟 p50 {latency['p50']:.2f} ms / p95 {latency['p95']:.2f} ms / max {latency['max']:.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
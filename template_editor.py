@@ -0,0 +1,93 @@
+"""模板编辑器：{{变量}} 高亮和增量的变量跟踪，编辑数 MB 的提示词时也不会卡顿。
+
+每次按键只处理受影响的文本块（段落），不再反复调用 toPlainText() 复制整个文档。
+变量不能跨行（VARIABLE_PATTERN 不匹配换行），因此重新扫描变化所在的块就足以保持结果正确。
+"""
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QColor, QFont, QSyntaxHighlighter, QTextCharFormat
+from PySide6.QtWidgets import QPlainTextEdit
+
+from template_variables import VariableIndex, find_variables
+
+# 超过这个字符数时预览改为停顿后再刷新
+LARGE_DOCUMENT_CHARS = 200_000
+LARGE_DOCUMENT_PREVIEW_DELAY_MS = 300
+
+
+class VariableHighlighter(QSyntaxHighlighter):
+    """{{变量}} 高亮。QSyntaxHighlighter 只对内容发生变化的块调用 highlightBlock。"""
+
+    def __init__(self, document):
+        super().__init__(document)
+        self.variable_format = QTextCharFormat()
+        self.variable_format.setForeground(QColor('#4fc1ff'))
+        self.variable_format.setFontWeight(QFont.Bold)
+
+    def highlightBlock(self, text):
+        for position, length, _ in find_variables(text):
+            self.setFormat(position, length, self.variable_format)
+
+
+class VariableTracker(QObject):
+    """根据 QTextDocument.contentsChange 的增量维护变量位置，变量集合变化时发出 variablesChanged。"""
+    variablesChanged = Signal(list)
+
+    def __init__(self, document, parent=None):
+        super().__init__(parent)
+        self.document = document
+        self.index = VariableIndex()
+        self._char_count = document.characterCount()
+        self.rebuild()
+        document.contentsChange.connect(self.on_contents_change)
+
+    def variables(self):
+        return self.index.variables()
+
+    def rebuild(self):
+        before = set(self.index.counts)
+        self.index.reset(find_variables(self.document.toPlainText()))
+        self._char_count = self.document.characterCount()
+        if set(self.index.counts) != before:
+            self.variablesChanged.emit(self.index.variables())
+
+    def on_contents_change(self, position, chars_removed, chars_added):
+        document = self.document
+        old_count, self._char_count = self._char_count, document.characterCount()
+        # 触及文档末尾段落分隔符的变化只来自整体替换（setPlainText 等），直接全部重建
+        if position + chars_added >= self._char_count or position + chars_removed >= old_count:
+            self.rebuild()
+            return
+        first = document.findBlock(position)
+        last = document.findBlock(position + chars_added)
+        start = first.position()
+        end = last.position() + last.length()
+        delta = chars_added - chars_removed
+        occurrences = []
+        block = first
+        while block.isValid():
+            occurrences.extend(find_variables(block.text(), block.position()))
+            if block == last:
+                break
+            block = block.next()
+        if self.index.replace_range(start, end - delta, delta, occurrences):
+            self.variablesChanged.emit(self.index.variables())
+
+
+class TemplateEditor(QPlainTextEdit):
+    """模板编辑区。QPlainTextEdit 按行布局，比 QTextEdit 更适合很长的纯文本。"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.highlighter = VariableHighlighter(self.document())
+        self.variable_tracker = VariableTracker(self.document(), self)
+        self.variablesChanged = self.variable_tracker.variablesChanged
+
+    def variables(self):
+        return self.variable_tracker.variables()
+
+    def character_before_cursor(self):
+        position = self.textCursor().position()
+        return self.document().characterAt(position - 1) if position > 0 else ''
+
+    def is_large_document(self):
+        return self.document().characterCount() > LARGE_DOCUMENT_CHARS
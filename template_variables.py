@@ -0,0 +1,56 @@
+"""{{变量}} 的查找与增量索引，不依赖 Qt，模板编辑器和测试共用。
+
+位置一律使用 Qt 的 UTF-16 单位，与 QTextDocument 报告的变化位置一致。
+"""
+from bisect import bisect_left
+from collections import Counter
+
+import prompt_api
+
+
+def utf16_offsets(text, indexes):
+    """把 Python 字符串下标转换为 Qt 使用的 UTF-16 位置（只有包含 BMP 以外的字符时才需要换算）。"""
+    if len(text.encode('utf-16-le')) == 2 * len(text):
+        return list(indexes)
+    return [len(text[:i].encode('utf-16-le')) // 2 for i in indexes]
+
+
+def find_variables(text, base=0):
+    """返回 text 中的变量出现位置 [(Qt 位置, 长度, 变量名), ...]。"""
+    matches = list(prompt_api.VARIABLE_PATTERN.finditer(text))
+    if not matches:
+        return []
+    bounds = utf16_offsets(text, [i for m in matches for i in (m.start(), m.end())])
+    return [(base + bounds[2 * k], bounds[2 * k + 1] - bounds[2 * k], m.group(1))
+            for k, m in enumerate(matches)]
+
+
+class VariableIndex:
+    """按位置排序的变量出现记录，以及每个变量名的出现次数。不依赖 Qt。"""
+
+    def __init__(self):
+        self.positions = []
+        self.names = []
+        self.counts = Counter()
+
+    def variables(self):
+        return sorted(self.counts)
+
+    def reset(self, occurrences):
+        self.positions = [position for position, _, _ in occurrences]
+        self.names = [name for _, _, name in occurrences]
+        self.counts = Counter(self.names)
+
+    def replace_range(self, start, old_end, delta, occurrences):
+        """删除旧文档 [start, old_end) 内的记录，把 old_end 之后的记录平移 delta，
+        再插入重新扫描得到的 occurrences。返回变量名集合是否发生了变化。"""
+        before = set(self.counts)
+        lo = bisect_left(self.positions, start)
+        hi = bisect_left(self.positions, old_end)
+        self.counts.subtract(self.names[lo:hi])
+        tail = [position + delta for position in self.positions[hi:]] if delta else self.positions[hi:]
+        self.positions[lo:] = [position for position, _, _ in occurrences] + tail
+        self.names[lo:hi] = [name for _, _, name in occurrences]
+        self.counts.update(name for _, _, name in occurrences)
+        self.counts = +self.counts  # 去掉计数为 0 的变量
+        return set(self.counts) != before
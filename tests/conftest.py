@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """在临时目录中新建数据库，并把工作目录切换过去（config.json 相对于工作目录读取）。"""
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'prompts.db'))
+    monkeypatch.chdir(tmp_path)
+    database.init_db()
+    return tmp_path
+
+
+@pytest.fixture
+def mock_llm(temp_db):
+    """启动本地模拟的 LLM / Embedding 接口，并在临时工作目录中写入指向它的 config.json。"""
+    import llm_client
+    import mock_llm_server
+
+    server = mock_llm_server.start(dimension=16)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    llm_client.save_llm_config({'base_url': base_url, 'api_key': 'test', 'model': 'mock-chat',
+                                'embedding_base_url': base_url, 'embedding_api_key': 'test',
+                                'embedding_model': 'mock-embedding'})
+    yield server
+    server.shutdown()
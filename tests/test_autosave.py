@@ -0,0 +1,178 @@
+import threading
+import time
+
+import autosave
+import database
+
+
+def make_engine(tmp_path, release):
+    def embed(content, model=None):
+        release.wait(10)
+        return None, []
+    return autosave.AutoSaveEngine(journal_path=str(tmp_path / 'journal.json'), embed_function=embed)
+
+
+def test_outstanding_save_is_visible_and_not_overwritten_by_stale_load(temp_db):
+    prompt_id = database.add_prompt("标题", "旧内容")
+    release = threading.Event()
+    engine = make_engine(temp_db, release)
+    try:
+        version = database.get_prompt_version(prompt_id)
+        assert engine.remember(prompt_id, "标题", "旧内容", [], version=version)
+        snapshot = autosave.make_snapshot(prompt_id, "标题", "新内容", [])
+        assert engine.submit(snapshot)
+        # 写线程阻塞在生成 embedding 上，保存仍未落盘
+        assert not engine.flush(timeout=0.05)
+        assert engine.pending_snapshot(prompt_id) == snapshot
+        assert not engine.remember(prompt_id, "标题", "旧内容", [], version=version)
+
+        release.set()
+        assert engine.flush(timeout=10)
+        assert engine.pending_snapshot(prompt_id) is None
+        assert database.get_prompt_details(prompt_id)['content'] == "新内容"
+        # 落盘后引擎自己记录了新版本，相同的内容不会再次提交
+        assert not engine.submit(autosave.make_snapshot(prompt_id, "标题", "新内容", []))
+    finally:
+        release.set()
+        engine.stop(10)
+
+
+def test_pending_snapshot_only_for_same_prompt(temp_db):
+    first, second = database.add_prompts([("一", "内容一"), ("二", "内容二")])
+    release = threading.Event()
+    engine = make_engine(temp_db, release)
+    try:
+        engine.submit(autosave.make_snapshot(first, "一", "改过", []))
+        assert engine.pending_snapshot(second) is None
+        assert engine.remember(second, "二", "内容二", [])
+    finally:
+        release.set()
+        engine.stop(10)
+
+
+def test_journal_is_written_in_background_and_recovered(temp_db):
+    first, second = database.add_prompts([("一", "内容一"), ("二", "内容二")])
+    release = threading.Event()
+    engine = make_engine(temp_db, release)
+    try:
+        for i in range(3):
+            engine.submit(autosave.make_snapshot(first, "一", f"草稿 {i}", ["标签"]))
+        engine.submit(autosave.make_snapshot(second, "二", "改过", []))
+        assert engine.flush_journal(timeout=10)
+        # 保存还没有落盘，另一个引擎（即下次启动）能从日志中恢复每个提示词的最新快照
+        other = autosave.AutoSaveEngine(journal_path=engine.journal_path)
+        try:
+            recovered = {s.prompt_id: s for s, _ in other.recover()}
+        finally:
+            other.stop(10)
+        assert set(recovered) == {first, second}
+        assert (recovered[first].content, recovered[first].tags) == ("草稿 2", ("标签",))
+
+        release.set()
+        assert engine.flush(timeout=10)
+        assert engine.recover() == []
+    finally:
+        release.set()
+        engine.stop(10)
+
+
+def test_journal_ignores_truncated_line_and_compacts(temp_db, monkeypatch):
+    monkeypatch.setattr(autosave, 'JOURNAL_COMPACT_MIN_LINES', 4)
+    prompt_id = database.add_prompt("标题", "内容")
+    release = threading.Event()
+    engine = make_engine(temp_db, release)
+    try:
+        for i in range(10):
+            engine.submit(autosave.make_snapshot(prompt_id, "标题", f"草稿 {i}", []))
+            assert engine.flush_journal(timeout=10)
+        with open(engine.journal_path, encoding='utf-8') as f:
+            assert len(f.readlines()) <= 4
+        with open(engine.journal_path, 'a', encoding='utf-8') as f:
+            f.write('{"prompt_id": ')
+        assert [s.content for s, _ in engine.recover()] == ["草稿 9"]
+    finally:
+        release.set()
+        engine.stop(10)
+
+
+def test_recovered_change_conflicts_with_newer_save(temp_db):
+    prompt_id = database.add_prompt("标题", "原内容")
+    version = database.get_prompt_version(prompt_id)
+    release = threading.Event()
+    engine = make_engine(temp_db, release)
+    try:
+        engine.remember(prompt_id, "标题", "原内容", [], version=version)
+        engine.submit(autosave.make_snapshot(prompt_id, "标题", "我的旧修改", []))
+        assert engine.flush_journal(timeout=10)
+        # 本地的保存落盘之前，其他人保存了新版本；随后本进程退出
+        database.save_prompt_snapshot(prompt_id, "标题", content="同事的修改", expected_version=version)
+    finally:
+        release.set()
+        engine.stop(10)
+
+    results = []
+    engine = autosave.AutoSaveEngine(journal_path=engine.journal_path, on_saved=results.append,
+                                     embed_function=lambda content, model=None: (None, []))
+    try:
+        recovered = engine.recover()
+        assert [(s.content, v) for s, v in recovered] == [("我的旧修改", version)]
+        for snapshot, base_version in recovered:
+            engine.restore(snapshot, base_version)
+        assert engine.flush(timeout=10)
+        assert [r.conflict for r in results] == [True]
+        assert database.get_prompt_details(prompt_id)['content'] == "同事的修改"
+        # 更改仍在恢复日志中，用户选择覆盖后才写入
+        assert [s.content for s, _ in engine.recover()] == ["我的旧修改"]
+        engine.resolve_conflict(prompt_id, overwrite=True)
+        assert engine.flush(timeout=10)
+        assert database.get_prompt_details(prompt_id)['content'] == "我的旧修改"
+        assert engine.recover() == []
+    finally:
+        engine.stop(10)
+
+
+def test_journal_version_follows_completed_save(temp_db):
+    prompt_id = database.add_prompt("标题", "原内容")
+    version = database.get_prompt_version(prompt_id)
+    gate = threading.Semaphore(0)
+    started = threading.Event()
+
+    def embed(content, model=None):
+        started.set()
+        gate.acquire(timeout=10)
+        return None, []
+
+    engine = autosave.AutoSaveEngine(journal_path=str(temp_db / 'journal.jsonl'), embed_function=embed)
+    try:
+        engine.remember(prompt_id, "标题", "原内容", [], version=version)
+        engine.submit(autosave.make_snapshot(prompt_id, "标题", "第一次", []))
+        assert started.wait(10)
+        engine.submit(autosave.make_snapshot(prompt_id, "标题", "第二次", []))
+        # 只放行第一次保存：日志中仍未落盘的第二次修改改以新写入的版本为基准
+        gate.release()
+        deadline = time.monotonic() + 10
+        while True:
+            assert engine.flush_journal(timeout=10)
+            recovered = engine.recover()
+            if [v for _, v in recovered] == [version + 1] or time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+        assert [(s.content, v) for s, v in recovered] == [("第二次", version + 1)]
+        gate.release()
+        assert engine.flush(timeout=10)
+        assert database.get_prompt_details(prompt_id)['content'] == "第二次"
+    finally:
+        gate.release()
+        gate.release()
+        engine.stop(10)
+
+
+def test_default_journal_path_is_per_user_and_per_database(temp_db, monkeypatch):
+    monkeypatch.setenv('PROMPT_MANAGER_DATA_DIR', str(temp_db / 'alice'))
+    first = autosave.default_journal_path()
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(temp_db / 'other.db'))
+    second = autosave.default_journal_path()
+    assert first != second
+    assert all(path.startswith(str(temp_db / 'alice')) for path in (first, second))
+    monkeypatch.setenv('PROMPT_MANAGER_DATA_DIR', str(temp_db / 'bob'))
+    assert autosave.default_journal_path().startswith(str(temp_db / 'bob'))
@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+import batch_optimize
+import database
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(batch_optimize, 'RETRY_BACKOFF', 0.01)
+
+
+def add_prompts(n):
+    return database.add_prompts((f"提示词 {i}", f"内容 {i}") for i in range(n))
+
+
+def latest_version(prompt_id):
+    return database.get_prompt_versions(prompt_id)[0]['content']
+
+
+def test_run_job_completes_and_saves_versions(mock_llm):
+    ids = add_prompts(6)
+    job_id = batch_optimize.create_job('optimize', ids)
+    seen = []
+    status = batch_optimize.run_job(job_id, workers=3, rate=100,
+                                    progress=lambda done, total, prompt_id, error: seen.append((done, total, error)))
+    assert status == ('completed', 6, 0)
+    assert sorted(done for done, _, _ in seen) == list(range(1, 7))
+    assert all(total == 6 and error is None for _, total, error in seen)
+    for i, prompt_id in enumerate(ids):
+        assert latest_version(prompt_id) == f"内容 {i}\n\n（已优化）"
+        # 结果只保存为历史版本，不修改当前内容
+        assert database.get_prompt_details(prompt_id)['content'] == f"内容 {i}"
+    job = database.get_batch_job(job_id)
+    assert (job['status'], job['done'], job['pending']) == ('completed', 6, 0)
+    assert mock_llm.state.counts['chat'] == 6
+
+
+def test_stop_event_pauses_and_run_resumes(mock_llm):
+    mock_llm.state.latency = 0.02
+    ids = add_prompts(12)
+    job_id = batch_optimize.create_job('optimize', ids)
+    stop = threading.Event()
+
+    def progress(done, total, prompt_id, error):
+        if done >= 3:
+            stop.set()
+
+    status, succeeded, failed = batch_optimize.run_job(job_id, workers=2, rate=100, progress=progress,
+                                                        stop_event=stop)
+    assert status == 'paused'
+    job = database.get_batch_job(job_id)
+    assert job['status'] == 'running'
+    assert job['done'] == succeeded >= 3
+    assert job['pending'] == 12 - succeeded
+    # 没有设置 ID 时继续最近一个未完成的任务
+    assert database.get_batch_job()['id'] == job_id
+
+    status, resumed, _ = batch_optimize.run_job(workers=2, rate=100)
+    assert status == 'completed'
+    assert succeeded + resumed == 12
+    # 已完成的条目不会再次请求
+    assert mock_llm.state.counts['chat'] == 12
+    assert all(len(database.get_prompt_versions(prompt_id)) == 2 for prompt_id in ids)
+
+
+def test_failed_items_are_retried_then_can_be_rerun(mock_llm, fast_retries):
+    ids = add_prompts(4)
+    job_id = batch_optimize.create_job('optimize', ids)
+    mock_llm.state.error_rate = 1.0
+    errors = []
+    status = batch_optimize.run_job(job_id, workers=2, rate=1000,
+                                    progress=lambda done, total, prompt_id, error: errors.append(error))
+    assert status == ('completed', 0, 4)
+    assert all(errors)
+    assert mock_llm.state.counts['errors'] == 4 * batch_optimize.MAX_ATTEMPTS
+    failed = database.get_batch_job_items(job_id, ('failed',))
+    assert [item['prompt_id'] for item in failed] == ids
+    assert all(item['error'] for item in failed)
+
+    mock_llm.state.error_rate = 0.0
+    # 不带 retry_failed 时失败的条目保持原样
+    assert batch_optimize.run_job(job_id, rate=1000) == ('completed', 0, 0)
+    assert batch_optimize.run_job(job_id, rate=1000, retry_failed=True) == ('completed', 4, 0)
+    assert database.get_batch_job(job_id)['failed'] == 0
+
+
+def test_transient_errors_succeed_on_retry(mock_llm, fast_retries, monkeypatch):
+    monkeypatch.setattr(batch_optimize, 'MAX_ATTEMPTS', 20)
+    ids = add_prompts(10)
+    mock_llm.state.error_rate = 0.5
+    status = batch_optimize.run_job(batch_optimize.create_job('optimize', ids), workers=4, rate=1000)
+    assert status == ('completed', 10, 0)
+    assert mock_llm.state.counts['errors'] > 0
+    assert mock_llm.state.counts['chat'] == 10
+
+
+def test_deleted_prompt_is_reported_as_failed(mock_llm):
+    ids = add_prompts(3)
+    job_id = batch_optimize.create_job('optimize', ids)
+    database.delete_prompt(ids[1])
+    assert batch_optimize.run_job(job_id, rate=1000) == ('completed', 2, 1)
+
+
+def test_run_job_respects_rate_limit(mock_llm):
+    ids = add_prompts(12)
+    job_id = batch_optimize.create_job('optimize', ids)
+    start = time.monotonic()
+    assert batch_optimize.run_job(job_id, workers=4, rate=20)[0] == 'completed'
+    # 起始的 4 个令牌可以突发，其余 8 个请求按每秒 20 个发放
+    assert time.monotonic() - start >= 8 / 20 * 0.9
+
+
+def test_token_bucket_allows_burst_then_limits_rate():
+    bucket = batch_optimize.TokenBucket(rate=50, capacity=5)
+    start = time.monotonic()
+    for _ in range(5):
+        assert bucket.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(10):
+        assert bucket.acquire()
+    assert time.monotonic() - start >= 10 / 50 * 0.9
+
+
+def test_token_bucket_acquire_stops_when_event_set():
+    bucket = batch_optimize.TokenBucket(rate=0.1, capacity=1)
+    assert bucket.acquire()
+    stop = threading.Event()
+    threading.Timer(0.05, stop.set).start()
+    start = time.monotonic()
+    assert not bucket.acquire(stop)
+    assert time.monotonic() - start < 2
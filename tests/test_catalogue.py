@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+import catalogue
+import database
+
+QUERIES = ["", "周报", "翻译", "python", "标签1", "标签", "不存在", "7"]
+
+
+def assert_matches_sql(cat):
+    for query in QUERIES:
+        expected = [row['id'] for row in database.search_prompts(query)]
+        assert [prompt_id for prompt_id, _ in cat.search(query)] == expected, query
+
+
+@pytest.fixture
+def cat(temp_db):
+    catalogue.seed_database(60, 5)
+    cat = catalogue.Catalogue()
+    cat.load()
+    yield cat
+    cat.close()
+
+
+def test_stamp_key_preserves_text_order():
+    values = [None, "2024-05-01 09:00:00", "2024-05-01 09:00:00.000", "2024-05-01 09:00:00.001",
+              "2024-05-01 09:00:01", "2024-12-31 23:59:59.999"]
+    keys = [catalogue.stamp_key(value) for value in values]
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+
+
+def test_search_matches_sql_after_load(cat):
+    # seed_database 在一个事务中写入，许多提示词的 updated_at 相同，顺序由 ID 决定
+    conn = database.get_db_connection()
+    stamps = [row[0] for row in conn.execute("SELECT CAST(updated_at AS TEXT) FROM prompts")]
+    conn.close()
+    assert len(set(stamps)) < len(stamps)
+    assert_matches_sql(cat)
+
+
+def test_search_matches_sql_after_writes(cat):
+    ids = [prompt_id for prompt_id, _ in cat.search()]
+    database.save_prompt_snapshot(ids[-1], "Python 周报 改", tags=["标签1", "新标签"])
+    database.delete_prompt(ids[0])
+    database.add_prompts([("新的 翻译", "内容"), ("另一个 周报", "内容")])
+    database.update_prompt_tags(ids[5], ["标签3"])
+    assert_matches_sql(cat)
+
+    # 其他连接直接修改数据库
+    conn = sqlite3.connect(database.DATABASE_PATH)
+    with conn:
+        conn.execute("UPDATE tags SET name = '改名的标签' WHERE name = '标签1'")
+        conn.execute("UPDATE prompts SET updated_at = '2000-01-01 00:00:00' WHERE id = ?", (ids[10],))
+        conn.execute("UPDATE prompts SET updated_at = NULL WHERE id = ?", (ids[11],))
+    conn.close()
+    assert_matches_sql(cat)
+    assert [prompt_id for prompt_id, _ in cat.search()][-2:] == [ids[10], ids[11]]
+
+
+def test_search_matches_sql_across_compaction_and_index_rebuild(cat, monkeypatch):
+    monkeypatch.setattr(catalogue, 'MAX_DELTA_SLOTS', 3)
+    monkeypatch.setattr(catalogue, 'COMPACT_MIN_DEAD', 5)
+    ids = [prompt_id for prompt_id, _ in cat.search()]
+    for i, prompt_id in enumerate(ids[:30]):
+        if i % 3 == 0:
+            database.delete_prompt(prompt_id)
+        else:
+            database.save_prompt_snapshot(prompt_id, f"周报 {i}", tags=[f"标签{i % 4}"])
+        cat.sync()
+    assert cat.dead < 30
+    assert_matches_sql(cat)
+    assert len(cat) == len(database.search_prompts(''))
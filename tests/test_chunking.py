@@ -0,0 +1,99 @@
+import random
+
+import numpy as np
+import pytest
+
+import chunking
+import database
+
+
+def test_short_text_is_single_chunk():
+    assert chunking.split_into_chunks("hello", max_chars=10) == [(0, 5)]
+    assert chunking.split_into_chunks("x" * 10, max_chars=10) == [(0, 10)]
+
+
+@pytest.mark.parametrize('text', ["", "   ", "\n\n\t"])
+def test_empty_or_whitespace_content(text):
+    assert chunking.split_into_chunks(text, max_chars=10) == [(0, len(text))]
+
+
+def test_breaks_at_paragraph_inside_window():
+    text = "a" * 80 + "\n\n" + "b" * 80
+    spans = chunking.split_into_chunks(text, max_chars=100, overlap=10)
+    assert spans[0] == (0, 82)
+    assert spans[1][0] == 72
+    assert spans[-1][1] == len(text)
+
+
+def test_hard_cut_without_break_characters():
+    text = "x" * 250
+    spans = chunking.split_into_chunks(text, max_chars=100, overlap=20)
+    assert spans == [(0, 100), (80, 180), (160, 250)]
+
+
+def test_overlap_is_capped_at_half_window():
+    spans = chunking.split_into_chunks("x" * 300, max_chars=100, overlap=90)
+    assert all(b[0] == a[1] - 50 for a, b in zip(spans, spans[1:]))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_text_spans_cover_and_overlap(seed):
+    rng = random.Random(seed)
+    alphabet = "abc 。，\n"
+    text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 3000)))
+    max_chars, overlap = rng.randint(20, 400), rng.randint(0, 100)
+    spans = chunking.split_into_chunks(text, max_chars=max_chars, overlap=overlap)
+    assert spans[0][0] == 0
+    assert spans[-1][1] == len(text)
+    for start, end in spans:
+        assert 0 <= start < end or len(text) == 0
+        assert end - start <= max_chars
+    for (start, end), (next_start, next_end) in zip(spans, spans[1:]):
+        assert start < next_start <= end
+        assert end - next_start <= min(overlap, max_chars // 2)
+        assert next_end > end
+
+
+def test_embed_content_averages_normalized_chunks():
+    text = "x" * 250
+
+    def embed_batch(texts):
+        return [[len(t), 0.0] for t in texts]
+
+    document, chunks = chunking.embed_content(text, max_chars=100, overlap=20, embed_batch=embed_batch)
+    assert [(start, end) for start, end, _ in chunks] == [(0, 100), (80, 180), (160, 250)]
+    np.testing.assert_allclose(document, [1.0, 0.0])
+
+
+def brute_force_max_sim(chunk_prompt_ids, scores, limit):
+    best = {}
+    for prompt_id, score in zip(chunk_prompt_ids.tolist(), scores.tolist()):
+        best[prompt_id] = max(best.get(prompt_id, -np.inf), score)
+    return sorted(best.items(), key=lambda item: -item[1])[:limit]
+
+
+def test_rank_takes_best_chunk_per_prompt():
+    ids = np.array([1, 1, 2, 3, 3, 3])
+    scores = np.array([0.1, 0.9, 0.5, 0.2, 0.3, 0.8], dtype=np.float32)
+    ranked = database.rank_prompts_by_chunk_scores(ids, scores, 10)
+    assert [prompt_id for prompt_id, _ in ranked] == [1, 3, 2]
+    assert ranked[0][1] == pytest.approx(0.9)
+    assert database.rank_prompts_by_chunk_scores(ids, scores, 2) == ranked[:2]
+
+
+def test_rank_with_no_chunks():
+    assert database.rank_prompts_by_chunk_scores(np.array([], dtype=np.int64), np.array([], dtype=np.float32), 5) == []
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_rank_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    # 少数提示词拥有大量分块，迫使候选集合扩大
+    ids = np.concatenate([np.zeros(500, dtype=np.int64), rng.integers(1, 200, 2000)])
+    rng.shuffle(ids)
+    scores = rng.random(len(ids)).astype(np.float32)
+    limit = int(rng.integers(1, 60))
+    ranked = database.rank_prompts_by_chunk_scores(ids, scores, limit)
+    expected = brute_force_max_sim(ids, scores, limit)
+    assert [prompt_id for prompt_id, _ in ranked] == [prompt_id for prompt_id, _ in expected]
+    np.testing.assert_allclose([s for _, s in ranked], [s for _, s in expected])
@@ -0,0 +1,54 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+import database
+
+
+def test_version_increments_on_every_edit(temp_db):
+    prompt_id = database.add_prompt("标题", "内容")
+    start = database.get_prompt_version(prompt_id)
+    assert database.save_prompt_snapshot(prompt_id, "新标题", expected_version=start) == start + 1
+    database.update_prompt(prompt_id, "新标题", "新内容")
+    assert database.get_prompt_version(prompt_id) == start + 2
+    database.update_prompt_tags(prompt_id, ["标签"])
+    assert database.get_prompt_version(prompt_id) == start + 3
+    assert database.get_prompt_details(prompt_id)['version'] == start + 3
+
+
+def test_embedding_only_writes_keep_version(temp_db):
+    prompt_id = database.add_prompt("标题", "内容")
+    version = database.get_prompt_version(prompt_id)
+    database.update_embeddings([(prompt_id, np.ones(4, dtype=np.float32), [])], 'model')
+    assert database.get_prompt_version(prompt_id) == version
+
+
+def test_stale_version_raises_conflict(temp_db):
+    prompt_id = database.add_prompt("标题", "内容")
+    loaded = database.get_prompt_version(prompt_id)
+    # 同一毫秒内的两次写入也能区分
+    database.save_prompt_snapshot(prompt_id, "其他人", expected_version=loaded)
+    with pytest.raises(database.ConflictError) as info:
+        database.save_prompt_snapshot(prompt_id, "我的修改", content="我的内容", expected_version=loaded)
+    assert info.value.current_version == loaded + 1
+    details = database.get_prompt_details(prompt_id)
+    assert (details['title'], details['content']) == ("其他人", "内容")
+
+
+def test_save_missing_prompt_returns_none(temp_db):
+    assert database.save_prompt_snapshot(12345, "标题", expected_version=0) is None
+
+
+def test_init_db_adds_version_column_to_old_database(tmp_path, monkeypatch):
+    path = tmp_path / 'old.db'
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE prompts (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL,
+                    content TEXT NOT NULL, embedding BLOB, created_at TIMESTAMP, updated_at TIMESTAMP)""")
+    conn.execute("INSERT INTO prompts (title, content) VALUES ('旧', '旧内容')")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(path))
+    database.init_db()
+    assert database.get_prompt_version(1) == 0
+    assert database.save_prompt_snapshot(1, "新", expected_version=0) == 1
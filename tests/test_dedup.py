@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import database
+import dedup
+
+
+def random_unit_rows(rng, n, dim, duplicates=0):
+    matrix = rng.standard_normal((n, dim)).astype(np.float32)
+    # 把部分行改成其他行加上微小扰动，制造近似重复
+    for _ in range(duplicates):
+        a, b = rng.choice(n, size=2, replace=False)
+        matrix[b] = matrix[a] + rng.standard_normal(dim).astype(np.float32) * 0.01
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def brute_force_pairs(matrix, threshold):
+    sims = matrix @ matrix.T
+    i, j = np.nonzero(np.triu(sims >= threshold, k=1))
+    return set(zip(i.tolist(), j.tolist()))
+
+
+def as_set(result):
+    i, j, _ = result
+    return set(zip(i.tolist(), j.tolist()))
+
+
+@pytest.mark.parametrize('memory_limit_mb', [0.001, 0.05, 256])
+def test_full_scan_matches_brute_force_for_any_block_size(memory_limit_mb):
+    matrix = random_unit_rows(np.random.default_rng(0), 300, 16, duplicates=40)
+    expected = brute_force_pairs(matrix, 0.95)
+    assert expected
+    assert as_set(dedup.find_duplicate_pairs(matrix, 0.95, memory_limit_mb)) == expected
+
+
+def test_pairs_are_ordered_and_scored():
+    matrix = random_unit_rows(np.random.default_rng(1), 100, 8, duplicates=10)
+    i, j, sim = dedup.find_duplicate_pairs(matrix, 0.9, 0.01)
+    assert np.all(i < j)
+    np.testing.assert_allclose(sim, np.einsum('ij,ij->i', matrix[i], matrix[j]), rtol=1e-5)
+
+
+def test_rows_mode_finds_pairs_touching_given_rows_once():
+    matrix = random_unit_rows(np.random.default_rng(2), 200, 16, duplicates=30)
+    rows = np.array([3, 50, 51, 120, 199])
+    expected = {(a, b) for a, b in brute_force_pairs(matrix, 0.95) if a in rows or b in rows}
+    i, j, _ = dedup.find_duplicate_pairs(matrix, 0.95, 0.001, rows=rows)
+    found = list(zip(i.tolist(), j.tolist()))
+    assert len(found) == len(set(found))
+    assert set(found) == expected
+
+
+def test_empty_matrix():
+    i, j, sim = dedup.find_duplicate_pairs(np.zeros((0, 4), dtype=np.float32))
+    assert len(i) == len(j) == len(sim) == 0
+
+
+def test_group_pairs_merges_transitively():
+    groups = dedup.group_pairs(np.array([1, 2, 7]), np.array([2, 3, 8]))
+    assert groups == [[1, 2, 3], [7, 8]]
+
+
+def test_analyze_incremental_matches_full_recompute(temp_db):
+    rng = np.random.default_rng(3)
+    base = random_unit_rows(rng, 60, 8)
+    ids = database.add_prompts([(f"p{i}", "内容", base[i]) for i in range(60)])
+    near = base[5] + np.float32(0.001)
+    database.add_prompt("重复", "内容", embedding=near.astype(np.float32))
+
+    first = dedup.analyze(threshold=0.99, clusters=3)
+    assert not first.incremental
+    assert [ids[5], ids[-1] + 1] in first.groups
+
+    database.add_prompt("又一个重复", "内容", embedding=base[10].copy())
+    incremental = dedup.analyze(threshold=0.99, clusters=3)
+    full = dedup.analyze(threshold=0.99, clusters=3, refresh=True)
+    assert incremental.incremental and not full.incremental
+    assert incremental.groups == full.groups
+    assert sorted(incremental.labels) == sorted(full.labels)
+    assert sum(incremental.cluster_sizes) == len(full.ids)
@@ -0,0 +1,66 @@
+import pytest
+
+import database
+import embedding_migration
+import llm_client
+
+
+def add_prompts(n):
+    return database.add_prompts((f"提示词 {i}", f"内容 {i}") for i in range(n))
+
+
+def chunk_models(prompt_id):
+    conn = database.get_db_connection()
+    rows = conn.execute("SELECT DISTINCT embedding_model FROM prompt_chunks WHERE prompt_id = ?",
+                        (prompt_id,)).fetchall()
+    conn.close()
+    return {row[0] for row in rows}
+
+
+def test_failed_items_are_recorded_and_migration_completes(mock_llm):
+    ids = add_prompts(40)
+    mock_llm.state.error_rate = 0.3
+    migration_id = embedding_migration.start('mock-embedding-v2')
+    assert database.get_embedding_migration(migration_id)['total'] == database.count_prompts() == len(ids)
+    status = embedding_migration.run(migration_id, batch_size=8, workers=4)
+    assert status == 'completed'
+    assert llm_client.get_embedding_model() == 'mock-embedding-v2'
+
+    failures = database.get_embedding_migration_failures(migration_id)
+    failed_ids = {row['prompt_id'] for row in failures}
+    assert failed_ids and len(failed_ids) < len(ids)
+    assert all(row['error'] for row in failures)
+    for prompt_id in ids:
+        has_vector = database.get_prompt_details(prompt_id)['embedding'] is not None
+        assert has_vector == (prompt_id not in failed_ids)
+        assert chunk_models(prompt_id) == (set() if prompt_id in failed_ids else {'mock-embedding-v2'})
+
+
+def test_catch_up_skips_failed_items_until_edited(mock_llm):
+    ids = add_prompts(5)
+    migration_id = embedding_migration.start('mock-embedding-v2')
+    versions = {p['id']: p['version'] for p in database.get_prompts_for_embedding(0, 10)}
+    database.save_embedding_migration_batch(migration_id, 'mock-embedding-v2', [],
+                                            failures=[(ids[0], versions[ids[0]], "失败")])
+    pending = database.get_prompts_for_embedding(0, 10, missing_model='mock-embedding-v2', migration_id=migration_id)
+    assert ids[0] not in [p['id'] for p in pending]
+
+    database.save_prompt_snapshot(ids[0], "修改过", content="新的内容")
+    pending = database.get_prompts_for_embedding(0, 10, missing_model='mock-embedding-v2', migration_id=migration_id)
+    assert ids[0] in [p['id'] for p in pending]
+
+    assert embedding_migration.run(migration_id, batch_size=2, workers=1) == 'completed'
+    assert database.get_embedding_migration_failures(migration_id) == []
+    assert chunk_models(ids[0]) == {'mock-embedding-v2'}
+
+
+def test_configuration_error_aborts_migration(mock_llm):
+    add_prompts(3)
+    migration_id = embedding_migration.start('mock-embedding-v2')
+    llm_client.save_llm_config({'embedding_api_key': ''})
+    with pytest.raises(ValueError):
+        embedding_migration.run(migration_id, workers=1)
+    migration = database.get_embedding_migration(migration_id)
+    assert migration['status'] == 'running'
+    assert migration['error']
+    assert database.get_embedding_migration_failures(migration_id) == []
@@ -0,0 +1,26 @@
+import threading
+
+import profiler
+
+
+def test_sql_outside_timed_calls_is_not_retained(monkeypatch):
+    monkeypatch.setattr(profiler, '_enabled', True)
+    monkeypatch.setattr(profiler, '_local', threading.local())
+    for _ in range(100):
+        profiler._on_sql("SELECT 1")
+    assert profiler._sql_statements() == []
+
+
+def test_sql_inside_timed_call_is_cleared_afterwards(monkeypatch):
+    monkeypatch.setattr(profiler, '_enabled', True)
+    monkeypatch.setattr(profiler, '_local', threading.local())
+    seen = []
+
+    @profiler.timed('test.query')
+    def query():
+        profiler._on_sql("SELECT 1")
+        seen.extend(profiler._sql_statements())
+
+    query()
+    assert seen == ["SELECT 1"]
+    assert profiler._sql_statements() == []
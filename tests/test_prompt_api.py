@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+import cli
+import database
+import prompt_api
+
+
+def write_txt(directory, files):
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, content in files.items():
+        path = directory / f"{name}.txt"
+        path.write_text(content, encoding='utf-8')
+        paths.append(str(path))
+    return paths
+
+
+def test_import_and_export_round_trip(temp_db):
+    files = {f"提示词{i}": f"第 {i} 个：{{{{输入}}}}\n第二行" for i in range(6)}
+    paths = write_txt(temp_db / 'in', files)
+    ids = prompt_api.import_txt_files(paths, workers=3)
+    assert len(ids) == len(files)
+    imported = {p['title']: p['content'] for p in database.get_prompts_with_content(ids)}
+    assert imported == files
+
+    database.add_prompt('a/b:c?', "含有非法字符的标题")
+    assert prompt_api.export_txt_files(str(temp_db / 'out')) == len(files) + 1
+    exported = {path.stem: path.read_text(encoding='utf-8') for path in (temp_db / 'out').iterdir()}
+    assert exported == {**files, 'a_b:c_': "含有非法字符的标题"}
+
+
+def test_import_unreadable_file_imports_nothing(temp_db):
+    paths = write_txt(temp_db / 'in', {'好的': "内容"})
+    with pytest.raises(OSError):
+        prompt_api.import_txt_files(paths + [str(temp_db / 'in' / '不存在.txt')])
+    assert database.get_prompts_with_content() == []
+
+
+def test_render_with_processes_matches_single_process(temp_db):
+    database.add_prompts([(f"模板{i}", f"{{{{名字}}}}你好，第 {i} 个，{{{{未提供}}}}") for i in range(20)])
+    values = {'名字': "小明"}
+    single = prompt_api.render_prompts(values)
+    parallel = prompt_api.render_prompts(values, workers=3)
+    assert parallel == single
+    assert len(single) == 20
+    assert all(rendered.startswith("小明你好") and rendered.endswith("{{未提供}}") for _, _, rendered in single)
+
+
+def test_reembed_records_partial_failures(mock_llm):
+    ids = database.add_prompts((f"提示词{i}", f"内容 {i}") for i in range(30))
+    database.add_prompt("空白", "   ")
+    mock_llm.state.error_rate = 0.3
+    done, failures = prompt_api.reembed_prompts(workers=4, batch_size=7)
+    failed_ids = {prompt_id for prompt_id, _ in failures}
+    assert done and failed_ids
+    assert done + len(failed_ids) == len(ids)
+    for prompt in database.get_prompts_by_ids(ids):
+        has_vector = database.get_prompt_details(prompt['id'])['embedding'] is not None
+        assert has_vector == (prompt['id'] not in failed_ids)
+
+    # 只补生成失败的提示词（空白内容的提示词不会生成向量）
+    mock_llm.state.error_rate = 0
+    done, failures = prompt_api.reembed_prompts(missing_only=True, workers=4)
+    assert (done, failures) == (len(failed_ids), [])
+
+
+def test_cli_db_option_and_render_vars(temp_db, capsys):
+    db_path = temp_db / 'other' / 'library.db'
+    db_path.parent.mkdir()
+    paths = write_txt(temp_db / 'in', {'问候': "{{名字}}说：{{内容}}"})
+    assert cli.main(['--db', str(db_path), 'import', *paths, '--workers', '1']) == 0
+    assert database.DATABASE_PATH == str(db_path)
+    assert db_path.exists()
+    capsys.readouterr()
+
+    assert cli.main(['--db', str(db_path), 'render', '--var', '名字=小明', '--var', '内容=a=b']) == 0
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(row['title'], row['content']) for row in rows] == [('问候', "小明说：a=b")]
+
+    with pytest.raises(SystemExit, match="变量格式错误"):
+        cli.main(['render', '--var', '名字'])
+
+
+def test_cli_reports_errors_with_exit_code(temp_db, capsys):
+    assert cli.main(['migrate-embeddings']) == 1
+    assert "没有进行中的迁移" in capsys.readouterr().err
+    with pytest.raises(SystemExit) as excinfo:
+        cli.main(['render', '--workers', 'many'])
+    assert excinfo.value.code == 2
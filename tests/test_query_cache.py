@@ -0,0 +1,101 @@
+import sqlite3
+
+import pytest
+
+import chunking
+import database
+import query_cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(query_cache.time, 'monotonic', clock)
+    return clock
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = query_cache.LRUCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_put_existing_key_refreshes_recency(clock):
+    cache = query_cache.LRUCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('a', 10)
+    cache.put('c', 3)
+    assert cache.get('a') == 10
+    assert cache.get('b') is None
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = query_cache.LRUCache(maxsize=10, ttl=5)
+    cache.put('a', 1)
+    clock.now += 4.9
+    assert cache.get('a') == 1
+    clock.now += 0.2
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_ttl_counts_from_last_put(clock):
+    cache = query_cache.LRUCache(maxsize=10, ttl=5)
+    cache.put('a', 1)
+    clock.now += 4
+    cache.put('a', 2)
+    clock.now += 4
+    assert cache.get('a') == 2
+
+
+def test_normalize_query():
+    assert query_cache.normalize_query("  Hello\tWORLD \n") == "hello world"
+
+
+def test_library_version_changes_on_any_write(temp_db):
+    before = query_cache.library_version()
+    assert query_cache.library_version() == before
+    # 绕过 database 模块、直接由另一个连接写入，模拟其他进程
+    conn = sqlite3.connect(database.DATABASE_PATH)
+    conn.execute("INSERT INTO tags (name) VALUES ('外部')")
+    conn.commit()
+    conn.close()
+    after = query_cache.library_version()
+    assert after != before
+    database.add_prompt("标题", "内容")
+    assert query_cache.library_version() != after
+
+
+def test_semantic_search_results_invalidated_by_writes(mock_llm):
+    query_cache.clear()
+    model = query_cache.active_embedding_model()
+    for title in ("翻译助手", "代码审查"):
+        prompt_id = database.add_prompt(title, title)
+        embedding, chunks = chunking.embed_content(title, model=model)
+        database.save_prompt_snapshot(prompt_id, title, embedding=embedding, update_embedding=True,
+                                      chunks=chunks, embedding_model=model)
+    first = query_cache.semantic_search("翻译助手")
+    assert query_cache.semantic_search("  翻译助手 ") == first
+    assert mock_llm.state.counts['embeddings'] == 3
+
+    new_id = database.add_prompt("翻译助手", "翻译助手")
+    embedding, chunks = chunking.embed_content("翻译助手", model=model)
+    database.save_prompt_snapshot(new_id, "翻译助手", embedding=embedding, update_embedding=True,
+                                  chunks=chunks, embedding_model=model)
+    assert new_id in query_cache.semantic_search("翻译助手")
+    # 查询向量仍然命中缓存，只有新提示词的内容请求了 API
+    assert mock_llm.state.counts['embeddings'] == 4
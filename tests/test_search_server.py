@@ -0,0 +1,147 @@
+import asyncio
+import json
+import threading
+
+import numpy as np
+import pytest
+
+import database
+import search_server
+
+
+@pytest.fixture
+def server(temp_db):
+    database.add_prompt("第一个提示词", "关于翻译的内容", embedding=np.array([1.0, 0.0, 0.0], dtype=np.float32))
+    database.add_prompt("第二个提示词", "关于摘要的内容", embedding=np.array([0.0, 1.0, 0.0], dtype=np.float32))
+    index = search_server.SearchIndex()
+    index.load()
+    return search_server.SearchServer(index=index)
+
+
+def dispatch(server, method, target, payload=None):
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    return asyncio.run(server.dispatch(method, target, body))
+
+
+def test_semantic_search_uses_vector(server):
+    _, status, payload = dispatch(server, 'POST', '/search', {'vector': [0.1, 0.9, 0.0], 'k': 1})
+    assert status == 200
+    assert [r['title'] for r in payload['results']] == ["第二个提示词"]
+
+
+@pytest.mark.parametrize('body', [b'[1, 2]', b'"text"', b'3', b'null'])
+def test_rejects_non_object_json_body(server, body):
+    _, status, payload = asyncio.run(server.dispatch('POST', '/search', body))
+    assert status == 400
+    assert 'error' in payload
+
+
+@pytest.mark.parametrize('k', [0, -3])
+def test_rejects_non_positive_k(server, k):
+    _, status, _ = dispatch(server, 'POST', '/search', {'q': '翻译', 'mode': 'keyword', 'k': k})
+    assert status == 400
+
+
+@pytest.mark.parametrize('vector', ["abc", [[1.0, 0.0, 0.0]], [], [1.0, 0.0]])
+def test_rejects_malformed_vector(server, vector):
+    _, status, _ = dispatch(server, 'POST', '/search', {'vector': vector})
+    assert status == 400
+
+
+def test_batch_failure_is_reported_on_every_future(server):
+    async def run():
+        batcher = search_server.MicroBatcher(server.index, window=10)
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in range(3)]
+        # 形状不一致的向量让 vstack 失败，所有请求都应该得到异常而不是一直等待
+        batch = [(np.zeros(3, dtype=np.float32), 1, futures[0]),
+                 (np.zeros(2, dtype=np.float32), 1, futures[1]),
+                 (np.zeros(3, dtype=np.float32), 1, futures[2])]
+        await batcher._run_batch(batch)
+        return futures
+
+    futures = asyncio.run(run())
+    assert all(isinstance(f.exception(), ValueError) for f in futures)
+
+
+def test_reload_replaces_snapshot_atomically(server):
+    old = server.index.snapshot
+    database.add_prompt("第三个提示词", "新内容", embedding=np.array([0.0, 0.0, 1.0], dtype=np.float32))
+    assert server.index.needs_reload()
+    server.index.load()
+    new = server.index.snapshot
+    assert new is not old
+    assert len(old.ids) == 2 and len(new.ids) == 3
+    assert new.matrix.shape[0] == len(new.ids)
+    # 进行中的请求仍持有旧快照，旧的全文索引依然可用
+    assert old.fts.execute("SELECT count(*) FROM docs").fetchone()[0] == 2
+
+
+def index_contents(index):
+    snapshot = index.snapshot
+    docs = sorted(snapshot.fts.execute("SELECT rowid, title, content, tags FROM docs").fetchall())
+    chunks = sorted((int(prompt_id), tuple(np.round(row, 5))) for prompt_id, row in zip(snapshot.ids, snapshot.matrix))
+    return docs, chunks
+
+
+def test_refresh_applies_changes_incrementally(server):
+    index = server.index
+    fts = index.snapshot.fts
+    first, second = [row['id'] for row in database.search_prompts('')][::-1]
+    third = database.add_prompt("第三个提示词", "新内容", embedding=np.array([0.0, 0.0, 1.0], dtype=np.float32))
+    database.save_prompt_snapshot(first, "改过的标题", content="改过的内容", tags=["翻译"])
+    database.update_embeddings([(second, np.array([0.5, 0.5, 0.0], dtype=np.float32), [])])
+    database.delete_prompt(third)
+    index.refresh()
+    # 全文索引原地更新，没有整体重建
+    assert index.snapshot.fts is fts
+
+    fresh = search_server.SearchIndex()
+    fresh.load()
+    assert index_contents(index) == index_contents(fresh)
+    assert not index.needs_reload()
+
+    conn = database.get_db_connection()
+    with conn:
+        conn.execute("UPDATE tags SET name = '笔译' WHERE name = '翻译'")
+    conn.close()
+    index.refresh()
+    assert index.get(first)['tags'] == ['笔译']
+
+
+def test_refresh_falls_back_to_full_reload(server, monkeypatch):
+    index = server.index
+    monkeypatch.setattr(search_server, 'RELOAD_MIN_CHANGES', 1)
+    fts = index.snapshot.fts
+    database.add_prompts([(f"新提示词{i}", "内容") for i in range(3)])
+    index.refresh()
+    assert index.snapshot.fts is not fts
+    assert len(index.keyword_search('新提示词', 10)) == 3
+
+
+def test_requests_do_not_wait_for_refresh(server, monkeypatch):
+    index = server.index
+    index.refresh_interval = 0
+    release = threading.Event()
+    prepare_update = index.prepare_update
+
+    def slow_prepare_update():
+        release.wait(10)
+        return prepare_update()
+
+    monkeypatch.setattr(index, 'prepare_update', slow_prepare_update)
+    database.add_prompt("第三个提示词", "新内容")
+
+    async def run():
+        search = {'q': '第三个', 'mode': 'keyword'}
+        # 同步在后台阻塞期间，请求立即用旧快照返回
+        _, status, payload = await asyncio.wait_for(server.dispatch('POST', '/search', json.dumps(search).encode()), 5)
+        assert status == 200 and payload['results'] == []
+        task = server._refresh_task
+        assert task is not None and not task.done()
+        release.set()
+        await asyncio.wait_for(task, 10)
+        _, _, payload = await server.dispatch('POST', '/search', json.dumps(search).encode())
+        return payload['results']
+
+    assert [r['title'] for r in asyncio.run(run())] == ["第三个提示词"]
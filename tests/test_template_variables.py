@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+from template_variables import VariableIndex, find_variables, utf16_offsets
+
+
+def utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def apply_edit(index, old_text, position, removed, inserted):
+    """按 TemplateEditor 的 VariableTracker 的方式更新索引：只重新扫描变化所在的块（行）。
+
+    position、removed 是 Python 下标和字符数；传给索引的位置和增量换算成 UTF-16 单位，与 Qt 一致。
+    """
+    new_text = old_text[:position] + inserted + old_text[position + removed:]
+    delta = utf16_len(inserted) - utf16_len(old_text[position:position + removed])
+    first_start = new_text.rfind('\n', 0, position) + 1
+    last_end = new_text.find('\n', position + len(inserted))
+    # 块的长度包含段落分隔符；最后一个块后面是文档末尾的分隔符
+    last_end = (len(new_text) if last_end == -1 else last_end) + 1
+    start = utf16_len(new_text[:first_start])
+    end = utf16_len(new_text[:last_end - 1]) + 1
+    occurrences = []
+    block_start = first_start
+    for line in new_text[first_start:last_end - 1].split('\n'):
+        occurrences.extend(find_variables(line, utf16_len(new_text[:block_start])))
+        block_start += len(line) + 1
+    index.replace_range(start, end - delta, delta, occurrences)
+    return new_text
+
+
+def assert_matches_rescan(index, text):
+    expected = find_variables(text)
+    assert index.positions == [position for position, _, _ in expected]
+    assert index.names == [name for _, _, name in expected]
+    assert index.variables() == sorted({name for _, _, name in expected})
+    assert all(count > 0 for count in index.counts.values())
+
+
+def make_index(text):
+    index = VariableIndex()
+    index.reset(find_variables(text))
+    return index
+
+
+def test_find_variables_positions_in_utf16():
+    text = "😀{{名字}} 和 {{ 城市 }}"
+    assert find_variables(text) == [(2, 6, '名字'), (11, 8, ' 城市 ')]
+    assert find_variables("前缀 {{a}}", base=100) == [(103, 5, 'a')]
+    assert utf16_offsets("a😀b", [0, 1, 2, 3]) == [0, 1, 3, 4]
+
+
+@pytest.mark.parametrize('old_text, position, removed, inserted', [
+    ("{{a}} {{b}}", 3, 0, "x"),            # 在变量名中插入：{{a}} 变为 {{ax}}
+    ("{{a}} {{b}}", 1, 1, ""),             # 删掉一个括号，变量被拆开
+    ("{{a} {{b}}", 3, 0, "}"),             # 补上括号，两个片段合并成变量
+    ("{{a\n}} {{b}}", 3, 1, ""),           # 删除换行，跨行的片段合并成同一块
+    ("{{a}} {{b}}", 3, 0, "\n"),           # 插入换行，把变量拆到两个块中
+    ("x\n{{a}}\ny\n{{b}}", 2, 6, ""),      # 删除整块
+    ("{{a}}\n{{b}}", 5, 1, "\n{{c}}\n"),   # 在块边界替换
+    ("{{a}}{{a}}{{b}}", 0, 10, ""),        # 同名变量全部删除后不再出现
+    ("{{😀}} {{b}}", 0, 0, "😀"),          # BMP 以外的字符让 UTF-16 位置多平移一位
+])
+def test_edits_match_full_rescan(old_text, position, removed, inserted):
+    index = make_index(old_text)
+    new_text = apply_edit(index, old_text, position, removed, inserted)
+    assert_matches_rescan(index, new_text)
+
+
+def test_replace_range_reports_variable_set_changes():
+    index = make_index("{{a}} {{a}}")
+    assert not index.replace_range(0, 6, 0, [(0, 5, 'a')])
+    assert index.replace_range(0, 6, 0, [(0, 5, 'b')])
+    assert index.variables() == ['a', 'b']
+
+
+PIECES = ["{{", "}}", "{", "}", "a", "b", "名", "😀", "\n", " ", "{{x}}", "{{y}}", "{{名字}}"]
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_random_edits_match_full_rescan(seed):
+    rng = random.Random(seed)
+    text = ''.join(rng.choice(PIECES) for _ in range(rng.randint(0, 60)))
+    index = make_index(text)
+    for _ in range(200):
+        position = rng.randint(0, len(text))
+        removed = rng.randint(0, min(8, len(text) - position))
+        inserted = ''.join(rng.choice(PIECES) for _ in range(rng.randint(0, 3)))
+        text = apply_edit(index, text, position, removed, inserted)
+        assert_matches_rescan(index, text)